@@ -1,20 +1,34 @@
 import os
 import json
+import time
 import uuid
+import collections
 from datetime import datetime, timezone
-from appwrite.client import Client
 from appwrite.services.databases import Databases
-from appwrite.query import Query
 from appwrite.exception import AppwriteException
 from appwrite.permission import Permission
 from appwrite.role import Role
 
+from .appwrite_client import create_client
+from .async_databases import DB_CONCURRENCY, run_keyed
+from .metrics import instrumented, stage
+from .partitions import ASSIGN_TIME_BUDGET_SHARE, assign_missing_partitions, lease_partitions, partition_queries, release_partitions, run_slots
+from .profiling import profiled
+from .queue_worker import drain_queue, requested_max_items
+from .run_lock import wait_for_burst
+from .run_log import leveled_logging
+from .trending import SOURCE_COMMENTS, record_trending_deltas
+from .versioned_writes import update_versioned
+
 # Configuration Constants
 DATABASE_ID = "database"
 ACCOUNTS_COLLECTION_ID = "accounts"
 VIDEO_COUNTS_COLLECTION_ID = "video_counts"
 COMMENTS_INTERACTIONS_COLLECTION_ID = "comments-interactions"
 MAX_COMMENT_LENGTH = 2000
+FUNCTION_TIMEOUT_SECONDS = float(os.environ.get("FUNCTION_TIMEOUT_SECONDS", "15")) # Keep in sync with appwrite.json
+RUN_LOCK_ID = "comments-manager" # Prefix of the partition leases in run_locks, held while a run drains its slots
+COMMENT_ID_NAMESPACE = uuid.UUID('6f1c2b9e-4d0a-5e7b-9c3f-2a8d1e6b7c40') # Comment IDs are uuid5(namespace, interaction ID)
 
 # --- NEW: Helper function to recursively delete a comment and its replies ---
 def delete_comment_recursive(comments_list, comment_id_to_delete, requesting_user_id, context):
@@ -28,7 +42,7 @@ def delete_comment_recursive(comments_list, comment_id_to_delete, requesting_use
     total_deleted_count = 0
 
     if not isinstance(comments_list, list):
-        context.log(f"Warning: Expected list for deletion, got {type(comments_list)}. Returning empty.")
+        context.warning("Expected list for deletion, got %s. Returning empty.", type(comments_list))
         return [], 0
 
     for comment in comments_list:
@@ -47,7 +61,7 @@ def delete_comment_recursive(comments_list, comment_id_to_delete, requesting_use
                 replies_count = len(replies) if isinstance(replies, list) else 0
                 deleted_count = 1 + replies_count
                 total_deleted_count += deleted_count
-                context.log(f"Comment {comment_id_to_delete} owned by {comment_owner_id} identified for deletion. Deleted count for this branch: {deleted_count}")
+                context.debug("Comment %s owned by %s identified for deletion. Deleted count for this branch: %s", comment_id_to_delete, comment_owner_id, deleted_count)
             # Continue to the next comment in the original list
             continue
 
@@ -85,8 +99,278 @@ def add_reply(comments, parent_id, new_reply):
             return True
     return False
 
+def find_comment(comments, comment_id):
+    """True if a comment or reply with this ID is anywhere in the list."""
+    for comment in comments:
+        if comment.get('commentId') == comment_id:
+            return True
+        if isinstance(comment.get('replies'), list) and find_comment(comment['replies'], comment_id):
+            return True
+    return False
+
+def comment_id_for_interaction(interaction_id):
+    return str(uuid.uuid5(COMMENT_ID_NAMESPACE, interaction_id))
+
+def delete_interaction(databases, interaction_id):
+    """Dequeues an interaction. It may already be gone if an earlier attempt deleted it before failing."""
+    try:
+        databases.delete_document(DATABASE_ID, COMMENTS_INTERACTIONS_COLLECTION_ID, interaction_id)
+    except AppwriteException as e:
+        if e.code != 404:
+            raise
+
+def get_user_id_from_permissions(permissions):
+    """Returns the user ID from the creator's update permission, or None."""
+    update_permission_prefix = 'update("user:'
+    for perm in permissions:
+        if perm.startswith(update_permission_prefix):
+            start_index = len(update_permission_prefix)
+            end_index = perm.find('")', start_index)
+            if end_index != -1:
+                return perm[start_index:end_index]
+    return None
+
+def process_create_interaction(databases, interaction_doc, context):
+    """
+    Adds one new comment or reply to the video's commentsJson and deletes the interaction.
+    A retry after a failure between the two finds the comment already added and only dequeues.
+    Returns: 'created', 'existed' (added by an earlier attempt; dequeued only) or 'failed' if the interaction is invalid
+    """
+    interaction_id = interaction_doc["$id"]
+    context.debug("Processing interaction %s...", interaction_id)
+
+    # --- Extract Common Data ---
+    video_id = interaction_doc.get('videoId')
+
+    if not video_id:
+        context.error(f"Missing videoId in interaction {interaction_id}. Skipping.")
+        return 'failed'
+
+    # --- Identify User ID from Permissions ---
+    user_id = get_user_id_from_permissions(interaction_doc.get('$permissions', []))
+
+    if not user_id:
+        context.error(f"Could not determine user ID from permissions on interaction doc {interaction_id}.")
+        return 'failed'
+
+    context.debug("Processing comment by User ID: %s for Video ID: %s", user_id, video_id)
+
+    # --- Fetch User Details ---
+    user_name = "User"
+    user_avatar_url = None
+    try:
+        account_doc = databases.get_document(DATABASE_ID, ACCOUNTS_COLLECTION_ID, user_id)
+        user_name = account_doc.get('name') or user_name
+        user_avatar_url = account_doc.get('profileImageUrl')
+    except AppwriteException as e:
+        if e.code == 404:
+            context.debug("Account details not found for user %s, using default name.", user_id)
+        else:
+            context.warning("Error fetching account details for %s: %s. Using default name.", user_id, e)
+
+    # --- Extract Comment Text and Temporary Client ID ---
+    comment_text = interaction_doc.get('commentText', '')
+    temporary_client_id = interaction_doc.get('temporaryClientId', '')
+    # Extract parent comment ID if it exists for a reply
+    parent_comment_id = interaction_doc.get('parentCommentId')
+
+    # --- Create New Comment Object ---
+    # The ID derives from the interaction's, so a retried interaction finds its comment already added
+    comment_id = comment_id_for_interaction(interaction_id)
+    timestamp_iso = datetime.now(timezone.utc).isoformat()
+    context.debug("Created new comment object with ID: %s", comment_id)
+
+    def build(counts_doc):
+        """Returns the new comment fields for the video_counts document read, or None if the comment is already there."""
+        comments_list = []
+        if counts_doc is None:
+            context.debug("No video_counts document found for %s. Will create.", video_id)
+        else:
+            try:
+                with stage('comments_json'):
+                    comments_list = json.loads(counts_doc.get('commentsJson') or '[]')
+                if not isinstance(comments_list, list):
+                    context.warning("commentsJson for video %s is not a list. Resetting to empty.", video_id)
+                    comments_list = []
+            except json.JSONDecodeError:
+                context.warning("Failed to parse commentsJson for video %s. Resetting to empty.", video_id)
+                comments_list = []
+        if find_comment(comments_list, comment_id):
+            context.debug("Comment %s of interaction %s was already added.", comment_id, interaction_id)
+            return None
+
+        new_comment = {
+            "commentId": comment_id,
+            "userId": user_id,
+            "userName": user_name,
+            "userAvatarUrl": user_avatar_url,
+            "commentText": comment_text,
+            "timestamp": timestamp_iso,
+            "temporaryClientId": temporary_client_id,
+            "replies": []
+        }
+
+        # --- Add Comment to the List ---
+        # Replies go on top-level comments only; anything else is added as a top-level comment
+        is_top_level_parent = bool(parent_comment_id) and any(
+            top_comment.get('commentId') == parent_comment_id for top_comment in comments_list
+        )
+        if parent_comment_id and not is_top_level_parent:
+            context.warning("Parent comment ID %s not found or not top-level.", parent_comment_id)
+        if is_top_level_parent and add_reply(comments_list, parent_comment_id, new_comment):
+            context.debug("Reply added successfully to parent.")
+            comment_kinds.append('replies')
+        else:
+            comments_list.insert(0, new_comment) # Insert at beginning
+            context.debug("Added new top-level comment.")
+            comment_kinds.append('topLevelComments')
+
+        with stage('comments_json'):
+            updated_comments_json = json.dumps(comments_list)
+        return {
+            "commentsJson": updated_comments_json,
+            "commentCount": ((counts_doc or {}).get('commentCount', 0) or 0) + 1
+        }
+
+    # --- Update Video Counts Document ---
+    comment_kinds = [] # What build added on its last attempt
+    context.debug("Updating video_counts document for %s...", video_id)
+    written = update_versioned(
+        databases, VIDEO_COUNTS_COLLECTION_ID, video_id, build,
+        create_data={"likeCount": 0, "dislikeCount": 0}, permissions=[Permission.read(Role.any())]
+    )
+    if written:
+        context.count(comment_kinds[-1])
+        context.debug("Updated video_counts document for %s.", video_id)
+
+    # --- Delete Interaction Document (Common for successful create/delete) ---
+    context.debug("Deleting interaction document %s...", interaction_id)
+    delete_interaction(databases, interaction_id)
+    context.debug("Deleted interaction document %s.", interaction_id)
+    return 'created' if written else 'existed'
+
+def process_delete_interaction(databases, interaction_doc, context):
+    """
+    Removes one comment (and its replies) from the video's commentsJson and deletes the interaction.
+    Returns: 'processed', 'skipped' (comment missing or not owned by the user; dequeued anyway) or 'failed'
+    """
+    interaction_id = interaction_doc["$id"]
+    video_id = interaction_doc.get('videoId')
+    context.debug("Processing DELETE interaction %s", interaction_id)
+
+    # --- Extract data ---
+    user_id = get_user_id_from_permissions(interaction_doc.get('$permissions', []))
+
+    if not user_id:
+        context.error(f"Could not determine user ID from permissions on interaction doc {interaction_id}.")
+        return 'failed'
+
+    comment_id_to_delete = interaction_doc.get('commentIdToDelete')
+
+    if not comment_id_to_delete:
+        context.error(f"Missing commentIdToDelete in DELETE interaction {interaction_id}. Skipping.")
+        return 'failed'
+    # --- Find and Remove Comment (with Auth Check) ---
+    outcomes = [] # Why build wrote nothing, or how many comments it removed, on its last attempt
+
+    def build(counts_doc):
+        """Returns the video_counts fields without the comment, or None if there is nothing to remove."""
+        if counts_doc is None:
+            context.debug("No video_counts document found for %s during delete. Cannot delete comment %s. Skipping.", video_id, comment_id_to_delete)
+            outcomes.append('failed')
+            return None
+        try:
+            with stage('comments_json'):
+                comments_list = json.loads(counts_doc.get('commentsJson') or '[]')
+        except json.JSONDecodeError:
+            context.warning("Failed to parse commentsJson for video %s during delete. Skipping.", video_id)
+            outcomes.append('failed')
+            return None
+        if not isinstance(comments_list, list):
+            context.warning("commentsJson for video %s is not a list during delete. Skipping.", video_id)
+            outcomes.append('failed')
+            return None
+
+        new_comments_list, deleted_count = delete_comment_recursive(comments_list, comment_id_to_delete, user_id, context)
+        if deleted_count == 0: # Check if any comments were actually deleted (implies found and authorized)
+            outcomes.append('skipped')
+            return None
+        outcomes.append(deleted_count)
+        with stage('comments_json'):
+            updated_comments_json = json.dumps(new_comments_list) # Use the NEW list returned by the function
+        return { # Only update comment fields
+            "commentsJson": updated_comments_json,
+            "commentCount": max(0, (counts_doc.get('commentCount', 0) or 0) - deleted_count)
+        }
+
+    # --- Update Video Counts Document ---
+    context.debug("Updating video_counts document for %s after deletion...", video_id)
+    written = update_versioned(databases, VIDEO_COUNTS_COLLECTION_ID, video_id, build)
+    if not written and outcomes[-1] == 'failed':
+        return 'failed'
+    if not written:
+        # Not a failure: could be legitimate (already deleted, e.g. by an earlier attempt) or auth failure. Dequeue it, retrying cannot help.
+        context.debug("Comment %s not found or user %s not authorized. Skipping update for interaction %s.", comment_id_to_delete, user_id, interaction_id)
+        delete_interaction(databases, interaction_id)
+        return 'skipped'
+    context.debug("Updated video_counts document for %s. New count: %s", video_id, written['commentCount'])
+
+    # --- Delete Interaction Document ---
+    context.debug("Deleting interaction document %s...", interaction_id)
+    delete_interaction(databases, interaction_id)
+    context.debug("Deleted interaction document %s.", interaction_id)
+    return 'processed'
+
+def by_video(interaction_doc):
+    return interaction_doc.get('videoId')
+
+def process_interaction_page(databases, interactions, totals, comments_created_by_video, context):
+    """Processes one page of comment interactions. Returns the IDs of the interactions left in the queue."""
+    kept_ids = []
+    # Each interaction rewrites its video's commentsJson, so interactions on one video run in
+    # order while different videos run in parallel. Deletes run after creates, so deleting a
+    # comment created in the same page finds it.
+    create_interactions = [doc for doc in interactions if doc.get('type', 'create') != 'delete'] # Default to 'create' if missing
+    delete_interactions = [doc for doc in interactions if doc.get('type', 'create') == 'delete']
+    context.log(f"Processing {len(create_interactions)} create and {len(delete_interactions)} delete interactions with up to {DB_CONCURRENCY} concurrent database calls...")
+
+    # --- Process CREATE interactions ---
+    with stage('comment_creates'):
+        results = run_keyed(create_interactions, by_video, lambda doc: process_create_interaction(databases, doc, context))
+    for interaction_doc, result in zip(create_interactions, results):
+        if isinstance(result, Exception):
+            context.error(f"Error processing interaction {interaction_doc.get('$id', 'unknown')}: {result}")
+            totals['failed'] += 1
+            kept_ids.append(interaction_doc['$id'])
+        elif result in ('created', 'existed'):
+            totals['processed'] += 1
+            if result == 'created': # A re-delivered interaction's comment was already counted for trending
+                comments_created_by_video[interaction_doc['videoId']] += 1
+        else:
+            totals['failed'] += 1
+            kept_ids.append(interaction_doc['$id'])
+
+    # --- Process DELETE interactions ---
+    with stage('comment_deletes'):
+        results = run_keyed(delete_interactions, by_video, lambda doc: process_delete_interaction(databases, doc, context))
+    for interaction_doc, result in zip(delete_interactions, results):
+        if isinstance(result, Exception):
+            context.error(f"Error processing delete interaction {interaction_doc.get('$id', 'unknown')}: {result}")
+            totals['failed'] += 1
+            kept_ids.append(interaction_doc['$id'])
+        elif result == 'processed':
+            totals['processed'] += 1
+        elif result == 'failed':
+            totals['failed'] += 1
+            kept_ids.append(interaction_doc['$id'])
+    return kept_ids
+
+@instrumented("comments-manager")
+@leveled_logging
+@profiled
 def main(context):
     context.log("--- Comments Manager Batch Job Start ---")
+    started_at = time.monotonic()
 
     # --- Environment Variable Check ---
     api_endpoint = os.environ.get("APPWRITE_FUNCTION_API_ENDPOINT")
@@ -100,325 +384,48 @@ def main(context):
         return context.res.json({"success": False, "message": message}, 500)
 
     # --- Initialize Appwrite Client ---
-    client = Client()
-    client.set_endpoint(api_endpoint).set_project(project_id).set_key(api_key)
+    client = create_client(api_endpoint, project_id, api_key)
     databases = Databases(client)
 
+    leases = {} # Partition slot -> lease token; runs started by queue events coalesce into the holders' runs
+
     try:
-        context.log("Fetching comment interaction documents...")
-        # Fetch documents, limit to 100 per run for performance
-        interaction_response = databases.list_documents(
-            DATABASE_ID,
-            COMMENTS_INTERACTIONS_COLLECTION_ID,
-            [Query.limit(100)]
+        # --- Lease This Run's Partitions of the Queue ---
+        leases = lease_partitions(databases, RUN_LOCK_ID, run_slots(context, 'videoId'), FUNCTION_TIMEOUT_SECONDS)
+        if not leases:
+            context.log("Other runs hold this run's queue partitions and will process the queued comment interactions.")
+            context.log("--- Comments Manager Batch Job End (Coalesced) ---")
+            return context.res.json({"success": True, "message": "Other runs are processing these partitions.", "coalesced": True})
+        wait_for_burst(context)
+        context.log(f"Leased partitions {sorted(leases)}.")
+        with stage('assign_partitions'):
+            assign_missing_partitions(
+                databases, COMMENTS_INTERACTIONS_COLLECTION_ID, 'videoId', context,
+                started_at + FUNCTION_TIMEOUT_SECONDS * ASSIGN_TIME_BUDGET_SHARE
+            )
+
+        totals = collections.Counter() # processed, failed
+        comments_created_by_video = collections.Counter() # Map videoId -> new comments, for trending
+
+        # --- Drain the Queue Page by Page Within the Time Budget ---
+        drain = drain_queue(
+            databases, COMMENTS_INTERACTIONS_COLLECTION_ID,
+            lambda page: process_interaction_page(databases, page, totals, comments_created_by_video, context),
+            context, FUNCTION_TIMEOUT_SECONDS, started_at=started_at,
+            queries=partition_queries(leases), max_items=requested_max_items(context)
         )
-        interactions = interaction_response.get('documents', [])
-        total_fetched = len(interactions)
-        context.log(f"Fetched {total_fetched} comment interactions to process.")
+        total_fetched = drain['fetched']
+        context.log(f"Fetched {total_fetched} comment interactions in {drain['pages']} pages. Backlog remaining: {drain['backlogRemaining']}.")
 
         if total_fetched == 0:
             context.log("No comment interactions to process.")
             context.log("--- Comments Manager Batch Job End (No Work) ---")
             return context.res.json({"success": True, "message": "No comment interactions found."})
 
-        processed_count = 0
-        failed_count = 0
-
-        # --- Process each interaction ---
-        for interaction_doc in interactions:
-            try:
-                interaction_id = interaction_doc["$id"]
-                context.log(f"Processing interaction {interaction_id}...")
-
-                # --- Extract Common Data ---
-                video_id = interaction_doc.get('videoId')
-                interaction_type = interaction_doc.get('type', 'create') # Default to 'create' if missing
-
-                if not video_id:
-                    context.error(f"Missing videoId in interaction {interaction_id}. Skipping.")
-                    failed_count += 1
-                    continue
-
-                # --- Identify User ID from Permissions ---
-                user_id = None
-                doc_permissions = interaction_doc.get('$permissions', [])
-                
-                # Look for update permission to determine the creator
-                update_permission_prefix = 'update("user:'
-                for perm in doc_permissions:
-                    if perm.startswith(update_permission_prefix):
-                        start_index = len(update_permission_prefix)
-                        end_index = perm.find('")', start_index)
-                        if end_index != -1:
-                            user_id = perm[start_index:end_index]
-                            break # Found the user ID
-
-                if not user_id:
-                    context.error(f"Could not determine user ID from permissions on interaction doc {interaction_id}.")
-                    failed_count += 1
-                    continue
-
-                context.log(f"Processing comment by User ID: {user_id} for Video ID: {video_id}")
-
-                # --- Fetch User Details ---
-                user_name = "User"
-                user_avatar_url = None
-                try:
-                    account_doc = databases.get_document(DATABASE_ID, ACCOUNTS_COLLECTION_ID, user_id)
-                    user_name = account_doc.get('name') or user_name
-                    user_avatar_url = account_doc.get('profileImageUrl')
-                except AppwriteException as e:
-                    if e.code == 404:
-                        context.log(f"Account details not found for user {user_id}, using default name.")
-                    else:
-                        context.log(f"Warning: Error fetching account details for {user_id}: {e}. Using default name.")
-
-                # --- Fetch/Initialize Video Counts Document ---
-                comments_list = []
-                current_comment_count = 0
-                current_like_count = 0
-                current_dislike_count = 0
-                create_counts_doc = False
-                
-                # Extract parent comment ID if it exists for a reply
-                parent_comment_id = interaction_doc.get('parentCommentId')
-                # Check if parent comment is valid if one was provided
-                has_parent_comment_id = bool(parent_comment_id)
-                is_top_level_parent = False
-                
-                try:
-                    context.log(f"Fetching video_counts document for video {video_id}...")
-                    counts_doc = databases.get_document(DATABASE_ID, VIDEO_COUNTS_COLLECTION_ID, video_id)
-                    comments_json_string = counts_doc.get('commentsJson') or '[]'
-                    current_comment_count = counts_doc.get('commentCount', 0) or 0
-                    current_like_count = counts_doc.get('likeCount', 0) or 0
-                    current_dislike_count = counts_doc.get('dislikeCount', 0) or 0
-
-                    try:
-                        comments_list = json.loads(comments_json_string)
-                        if not isinstance(comments_list, list):
-                            context.log(f"Warning: commentsJson for video {video_id} is not a list. Resetting to empty.")
-                            comments_list = []
-                        
-                        # Validate parent comment ID if needed
-                        if has_parent_comment_id:
-                            # Check if it exists as a top-level comment
-                            for top_comment in comments_list:
-                                if top_comment.get('commentId') == parent_comment_id:
-                                    is_top_level_parent = True
-                                    break
-                            
-                            if not is_top_level_parent:
-                                context.log(f"Error: Parent comment ID {parent_comment_id} not found or not top-level.")
-                                # Handle as a top-level comment instead
-                                parent_comment_id = None
-                                has_parent_comment_id = False
-                    except json.JSONDecodeError:
-                        context.log(f"Warning: Failed to parse commentsJson for video {video_id}. Resetting to empty.")
-                        comments_list = []
-                        # Reset parent comment reference if JSON is invalid
-                        parent_comment_id = None
-                        has_parent_comment_id = False
-                        
-                except AppwriteException as e:
-                    if e.code == 404:
-                        context.log(f"No video_counts document found for {video_id}. Will create.")
-                        create_counts_doc = True
-                        comments_list = []
-                        current_comment_count = 0
-                        current_like_count = 0
-                        current_dislike_count = 0
-                        # Cannot have a parent comment if there's no document
-                        parent_comment_id = None
-                        has_parent_comment_id = False
-                    else:
-                        raise Exception(f"Error fetching video_counts doc for {video_id}: {e}")
-
-                # --- Extract Comment Text and Temporary Client ID ---
-                comment_text = interaction_doc.get('commentText', '')
-                temporary_client_id = interaction_doc.get('temporaryClientId', '')
-                
-                # --- Create New Comment Object ---
-                comment_id = str(uuid.uuid4())
-                timestamp_iso = datetime.now(timezone.utc).isoformat()
-                new_comment = {
-                    "commentId": comment_id,
-                    "userId": user_id,
-                    "userName": user_name,
-                    "userAvatarUrl": user_avatar_url,
-                    "commentText": comment_text,
-                    "timestamp": timestamp_iso,
-                    "temporaryClientId": temporary_client_id,
-                    "replies": []
-                }
-                context.log(f"Created new comment object with ID: {comment_id}")
-
-                # --- Add Comment to the List ---
-                reply_added = False
-                if has_parent_comment_id:
-                    context.log(f"Attempting to add reply to parent: {parent_comment_id}")
-                    reply_added = add_reply(comments_list, parent_comment_id, new_comment)
-                    if not reply_added:
-                        context.log(f"Warning: Parent comment {parent_comment_id} not found. Adding as top-level comment.")
-                        comments_list.insert(0, new_comment)
-                    else:
-                        context.log("Reply added successfully to parent.")
-                else:
-                    comments_list.insert(0, new_comment) # Insert at beginning
-                    context.log("Added new top-level comment.")
-
-                # --- Update Video Counts Document ---
-                new_comment_count = current_comment_count + 1
-                updated_comments_json = json.dumps(comments_list)
-                
-                update_data = {
-                    "commentsJson": updated_comments_json,
-                    "commentCount": new_comment_count,
-                    "likeCount": current_like_count,
-                    "dislikeCount": current_dislike_count
-                }
-
-                if create_counts_doc:
-                    context.log(f"Creating video_counts document for {video_id}...")
-                    databases.create_document(
-                        database_id=DATABASE_ID,
-                        collection_id=VIDEO_COUNTS_COLLECTION_ID,
-                        document_id=video_id,
-                        data=update_data,
-                        permissions=[Permission.read(Role.any())]
-                    )
-                    context.log(f"Created video_counts document for {video_id}.")
-                else:
-                    context.log(f"Updating video_counts document for {video_id}...")
-                    databases.update_document(
-                        database_id=DATABASE_ID,
-                        collection_id=VIDEO_COUNTS_COLLECTION_ID,
-                        document_id=video_id,
-                        data={
-                            "commentsJson": updated_comments_json,
-                            "commentCount": new_comment_count
-                        }
-                    )
-                    context.log(f"Updated video_counts document for {video_id}.")
-                
-                # --- Delete Interaction Document (Common for successful create/delete) ---
-                context.log(f"Deleting interaction document {interaction_id}...")
-                databases.delete_document(
-                    DATABASE_ID,
-                    COMMENTS_INTERACTIONS_COLLECTION_ID,
-                    interaction_id
-                )
-                context.log(f"Deleted interaction document {interaction_id}.")
-                
-                processed_count += 1
-
-            except Exception as e:
-                context.error(f"Error processing interaction {interaction_doc.get('$id', 'unknown')}: {e}")
-                failed_count += 1
-            
-        # Process DELETE interactions
-        for interaction_doc in interactions:
-            try:
-                interaction_id = interaction_doc["$id"]
-                interaction_type = interaction_doc.get('type', 'create')
-                video_id = interaction_doc.get('videoId')
-                
-                # Skip if not a delete interaction
-                if interaction_type != 'delete':
-                    continue
-                    
-                context.log(f"Processing DELETE interaction {interaction_id}")
-                
-                # --- Extract data ---
-                user_id = None
-                doc_permissions = interaction_doc.get('$permissions', [])
-                update_permission_prefix = 'update("user:'
-                for perm in doc_permissions:
-                    if perm.startswith(update_permission_prefix):
-                        start_index = len(update_permission_prefix)
-                        end_index = perm.find('")', start_index)
-                        if end_index != -1:
-                            user_id = perm[start_index:end_index]
-                            break
-                            
-                if not user_id:
-                    context.error(f"Could not determine user ID from permissions on interaction doc {interaction_id}.")
-                    failed_count += 1
-                    continue
-                
-                comment_id_to_delete = interaction_doc.get('commentIdToDelete')
-
-                if not comment_id_to_delete:
-                    context.error(f"Missing commentIdToDelete in DELETE interaction {interaction_id}. Skipping.")
-                    failed_count += 1
-                    continue
-                # --- Fetch Video Counts Document ---
-                comments_list = []
-                current_comment_count = 0
-                
-                try:
-                    counts_doc = databases.get_document(DATABASE_ID, VIDEO_COUNTS_COLLECTION_ID, video_id)
-                    comments_json_string = counts_doc.get('commentsJson') or '[]'
-                    current_comment_count = counts_doc.get('commentCount', 0) or 0
-
-                    try:
-                        comments_list = json.loads(comments_json_string)
-                        if not isinstance(comments_list, list):
-                            context.log(f"Warning: commentsJson for video {video_id} is not a list during delete. Skipping.")
-                            failed_count += 1
-                            continue
-                    except json.JSONDecodeError:
-                        context.log(f"Warning: Failed to parse commentsJson for video {video_id} during delete. Skipping.")
-                        failed_count += 1
-                        continue
-                        
-                except AppwriteException as e:
-                    if e.code == 404:
-                        context.log(f"No video_counts document found for {video_id} during delete. Cannot delete comment {comment_id_to_delete}. Skipping.")
-                        failed_count += 1
-                        continue
-                    else:
-                        context.error(f"Error fetching video_counts doc for {video_id} during delete: {e}. Skipping.")
-                        failed_count += 1
-                        continue
-                # --- Find and Remove Comment (with Auth Check) ---
-                # Call the refactored function - it returns the new list and count
-                new_comments_list, deleted_count = delete_comment_recursive(comments_list, comment_id_to_delete, user_id, context)
-
-                if deleted_count == 0: # Check if any comments were actually deleted (implies found and authorized)
-                    context.log(f"Comment {comment_id_to_delete} not found or user {user_id} not authorized. Skipping update for interaction {interaction_id}.")
-                    # Don't increment failed_count here, could be legitimate (already deleted) or auth failure
-                else:
-                    # --- Update Video Counts Document ---
-                    new_comment_count = max(0, current_comment_count - deleted_count)
-                    updated_comments_json = json.dumps(new_comments_list) # Use the NEW list returned by the function
-                    
-                    context.log(f"Updating video_counts document for {video_id} after deletion...")
-                    databases.update_document(
-                        database_id=DATABASE_ID,
-                        collection_id=VIDEO_COUNTS_COLLECTION_ID,
-                        document_id=video_id,
-                        data={ # Only update comment fields
-                            "commentsJson": updated_comments_json,
-                            "commentCount": new_comment_count
-                        }
-                    )
-                    context.log(f"Updated video_counts document for {video_id}. New count: {new_comment_count}")
-                    
-                    # --- Delete Interaction Document ---
-                    context.log(f"Deleting interaction document {interaction_id}...")
-                    databases.delete_document(
-                        DATABASE_ID,
-                        COMMENTS_INTERACTIONS_COLLECTION_ID,
-                        interaction_id
-                    )
-                    context.log(f"Deleted interaction document {interaction_id}.")
-                    
-                    processed_count += 1
-                    
-            except Exception as e:
-                context.error(f"Error processing delete interaction {interaction_doc.get('$id', 'unknown')}: {e}")
-                failed_count += 1
+        with stage('trending'):
+            record_trending_deltas(databases, SOURCE_COMMENTS, dict(comments_created_by_video), context)
+        processed_count = totals['processed']
+        failed_count = totals['failed']
 
         # --- Summary ---
         context.log(f"Processed {processed_count} comment interactions, {failed_count} failed.")
@@ -427,10 +434,15 @@ def main(context):
             "success": True,
             "processed": processed_count, 
             "failed": failed_count,
-            "total": total_fetched
+            "total": total_fetched,
+            "pages": drain['pages'],
+            "backlogRemaining": drain['backlogRemaining'],
+            "drained": drain['drained']
         })
 
     except Exception as e:
         context.error(f"Unexpected error in Comments Manager: {e}")
         context.log("--- Comments Manager Batch Job End (Error) ---")
         return context.res.json({"success": False, "message": str(e)}, 500)
+    finally:
+        release_partitions(databases, leases)
@@ -0,0 +1,116 @@
+from appwrite.services.databases import Databases
+from appwrite.exception import AppwriteException
+from appwrite.query import Query
+import os
+import traceback
+import collections
+
+from .appwrite_client import create_client
+from .counter_journal import purge_finished_entries
+from .metrics import instrumented, stage
+from .profiling import profiled
+from .video_counters import (
+    DATABASE_ID,
+    VIDEO_COUNTS_COLLECTION_ID,
+    compact_video_shards,
+    list_shard_documents,
+)
+
+# Configuration Constants
+PAGE_SIZE = 100
+QUEUE_COLLECTION_BY_JOURNAL_SOURCE = {
+    'likes': "video_interactions",
+    'subscriptions': "account_interactions",
+    'views': "pending_views"
+}
+
+def list_sharded_video_ids(databases):
+    """Pages through video_counts documents currently in sharded mode."""
+    video_ids = []
+    cursor = None
+    while True:
+        queries = [Query.greater_than('shardCount', 0), Query.limit(PAGE_SIZE)]
+        if cursor:
+            queries.append(Query.cursor_after(cursor))
+        documents = databases.list_documents(DATABASE_ID, VIDEO_COUNTS_COLLECTION_ID, queries).get('documents', [])
+        video_ids.extend(doc['$id'] for doc in documents)
+        if len(documents) < PAGE_SIZE:
+            return video_ids
+        cursor = documents[-1]['$id']
+
+@instrumented("counts-compactor")
+@profiled
+def main(context):
+    context.log("--- Counts Compactor Function Start ---")
+
+    # --- Environment & Auth Check ---
+    api_endpoint = os.environ.get("APPWRITE_FUNCTION_API_ENDPOINT")
+    project_id = os.environ.get("APPWRITE_FUNCTION_PROJECT_ID")
+    api_key = context.req.headers.get('x-appwrite-key')
+
+    if not all([api_endpoint, project_id, api_key]):
+        message = "Function configuration error: Missing endpoint, project ID, or API key."
+        context.error(message)
+        return context.res.json({"success": False, "message": message}, 500)
+
+    # --- Initialize Appwrite Client ---
+    client = create_client(api_endpoint, project_id, api_key)
+    databases = Databases(client)
+
+    compacted_videos = 0
+    folded_shards = 0
+    demoted_videos = 0
+    failed_videos = 0
+
+    try:
+        # --- Group Shard Documents by Video ---
+        # Shards of demoted videos can still receive late deltas, so every shard is scanned
+        with stage('scan_shards'):
+            shards_by_video = collections.defaultdict(list)
+            for shard_doc in list_shard_documents(databases, page_size=PAGE_SIZE):
+                shards_by_video[shard_doc['videoId']].append(shard_doc)
+
+            # Sharded videos without shard documents still need a compaction pass to be demoted
+            for video_id in list_sharded_video_ids(databases):
+                shards_by_video.setdefault(video_id, [])
+
+        context.log(f"Compacting counters for {len(shards_by_video)} videos.")
+
+        # --- Fold Shards into video_counts ---
+        for video_id, shard_docs in shards_by_video.items():
+            try:
+                with stage('fold_shards'):
+                    folded, demoted = compact_video_shards(databases, video_id, shard_docs, context)
+                compacted_videos += 1
+                folded_shards += folded
+                if demoted:
+                    demoted_videos += 1
+            except AppwriteException as e:
+                context.error(f"Failed to compact counters for video {video_id}: {e}")
+                failed_videos += 1
+            except Exception as e:
+                context.error(f"Unexpected error compacting counters for video {video_id}: {e}")
+                context.error(traceback.format_exc())
+                failed_videos += 1
+
+        # --- Purge Finished Journal Entries ---
+        with stage('purge'):
+            purged_journal_entries = purge_finished_entries(databases, QUEUE_COLLECTION_BY_JOURNAL_SOURCE)
+
+        context.log(f"Compaction finished. Videos: {compacted_videos}, Shards folded: {folded_shards}, Demoted: {demoted_videos}, Failed: {failed_videos}")
+        context.log(f"Purged {purged_journal_entries} journal entries.")
+        return context.res.json({
+            "success": True,
+            "compactedVideos": compacted_videos,
+            "foldedShards": folded_shards,
+            "demotedVideos": demoted_videos,
+            "failedVideos": failed_videos,
+            "purgedJournalEntries": purged_journal_entries
+        })
+
+    except Exception as e:
+        context.error(f"An unexpected error occurred during compaction: {e}")
+        context.error(traceback.format_exc())
+        return context.res.json({"success": False, "message": f"Unexpected Error: {str(e)}"}, 500)
+    finally:
+        context.log("--- Counts Compactor Function End ---")
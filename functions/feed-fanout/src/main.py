@@ -0,0 +1,213 @@
+from appwrite.services.databases import Databases
+from appwrite.exception import AppwriteException
+from appwrite.permission import Permission
+from appwrite.role import Role
+from appwrite.query import Query
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+import traceback
+
+from .appwrite_client import create_client
+from .metrics import instrumented, stage
+from .profiling import profiled
+from .versioned_writes import update_versioned, VersionConflictError
+
+# Configuration Constants
+DATABASE_ID = "database"
+FEED_FANOUT_JOBS_COLLECTION_ID = "feed_fanout_jobs"
+CHANNEL_SUBSCRIBERS_COLLECTION_ID = "channel_subscribers"
+CHANNEL_STATS_COLLECTION_ID = "channel_stats"
+SUBSCRIPTION_FEEDS_COLLECTION_ID = "subscription_feeds"
+MAX_JOBS_PER_RUN = 10
+INDEX_PAGES_PER_REQUEST = 25 # Reverse index page documents listed per request
+FEED_CAPACITY = int(os.environ.get("FEED_CAPACITY", "200")) # Video ids kept per feed, newest first
+# Creators with more subscribers are not fanned out; clients merge their uploads on read
+FANOUT_MAX_SUBSCRIBERS = int(os.environ.get("FANOUT_MAX_SUBSCRIBERS", "10000"))
+FANOUT_CONCURRENCY = int(os.environ.get("FANOUT_CONCURRENCY", "8")) # Parallel feed writes
+TIME_BUDGET_SECONDS = float(os.environ.get("TIME_BUDGET_SECONDS", "240")) # Stop starting new shards after this long
+
+def get_subscriber_count(databases, creator_id):
+    """
+    Returns: A tuple (subscriberCount, channel_stats document or None)
+    """
+    try:
+        stats_doc = databases.get_document(DATABASE_ID, CHANNEL_STATS_COLLECTION_ID, creator_id)
+        return stats_doc.get('subscriberCount', 0) or 0, stats_doc
+    except AppwriteException as e:
+        if e.code == 404:
+            return 0, None
+        raise
+
+def push_to_feed(databases, user_id, video_id):
+    """
+    Prepends a video id to a user's feed, dropping the oldest ids beyond FEED_CAPACITY.
+    Raises: VersionConflictError if the feed kept changing under the write; AppwriteException on database errors
+    """
+    def build(feed_doc):
+        video_ids = (feed_doc or {}).get('videoIds', []) or []
+        if video_id in video_ids: # Already delivered by an earlier, interrupted run
+            return None
+        return {'videoIds': ([video_id] + video_ids)[:FEED_CAPACITY]}
+
+    update_versioned(
+        databases, SUBSCRIPTION_FEEDS_COLLECTION_ID, user_id, build,
+        permissions=[Permission.read(Role.user(user_id))]
+    )
+
+def fan_out_shard(databases, executor, shard_doc, video_id, context):
+    """
+    Pushes a video into the feed of every subscriber in one reverse index page.
+    Returns: A tuple (feeds_written, failed_count)
+    """
+    subscriber_ids = shard_doc.get('subscriberIds', []) or []
+
+    def push(subscriber_id):
+        try:
+            push_to_feed(databases, subscriber_id, video_id)
+            return True
+        except (AppwriteException, VersionConflictError) as e:
+            context.error(f"Failed to push video {video_id} to the feed of {subscriber_id}: {e}")
+            return False
+
+    results = list(executor.map(push, subscriber_ids))
+    return results.count(True), results.count(False)
+
+@instrumented("feed-fanout")
+@profiled
+def main(context):
+    context.log("--- Feed Fan-out Start ---")
+    started_at = time.monotonic()
+
+    # --- Environment & Auth Check ---
+    api_endpoint = os.environ.get("APPWRITE_FUNCTION_API_ENDPOINT")
+    project_id = os.environ.get("APPWRITE_FUNCTION_PROJECT_ID")
+    api_key = context.req.headers.get('x-appwrite-key')
+
+    if not all([api_endpoint, project_id, api_key]):
+        message = "Function configuration error: Missing endpoint, project ID, or API key."
+        context.error(message)
+        return context.res.json({"success": False, "message": message}, 500)
+
+    # --- Initialize Appwrite Client ---
+    client = create_client(api_endpoint, project_id, api_key)
+    databases = Databases(client)
+
+    jobs_completed = 0
+    jobs_resumable = 0
+    jobs_retrying = 0
+    merge_on_read_jobs = 0
+    feeds_written = 0
+    failed_count = 0
+
+    try:
+        # --- Fetch Oldest Fan-out Jobs ---
+        with stage('fetch_jobs'):
+            job_docs = databases.list_documents(
+                DATABASE_ID,
+                FEED_FANOUT_JOBS_COLLECTION_ID,
+                [Query.order_asc('$createdAt'), Query.limit(MAX_JOBS_PER_RUN)]
+            ).get('documents', [])
+        context.log(f"Found {len(job_docs)} fan-out jobs.")
+
+        with ThreadPoolExecutor(max_workers=FANOUT_CONCURRENCY) as executor:
+            for job_doc in job_docs:
+                if time.monotonic() - started_at >= TIME_BUDGET_SECONDS:
+                    context.log("Time budget reached. Remaining jobs are left for the next run.")
+                    break
+
+                job_id = job_doc['$id']
+                video_id = job_doc.get('videoId')
+                creator_id = job_doc.get('creatorId')
+                next_shard = job_doc.get('nextShard', 0) or 0
+                next_page = job_doc.get('nextPage', 0) or 0
+
+                try:
+                    # --- Large Creators Fall Back to Merge-on-Read ---
+                    with stage('subscriber_count'):
+                        subscriber_count, stats_doc = get_subscriber_count(databases, creator_id)
+                    merge_on_read = subscriber_count > FANOUT_MAX_SUBSCRIBERS
+                    if stats_doc and bool(stats_doc.get('mergeOnRead')) != merge_on_read:
+                        databases.update_document(DATABASE_ID, CHANNEL_STATS_COLLECTION_ID, creator_id, {'mergeOnRead': merge_on_read})
+                        context.log(f"Channel {creator_id} ({subscriber_count} subscribers) switched to {'merge-on-read' if merge_on_read else 'fan-out'}.")
+                    if merge_on_read:
+                        databases.delete_document(DATABASE_ID, FEED_FANOUT_JOBS_COLLECTION_ID, job_id)
+                        merge_on_read_jobs += 1
+                        continue
+
+                    # --- Push Into Subscriber Feeds One Reverse Index Page at a Time ---
+                    # Shards are split into pages (subscription_edges.py); a paused job resumes at its (nextShard, nextPage)
+                    interrupted = False
+                    retry_from = None # (shard, page) of the first page with a failed push
+                    cursor = None
+                    while not interrupted:
+                        queries = [
+                            Query.equal('creatorId', creator_id),
+                            Query.greater_than_equal('shard', next_shard),
+                            Query.order_asc('shard'),
+                            Query.order_asc('page'),
+                            Query.limit(INDEX_PAGES_PER_REQUEST)
+                        ]
+                        if cursor:
+                            queries.append(Query.cursor_after(cursor))
+                        page_docs = databases.list_documents(DATABASE_ID, CHANNEL_SUBSCRIBERS_COLLECTION_ID, queries).get('documents', [])
+
+                        for page_doc in page_docs:
+                            shard, page = page_doc.get('shard', 0) or 0, page_doc.get('page', 0) or 0
+                            if shard == next_shard and page < next_page: # Done before the job was paused
+                                continue
+                            if time.monotonic() - started_at >= TIME_BUDGET_SECONDS:
+                                next_shard, next_page = shard, page
+                                interrupted = True
+                                break
+                            with stage('fan_out_shards'):
+                                written, failed = fan_out_shard(databases, executor, page_doc, video_id, context)
+                            feeds_written += written
+                            failed_count += failed
+                            if failed and retry_from is None:
+                                retry_from = (shard, page)
+
+                        if len(page_docs) < INDEX_PAGES_PER_REQUEST:
+                            break
+                        cursor = page_docs[-1]['$id']
+
+                    if interrupted:
+                        # Save progress so the next run resumes at the first unfinished page
+                        next_shard, next_page = retry_from or (next_shard, next_page)
+                        databases.update_document(DATABASE_ID, FEED_FANOUT_JOBS_COLLECTION_ID, job_id, {'nextShard': next_shard, 'nextPage': next_page})
+                        context.log(f"Fan-out of video {video_id} paused before page {next_page} of shard {next_shard}.")
+                        jobs_resumable += 1
+                        break
+
+                    if retry_from:
+                        # Keep the job and resume at the first page with a failed push; pushes are idempotent,
+                        # so the feeds already written on and after that page are only read again
+                        next_shard, next_page = retry_from
+                        databases.update_document(DATABASE_ID, FEED_FANOUT_JOBS_COLLECTION_ID, job_id, {'nextShard': next_shard, 'nextPage': next_page})
+                        context.log(f"Fan-out of video {video_id} will retry from page {next_page} of shard {next_shard}.")
+                        jobs_retrying += 1
+                        continue
+
+                    databases.delete_document(DATABASE_ID, FEED_FANOUT_JOBS_COLLECTION_ID, job_id)
+                    jobs_completed += 1
+                except AppwriteException as e:
+                    context.error(f"Failed to fan out video {video_id} of creator {creator_id}: {e}")
+                    failed_count += 1
+
+        context.log(f"Fan-out finished. Jobs completed: {jobs_completed}, Merge-on-read: {merge_on_read_jobs}, Resumable: {jobs_resumable}, Retrying: {jobs_retrying}, Feeds written: {feeds_written}, Failed: {failed_count}")
+        return context.res.json({
+            "success": True,
+            "jobsCompleted": jobs_completed,
+            "mergeOnReadJobs": merge_on_read_jobs,
+            "jobsResumable": jobs_resumable,
+            "jobsRetrying": jobs_retrying,
+            "feedsWritten": feeds_written,
+            "failed": failed_count
+        })
+
+    except Exception as e:
+        context.error(f"An unexpected error occurred during fan-out: {e}")
+        context.error(traceback.format_exc())
+        return context.res.json({"success": False, "message": f"Unexpected Error: {str(e)}"}, 500)
+    finally:
+        context.log("--- Feed Fan-out End ---")
@@ -0,0 +1,189 @@
+from appwrite.services.databases import Databases
+from appwrite.exception import AppwriteException
+from appwrite.query import Query
+import os
+import time
+import traceback
+
+from .appwrite_client import create_client
+from .metrics import instrumented, stage
+from .profiling import profiled
+
+# Configuration Constants
+DATABASE_ID = "database"
+ACCOUNTS_COLLECTION_ID = "accounts"
+USER_VIDEO_STATES_COLLECTION_ID = "user_video_states"
+PROJECTION_MARKS_COLLECTION_ID = "projection_marks" # One document per user, touchedAt set by likes-manager
+JOB_CHECKPOINTS_COLLECTION_ID = "job_checkpoints"
+CHECKPOINT_ID = "liked-videos-projector"
+MARKS_PAGE_SIZE = 100 # Users per page; also the number of userIds in one states query
+STATES_PAGE_SIZE = 100
+# Marks younger than this are left for the next run, so a mark written just before the watermark
+# moves cannot become visible behind it
+MARK_SETTLE_SECONDS = 60
+TIME_BUDGET_SECONDS = float(os.environ.get("TIME_BUDGET_SECONDS", "90")) # Stop paging after this long
+
+def load_checkpoint(databases):
+    """Returns the touchedAt watermark saved by the previous run, or 0 to start from the first mark."""
+    try:
+        checkpoint_doc = databases.get_document(DATABASE_ID, JOB_CHECKPOINTS_COLLECTION_ID, CHECKPOINT_ID)
+        return float(checkpoint_doc.get('cursor') or 0)
+    except ValueError: # An accounts cursor saved by the full scan this function used to run
+        return 0.0
+    except AppwriteException as e:
+        if e.code == 404:
+            return 0.0
+        raise
+
+def save_checkpoint(databases, watermark):
+    data = {'cursor': repr(watermark)}
+    try:
+        databases.update_document(DATABASE_ID, JOB_CHECKPOINTS_COLLECTION_ID, CHECKPOINT_ID, data)
+    except AppwriteException as e:
+        if e.code != 404:
+            raise
+        databases.create_document(DATABASE_ID, JOB_CHECKPOINTS_COLLECTION_ID, CHECKPOINT_ID, data)
+
+def fetch_states_by_user(databases, user_ids):
+    """
+    Fetches the liked/disliked states of a page of users with paged IN queries.
+    Returns: A dict userId -> {'liked': set(videoIds), 'disliked': set(videoIds)}
+    """
+    states_by_user = {user_id: {'liked': set(), 'disliked': set()} for user_id in user_ids}
+    cursor = None
+    while True:
+        queries = [Query.equal('userId', user_ids), Query.limit(STATES_PAGE_SIZE)]
+        if cursor:
+            queries.append(Query.cursor_after(cursor))
+        state_docs = databases.list_documents(DATABASE_ID, USER_VIDEO_STATES_COLLECTION_ID, queries).get('documents', [])
+        for state_doc in state_docs:
+            user_states = states_by_user.get(state_doc.get('userId'))
+            state = state_doc.get('state')
+            if user_states is not None and state in ('liked', 'disliked'):
+                user_states[state].add(state_doc.get('videoId'))
+        if len(state_docs) < STATES_PAGE_SIZE:
+            return states_by_user
+        cursor = state_docs[-1]['$id']
+
+def project_list(current_list, expected_set):
+    """Keeps the existing order for ids that are still valid and appends the missing ones."""
+    kept = [video_id for video_id in current_list if video_id in expected_set]
+    kept_set = set(kept)
+    return kept + sorted(expected_set - kept_set)
+
+@instrumented("liked-videos-projector")
+@profiled
+def main(context):
+    context.log("--- Liked Videos Projector Start ---")
+    started_at = time.monotonic()
+
+    # --- Environment & Auth Check ---
+    api_endpoint = os.environ.get("APPWRITE_FUNCTION_API_ENDPOINT")
+    project_id = os.environ.get("APPWRITE_FUNCTION_PROJECT_ID")
+    api_key = context.req.headers.get('x-appwrite-key')
+
+    if not all([api_endpoint, project_id, api_key]):
+        message = "Function configuration error: Missing endpoint, project ID, or API key."
+        context.error(message)
+        return context.res.json({"success": False, "message": message}, 500)
+
+    # --- Initialize Appwrite Client ---
+    client = create_client(api_endpoint, project_id, api_key)
+    databases = Databases(client)
+
+    accounts_scanned = 0
+    accounts_updated = 0
+    failed_count = 0
+    caught_up = False
+
+    try:
+        watermark = load_checkpoint(databases)
+        settled_before = time.time() - MARK_SETTLE_SECONDS
+        context.log(f"Projecting users touched since {watermark}.")
+
+        # --- Page Through Users Touched Since the Watermark Until Caught Up or the Budget Runs Out ---
+        # The watermark itself is included: a tie with the last mark of the previous run is projected again
+        cursor = None
+        while time.monotonic() - started_at < TIME_BUDGET_SECONDS:
+            queries = [
+                Query.greater_than_equal('touchedAt', watermark),
+                Query.less_than('touchedAt', settled_before),
+                Query.order_asc('touchedAt'),
+                Query.limit(MARKS_PAGE_SIZE)
+            ]
+            if cursor:
+                queries.append(Query.cursor_after(cursor))
+            with stage('marks_page'):
+                mark_docs = databases.list_documents(DATABASE_ID, PROJECTION_MARKS_COLLECTION_ID, queries).get('documents', [])
+            user_ids = [doc['$id'] for doc in mark_docs]
+
+            account_docs_by_id = {}
+            states_by_user = {}
+            if user_ids:
+                with stage('accounts_page'):
+                    account_docs = databases.list_documents(
+                        DATABASE_ID, ACCOUNTS_COLLECTION_ID,
+                        [Query.equal('$id', user_ids), Query.limit(len(user_ids))]
+                    ).get('documents', [])
+                account_docs_by_id = {doc['$id']: doc for doc in account_docs}
+                with stage('user_video_states'):
+                    states_by_user = fetch_states_by_user(databases, user_ids)
+
+            failed_touched_at = []
+            for mark_doc in mark_docs:
+                user_id = mark_doc['$id']
+                account_doc = account_docs_by_id.get(user_id)
+                if account_doc is None: # Accounts are created at sign-up; without one there is nothing to project into
+                    continue
+                accounts_scanned += 1
+                current_liked = account_doc.get('videosLiked', []) or []
+                current_disliked = account_doc.get('videosDisliked', []) or []
+                expected = states_by_user[user_id]
+
+                if set(current_liked) == expected['liked'] and set(current_disliked) == expected['disliked']:
+                    continue
+                try:
+                    with stage('account_updates'):
+                        databases.update_document(
+                            database_id=DATABASE_ID,
+                            collection_id=ACCOUNTS_COLLECTION_ID,
+                            document_id=user_id,
+                            data={
+                                'videosLiked': project_list(current_liked, expected['liked']),
+                                'videosDisliked': project_list(current_disliked, expected['disliked'])
+                            }
+                        )
+                    accounts_updated += 1
+                except AppwriteException as e:
+                    context.error(f"Failed to update liked/disliked lists for account {user_id}: {e}")
+                    failed_count += 1
+                    failed_touched_at.append(mark_doc['touchedAt'])
+
+            # --- Move the Watermark Only Past Users Projected Without Errors ---
+            if failed_touched_at:
+                watermark = min(failed_touched_at)
+                break
+            if mark_docs:
+                watermark = mark_docs[-1]['touchedAt']
+                cursor = mark_docs[-1]['$id']
+            if len(mark_docs) < MARKS_PAGE_SIZE:
+                caught_up = True
+                break
+
+        save_checkpoint(databases, watermark)
+
+        context.log(f"Projection finished. Scanned: {accounts_scanned}, Updated: {accounts_updated}, Failed: {failed_count}, Caught up: {caught_up}")
+        return context.res.json({
+            "success": True,
+            "accountsScanned": accounts_scanned,
+            "accountsUpdated": accounts_updated,
+            "failed": failed_count,
+            "caughtUp": caught_up
+        })
+
+    except Exception as e:
+        context.error(f"An unexpected error occurred during projection: {e}")
+        context.error(traceback.format_exc())
+        return context.res.json({"success": False, "message": f"Unexpected Error: {str(e)}"}, 500)
+    finally:
+        context.log("--- Liked Videos Projector End ---")
@@ -1,4 +1,3 @@
-from appwrite.client import Client
 from appwrite.services.databases import Databases
 from appwrite.exception import AppwriteException
 from appwrite.permission import Permission
@@ -7,16 +6,314 @@ from appwrite.query import Query
 from appwrite.id import ID
 import os
 import json
+import time
+import collections
+
+from .appwrite_client import create_client
+from .async_databases import DB_CONCURRENCY, run_keyed
+from .counter_journal import find_journal_entries, finish_journal_entry, journal_key, record_journal_entry
+from .metrics import instrumented, stage
+from .partitions import ASSIGN_TIME_BUDGET_SHARE, assign_missing_partitions, lease_partitions, partition_queries, release_partitions, run_slots
+from .profiling import profiled
+from .queue_worker import drain_queue, requested_max_items
+from .run_lock import wait_for_burst
+from .run_log import leveled_logging
+from .trending import SOURCE_LIKES, record_trending_deltas
+from .video_counters import apply_counter_deltas
 
 # Configuration Constants
 DATABASE_ID = "database"
-ACCOUNTS_COLLECTION_ID = "accounts"
 VIDEO_COUNTS_COLLECTION_ID = "video_counts"
 VIDEO_INTERACTIONS_COLLECTION_ID = "video_interactions"
 USER_VIDEO_STATES_COLLECTION_ID = "user_video_states"
+PROJECTION_MARKS_COLLECTION_ID = "projection_marks" # Users whose liked/disliked lists liked-videos-projector rebuilds
+FUNCTION_TIMEOUT_SECONDS = float(os.environ.get("FUNCTION_TIMEOUT_SECONDS", "30")) # Keep in sync with appwrite.json
+RUN_LOCK_ID = "likes-manager" # Prefix of the partition leases in run_locks, held while a run drains its slots
+JOURNAL_SOURCE = 'likes' # Marks this function's entries in counter_journal
+UNKNOWN_STATE_DOC = object() # The user's state document has not been looked up
+
+class CountWriteError(Exception):
+    """The video_counts write of a journaled batch failed; the batch is finished by a later run."""
+
+
+def get_user_id_from_permissions(permissions):
+    """Returns the user ID from the creator's update permission, or None."""
+    update_permission_prefix = 'update("user:'
+    for perm in permissions:
+        if perm.startswith(update_permission_prefix):
+            # Extract the user ID between 'user:' and '")'
+            start_index = len(update_permission_prefix)
+            end_index = perm.find('")', start_index)
+            if end_index != -1:
+                return perm[start_index:end_index]
+    return None
+
+def read_user_video_state(databases, user_id, video_id):
+    """
+    The user's current state on a video.
+    Returns: A tuple (state, state_doc_id); ('neutral', None) if the user has no state document
+    """
+    state_response = databases.list_documents(
+        DATABASE_ID,
+        USER_VIDEO_STATES_COLLECTION_ID,
+        [
+            Query.equal('userId', user_id),
+            Query.equal('videoId', video_id),
+            Query.limit(1)
+        ]
+    )
+    if state_response['total'] > 0:
+        state_doc = state_response['documents'][0]
+        return state_doc.get('state'), state_doc['$id']
+    return 'neutral', None
+
+def next_state(current_state, interaction_type):
+    """
+    Applies one like/dislike toggle.
+    Returns: A tuple (new_state, like_change, dislike_change)
+    """
+    if interaction_type == 'like':
+        if current_state == 'liked': # Toggle off
+            return 'neutral', -1, 0
+        if current_state == 'disliked': # Change from dislike to like
+            return 'liked', 1, -1
+        return 'liked', 1, 0
+    if current_state == 'disliked': # Toggle off
+        return 'neutral', 0, -1
+    if current_state == 'liked': # Change from like to dislike
+        return 'disliked', -1, 1
+    return 'disliked', 0, 1
+
+def store_user_video_state(databases, user_id, video_id, new_state, state_doc_id=UNKNOWN_STATE_DOC):
+    """
+    Sets the user's state on a video. The state is absolute, so storing it again is harmless.
+    `state_doc_id` is the user's state document if already known (None: there is none).
+    accounts.videosLiked/videosDisliked are derived from user_video_states by liked-videos-projector.
+    """
+    if state_doc_id is UNKNOWN_STATE_DOC:
+        _current_state, state_doc_id = read_user_video_state(databases, user_id, video_id)
+    if new_state == 'neutral':
+        if state_doc_id: # Only delete if a document existed
+            try:
+                databases.delete_document(DATABASE_ID, USER_VIDEO_STATES_COLLECTION_ID, state_doc_id)
+            except AppwriteException as e:
+                if e.code != 404:
+                    raise
+    elif state_doc_id: # Update existing document
+        databases.update_document(
+            DATABASE_ID,
+            USER_VIDEO_STATES_COLLECTION_ID,
+            state_doc_id,
+            {'state': new_state} # Only update the state field
+        )
+    else: # Create new document, only the user can read/manage it
+        databases.create_document(
+            DATABASE_ID,
+            USER_VIDEO_STATES_COLLECTION_ID,
+            ID.unique(),
+            {'userId': user_id, 'videoId': video_id, 'state': new_state},
+            [
+                Permission.read(Role.user(user_id)),
+                Permission.update(Role.user(user_id)),
+                Permission.delete(Role.user(user_id))
+            ]
+        )
 
+def mark_for_projection(databases, user_id):
+    """Records that the user's states changed, so liked-videos-projector rebuilds their lists. Written after the states."""
+    data = {'touchedAt': time.time()}
+    try:
+        databases.update_document(DATABASE_ID, PROJECTION_MARKS_COLLECTION_ID, user_id, data)
+        return
+    except AppwriteException as e:
+        if e.code != 404:
+            raise
+    try:
+        databases.create_document(DATABASE_ID, PROJECTION_MARKS_COLLECTION_ID, user_id, data)
+    except AppwriteException as e:
+        if e.code != 409:
+            raise
+        databases.update_document(DATABASE_ID, PROJECTION_MARKS_COLLECTION_ID, user_id, data) # Created concurrently
+
+def fold_user_interactions(databases, user_id, video_id, interaction_docs, context):
+    """
+    Runs one user's interactions on one video, in queue order, from their stored state. Nothing is written.
+    Returns: A dict with the initial state and its document, the final state, the like/dislike
+             changes and the number of count-changing interactions
+    """
+    initial_state, state_doc_id = read_user_video_state(databases, user_id, video_id)
+    state = initial_state
+    like_change = 0
+    dislike_change = 0
+    count_changing = 0
+    for interaction_doc in interaction_docs:
+        new_state, interaction_like_change, interaction_dislike_change = next_state(state, interaction_doc['type'])
+        context.debug("Interaction %s (%s) by user %s changes '%s' to '%s' on video %s", interaction_doc['$id'], interaction_doc['type'], user_id, state, new_state, video_id)
+        context.count(f"{state}->{new_state}")
+        like_change += interaction_like_change
+        dislike_change += interaction_dislike_change
+        count_changing += 1
+        state = new_state
+    return {
+        'initialState': initial_state,
+        'stateDocId': state_doc_id,
+        'state': state,
+        'likeCount': like_change,
+        'dislikeCount': dislike_change,
+        'countChanging': count_changing
+    }
+
+def finish_video_batch(databases, entry, state_doc_ids, events, counted, context):
+    """
+    Applies a journaled batch of one video's interactions (see counter_journal.py). `state_doc_ids`
+    maps users to their state documents where already known. The counter write that was made, if
+    any, is recorded in `counted` as (mode, deltas).
+    """
+    video_id = entry['target']
+
+    def apply_states(entry):
+        for user_id, new_state in entry['states'].items():
+            store_user_video_state(databases, user_id, video_id, new_state, state_doc_ids.get(user_id, UNKNOWN_STATE_DOC))
+            mark_for_projection(databases, user_id)
+
+    def apply_deltas(entry):
+        try:
+            mode = apply_counter_deltas(databases, video_id, entry['deltas'], events, context, idempotency_key=journal_key(entry))
+        except Exception as e:
+            raise CountWriteError(f"Failed to update/create counts for video {video_id} (deltas {entry['deltas']}): {e}") from e
+        if mode:
+            counted.append((mode, entry['deltas']))
+            context.debug("Applied count deltas for video %s (%s): %s", video_id, mode, entry['deltas'])
+        else:
+            context.debug("Count deltas of batch %s were already applied to video %s.", entry['$id'], video_id)
+
+    finish_journal_entry(databases, entry, apply_states, apply_deltas, VIDEO_INTERACTIONS_COLLECTION_ID)
+
+def process_video_interactions(databases, video_id, interaction_docs_by_user, context):
+    """
+    Applies one video's new interactions exactly once: folds them per user, journals the outcome,
+    then stores the states, the summed counts and dequeues them.
+    Returns: A list of (mode, deltas) for the counter write made, empty if none was needed
+    """
+    folds = {
+        user_id: fold_user_interactions(databases, user_id, video_id, interaction_docs, context)
+        for user_id, interaction_docs in interaction_docs_by_user.items()
+    }
+    interaction_ids = [doc['$id'] for docs in interaction_docs_by_user.values() for doc in docs]
+    deltas = {
+        'likeCount': sum(fold['likeCount'] for fold in folds.values()),
+        'dislikeCount': sum(fold['dislikeCount'] for fold in folds.values())
+    }
+    states = {user_id: fold['state'] for user_id, fold in folds.items() if fold['state'] != fold['initialState']}
+    counted = []
+    if not states:
+        # Every user toggled back to where they started. Still journaled: dequeuing only part of
+        # the batch would leave half a toggle to be applied on its own
+        context.debug("Interactions on video %s leave every state unchanged.", video_id)
+
+    entry = record_journal_entry(databases, JOURNAL_SOURCE, video_id, deltas, states, interaction_ids)
+    events = sum(fold['countChanging'] for fold in folds.values())
+    state_doc_ids = {user_id: fold['stateDocId'] for user_id, fold in folds.items()}
+    finish_video_batch(databases, entry, state_doc_ids, events, counted, context)
+    return counted
+
+def process_interaction_page(databases, interactions, totals, like_deltas_by_video, blocked_video_ids, context):
+    """
+    Processes one page of interactions. Returns the IDs of the interactions left in the queue.
+    A video whose batch failed is added to `blocked_video_ids`: its later interactions wait for the
+    next run, so they are never applied before the failed ones.
+    """
+    kept_ids = []
+
+    # --- Finish Batches an Earlier Run Journaled but Did Not Complete ---
+    # Their interactions are not processed again: the journal already holds their outcome
+    with stage('journal'):
+        entries = find_journal_entries(databases, JOURNAL_SOURCE, [doc['$id'] for doc in interactions])
+    covered_ids = {interaction_id for entry in entries for interaction_id in entry['interactionIds']}
+    if entries:
+        context.log(f"Finishing {len(entries)} journaled batches covering {len(covered_ids)} interactions.")
+
+    def finish_recovered(entry):
+        counted = []
+        finish_video_batch(databases, entry, {}, len(entry['interactionIds']), counted, context)
+        return counted
+
+    with stage('journal_recovery'):
+        results = run_keyed(entries, lambda entry: entry['target'], finish_recovered)
+    page_ids = {doc['$id'] for doc in interactions}
+    for entry, result in zip(entries, results):
+        entry_page_ids = [interaction_id for interaction_id in entry['interactionIds'] if interaction_id in page_ids]
+        if isinstance(result, Exception):
+            context.error(f"Failed to finish journaled batch {entry['$id']} for video {entry['target']}: {result}")
+            totals['countWriteFailures'] += isinstance(result, CountWriteError)
+            totals['failed'] += len(entry_page_ids)
+            kept_ids.extend(entry_page_ids)
+            blocked_video_ids.add(entry['target'])
+            continue
+        totals['recoveredBatches'] += 1
+        totals['processed'] += len(entry_page_ids)
+        for _mode, deltas in result:
+            totals['countWrites'] += 1
+            like_deltas_by_video[entry['target']] += deltas.get('likeCount', 0)
+
+    # --- Group New Interactions by Video, Then by User in Queue Order ---
+    interaction_docs_by_video = {} # Map videoId -> {userId: [interaction docs]}
+    for interaction_doc in interactions:
+        interaction_id = interaction_doc['$id']
+        if interaction_id in covered_ids:
+            continue
+        video_id = interaction_doc.get('videoId')
+        interaction_type = interaction_doc.get('type')
+        if not video_id or interaction_type not in ['like', 'dislike']:
+            context.error(f"Missing videoId or invalid type ('{interaction_type}') in interaction doc {interaction_id}.")
+            totals['failed'] += 1
+            kept_ids.append(interaction_id)
+            continue
+        doc_permissions = interaction_doc.get('$permissions', [])
+        user_id = get_user_id_from_permissions(doc_permissions)
+        if not user_id:
+            context.error(f"Could not determine user ID from permissions on interaction doc {interaction_id}. Permissions: {doc_permissions}")
+            totals['failed'] += 1
+            kept_ids.append(interaction_id)
+            continue
+        if video_id in blocked_video_ids:
+            totals['deferred'] += 1
+            kept_ids.append(interaction_id)
+            continue
+        interaction_docs_by_video.setdefault(video_id, {}).setdefault(user_id, []).append(interaction_doc)
+
+    # --- Apply Each Video's Interactions Once, Videos in Parallel ---
+    video_ids = list(interaction_docs_by_video)
+    context.log(f"Processing interactions on {len(video_ids)} videos with up to {DB_CONCURRENCY} concurrent database calls...")
+    with stage('interactions'):
+        results = run_keyed(
+            video_ids,
+            lambda video_id: video_id,
+            lambda video_id: process_video_interactions(databases, video_id, interaction_docs_by_video[video_id], context)
+        )
+    for video_id, result in zip(video_ids, results):
+        interaction_ids = [doc['$id'] for docs in interaction_docs_by_video[video_id].values() for doc in docs]
+        if isinstance(result, Exception):
+            # Whatever was journaled is finished by the next run; the rest is simply processed again
+            context.error(f"Failed to apply interactions on video {video_id}: {result}")
+            totals['countWriteFailures'] += isinstance(result, CountWriteError)
+            totals['failed'] += len(interaction_ids)
+            kept_ids.extend(interaction_ids)
+            blocked_video_ids.add(video_id)
+            continue
+        totals['processed'] += len(interaction_ids)
+        totals['countChanging'] += len(interaction_ids)
+        for _mode, deltas in result:
+            totals['countWrites'] += 1
+            like_deltas_by_video[video_id] += deltas.get('likeCount', 0)
+    return kept_ids
+
+@instrumented("likes-manager")
+@leveled_logging
+@profiled
 def main(context):
     context.log("--- Likes Manager Batch Job Start ---")
+    started_at = time.monotonic()
 
     # --- Environment Variable Check ---
     api_endpoint = os.environ.get("APPWRITE_FUNCTION_API_ENDPOINT")
@@ -30,325 +327,69 @@ def main(context):
         return context.res.json({"success": False, "message": message}, 500)
 
     # --- Initialize Appwrite Client (using API Key from header) ---
-    client = Client()
-    client.set_endpoint(api_endpoint).set_project(project_id).set_key(api_key)
+    client = create_client(api_endpoint, project_id, api_key)
     databases = Databases(client)
 
+    leases = {} # Partition slot -> lease token; runs started by queue events coalesce into the holders' runs
+
     try:
-        context.log("Fetching video interaction documents...")
-        # Fetch documents, limit to 100 per run
-        interaction_response = databases.list_documents(
-            DATABASE_ID,
-            VIDEO_INTERACTIONS_COLLECTION_ID,
-            [Query.limit(100)]
+        # --- Lease This Run's Partitions of the Queue ---
+        leases = lease_partitions(databases, RUN_LOCK_ID, run_slots(context, 'videoId'), FUNCTION_TIMEOUT_SECONDS)
+        if not leases:
+            context.log("Other runs hold this run's queue partitions and will process the queued interactions.")
+            context.log("--- Likes Manager Batch Job End (Coalesced) ---")
+            return context.res.json({"success": True, "message": "Other runs are processing these partitions.", "coalesced": True})
+        wait_for_burst(context)
+        context.log(f"Leased partitions {sorted(leases)}.")
+        with stage('assign_partitions'):
+            assign_missing_partitions(
+                databases, VIDEO_INTERACTIONS_COLLECTION_ID, 'videoId', context,
+                started_at + FUNCTION_TIMEOUT_SECONDS * ASSIGN_TIME_BUDGET_SHARE
+            )
+
+        totals = collections.Counter() # processed, failed, deferred, countWrites, countWriteFailures, countChanging, recoveredBatches
+        like_deltas_by_video = collections.Counter() # Map videoId -> net likeCount change over the run, for trending
+        blocked_video_ids = set() # Videos with a failed batch this run
+
+        # --- Drain the Queue Page by Page Within the Time Budget ---
+        drain = drain_queue(
+            databases, VIDEO_INTERACTIONS_COLLECTION_ID,
+            lambda page: process_interaction_page(databases, page, totals, like_deltas_by_video, blocked_video_ids, context),
+            context, FUNCTION_TIMEOUT_SECONDS, started_at=started_at,
+            queries=partition_queries(leases), max_items=requested_max_items(context)
         )
-        interactions = interaction_response['documents']
-        total_fetched = len(interactions)
-        context.log(f"Fetched {total_fetched} interactions to process.")
+        total_fetched = drain['fetched']
+        context.log(f"Fetched {total_fetched} interactions in {drain['pages']} pages. Backlog remaining: {drain['backlogRemaining']}.")
 
         if total_fetched == 0:
             context.log("No interactions to process.")
             context.log("--- Likes Manager Batch Job End (No Work) ---")
             return context.res.json({"success": True, "message": "No interactions found."})
 
-        processed_count = 0
-        failed_count = 0
-
-        # Process each interaction
-        for interaction_doc in interactions:
-            try:
-                interaction_id = interaction_doc["$id"]
-                context.log(f"Processing interaction {interaction_id}...")
-
-                # Extract basic info
-                video_id = interaction_doc.get('videoId')
-                interaction_type = interaction_doc.get('type')
-                
-                if not video_id or interaction_type not in ['like', 'dislike']:
-                    context.error(f"Missing videoId or invalid type ('{interaction_type}') in interaction doc {interaction_id}.")
-                    failed_count += 1
-                    continue
-
-                # --- Identify User ID from Permissions ---
-                user_id = None
-                doc_permissions = interaction_doc.get('$permissions', [])
-                
-                # Look for update permission, assuming only the creator has it on the interaction doc
-                update_permission_prefix = 'update("user:'
-                for perm in doc_permissions:
-                    if perm.startswith(update_permission_prefix):
-                        # Extract the user ID between 'user:' and '")'
-                        start_index = len(update_permission_prefix)
-                        end_index = perm.find('")', start_index)
-                        if end_index != -1:
-                            user_id = perm[start_index:end_index]
-                            break # Found the user ID
-
-                if not user_id:
-                    context.error(f"Could not determine user ID from permissions on interaction doc {interaction_id}. Permissions: {doc_permissions}")
-                    failed_count += 1
-                    continue
-
-                context.log(f"Processing interaction by User ID: {user_id} for Video ID: {video_id}, Type: {interaction_type}")
-
-                # --- Query Current User State ---
-                current_state = 'neutral'
-                state_doc_id = None # To store the ID if found, for update/delete
-                try:
-                    state_response = databases.list_documents(
-                        DATABASE_ID,
-                        USER_VIDEO_STATES_COLLECTION_ID,
-                        [
-                            Query.equal('userId', user_id),
-                            Query.equal('videoId', video_id),
-                            Query.limit(1)
-                        ]
-                    )
-                    if state_response['total'] > 0:
-                        state_doc = state_response['documents'][0]
-                        current_state = state_doc.get('state')
-                        state_doc_id = state_doc['$id']
-                        context.log(f"Found existing state '{current_state}' for user {user_id}, video {video_id} (Doc ID: {state_doc_id})")
-                    else:
-                        context.log(f"No existing state found for user {user_id}, video {video_id}. Current state is 'neutral'.")
-                except AppwriteException as e:
-                    context.error(f"Error querying user_video_states for user {user_id}, video {video_id}: {e}. Assuming 'neutral'.")
-                    # Decide if you should continue or skip this interaction
-                    failed_count += 1
-                    continue # Skip this interaction if state query fails
-
-                # --- Calculate Count Changes and New State ---
-                like_change = 0
-                dislike_change = 0
-                new_state = current_state # Start with the current state
-
-                if interaction_type == 'like':
-                    if current_state == 'liked': # Toggle off
-                        new_state = 'neutral'
-                        like_change = -1
-                        context.log(f"Interaction {interaction_id} (like) toggles OFF existing 'liked' state. like_change={like_change}")
-                    elif current_state == 'disliked': # Change from dislike to like
-                        new_state = 'liked'
-                        like_change = 1
-                        dislike_change = -1 # Decrement dislike count
-                        context.log(f"Interaction {interaction_id} (like) changes 'disliked' to 'liked'. like_change={like_change}, dislike_change={dislike_change}")
-                    else: # current_state == 'neutral'
-                        new_state = 'liked'
-                        like_change = 1
-                        context.log(f"Interaction {interaction_id} (like) sets 'neutral' to 'liked'. like_change={like_change}")
-
-                elif interaction_type == 'dislike':
-                    if current_state == 'disliked': # Toggle off
-                        new_state = 'neutral'
-                        dislike_change = -1
-                        context.log(f"Interaction {interaction_id} (dislike) toggles OFF existing 'disliked' state. dislike_change={dislike_change}")
-                    elif current_state == 'liked': # Change from like to dislike
-                        new_state = 'disliked'
-                        dislike_change = 1
-                        like_change = -1 # Decrement like count
-                        context.log(f"Interaction {interaction_id} (dislike) changes 'liked' to 'disliked'. dislike_change={dislike_change}, like_change={like_change}")
-                    else: # current_state == 'neutral'
-                        new_state = 'disliked'
-                        dislike_change = 1
-                        context.log(f"Interaction {interaction_id} (dislike) sets 'neutral' to 'disliked'. dislike_change={dislike_change}")
-                else:
-                    context.error(f"Unknown interaction type '{interaction_type}' for interaction {interaction_id}. Skipping.")
-                    failed_count += 1
-                    continue # Skip unknown types
-
-                # --- Update video_counts ---
-                if like_change != 0 or dislike_change != 0:
-                    try:
-                        # Fetch or initialize counts_doc
-                        counts_doc = None
-                        try:
-                            counts_doc = databases.get_document(DATABASE_ID, VIDEO_COUNTS_COLLECTION_ID, video_id)
-                            current_likes = counts_doc.get('likeCount', 0)
-                            current_dislikes = counts_doc.get('dislikeCount', 0)
-                            # Preserve comment info
-                            current_comments_json = counts_doc.get('commentsJson', '[]')
-                            current_comment_count = counts_doc.get('commentCount', 0)
-                        except AppwriteException as e:
-                            if e.code == 404:
-                                current_likes = 0
-                                current_dislikes = 0
-                                current_comments_json = '[]'
-                                current_comment_count = 0
-                                context.log(f"Counts doc for {video_id} not found, initializing counts.")
-                            else:
-                                raise # Re-throw other DB errors during fetch
-
-                        new_like_count = max(0, current_likes + like_change)
-                        new_dislike_count = max(0, current_dislikes + dislike_change)
-
-                        counts_update_data = {
-                            'likeCount': new_like_count,
-                            'dislikeCount': new_dislike_count
-                        }
-
-                        if counts_doc: # Update existing
-                            databases.update_document(
-                                database_id=DATABASE_ID, collection_id=VIDEO_COUNTS_COLLECTION_ID, document_id=video_id,
-                                data=counts_update_data
-                            )
-                            context.log(f"Updated counts for video {video_id}: Likes={new_like_count}, Dislikes={new_dislike_count}")
-                        else: # Create new
-                            counts_create_data = {
-                                **counts_update_data,
-                                'commentsJson': current_comments_json,
-                                'commentCount': current_comment_count
-                            }
-                            databases.create_document(
-                                database_id=DATABASE_ID, collection_id=VIDEO_COUNTS_COLLECTION_ID, document_id=video_id,
-                                data=counts_create_data,
-                                permissions=[Permission.read(Role.any())]
-                            )
-                            context.log(f"Created counts document for video {video_id}: Likes={new_like_count}, Dislikes={new_dislike_count}")
-
-                    except AppwriteException as e:
-                        context.error(f"Failed to update/create counts for video {video_id} (Interaction: {interaction_id}): {e}. Skipping count update.")
-                    except Exception as e:
-                        context.error(f"Unexpected error updating/creating counts for video {video_id} (Interaction: {interaction_id}): {e}. Skipping count update.")
-                else:
-                    context.log(f"No count change needed for interaction {interaction_id}.")
-
-                # --- Update user_video_states Collection ---
-                try:
-                    if new_state == 'neutral':
-                        if state_doc_id: # Only delete if a document existed
-                            context.log(f"New state is 'neutral', deleting state doc {state_doc_id}...")
-                            databases.delete_document(DATABASE_ID, USER_VIDEO_STATES_COLLECTION_ID, state_doc_id)
-                            context.log(f"Deleted state doc {state_doc_id}.")
-                        else:
-                             context.log("New state is 'neutral', no existing doc to delete.")
-                    elif new_state == 'liked' or new_state == 'disliked':
-                        state_data = {
-                            'userId': user_id,
-                            'videoId': video_id,
-                            'state': new_state
-                        }
-                        # Define permissions for the state document - only the user can read/manage it
-                        state_permissions = [
-                            Permission.read(Role.user(user_id)),
-                            Permission.update(Role.user(user_id)),
-                            Permission.delete(Role.user(user_id))
-                        ]
-
-                        if state_doc_id: # Update existing document
-                            context.log(f"Updating state doc {state_doc_id} to '{new_state}'...")
-                            databases.update_document(
-                                DATABASE_ID,
-                                USER_VIDEO_STATES_COLLECTION_ID,
-                                state_doc_id,
-                                {'state': new_state} # Only update the state field
-                            )
-                            context.log(f"Updated state doc {state_doc_id}.")
-                        else: # Create new document
-                            context.log(f"Creating new state doc with state '{new_state}'...")
-                            new_state_doc = databases.create_document(
-                                DATABASE_ID,
-                                USER_VIDEO_STATES_COLLECTION_ID,
-                                ID.unique(), # Use unique ID
-                                state_data,
-                                state_permissions # Apply permissions on creation
-                            )
-                            context.log(f"Created new state doc {new_state_doc['$id']}.")
-                    else:
-                        context.log(f"Warning: Unexpected new_state '{new_state}' - no action taken on user_video_states.")
-                    state_update_successful = True # Flag success
-                except AppwriteException as e:
-                    context.error(f"Failed to update user_video_states for user {user_id}, video {video_id}: {e}. Interaction {interaction_id} will NOT be deleted or cleaned up.")
-                    failed_count += 1
-                    state_update_successful = False # Flag failure
-                    continue # Skip cleanup and deletion for this interaction
-
-                # --- Fetch User's Account Document ---
-                account_doc = None
-                current_account_liked = []
-                current_account_disliked = []
-                try:
-                    account_doc = databases.get_document(DATABASE_ID, ACCOUNTS_COLLECTION_ID, user_id)
-                    current_account_liked = account_doc.get('videosLiked', []) or [] # Default to empty list if null/missing
-                    current_account_disliked = account_doc.get('videosDisliked', []) or []
-                    context.log(f"Fetched account doc {user_id}. Current array sizes: Liked({len(current_account_liked)}), Disliked({len(current_account_disliked)})")
-                except AppwriteException as e:
-                    if e.code == 404:
-                         context.log(f"Account doc {user_id} not found. Cannot clean up arrays, but proceeding with counts/state.")
-                         # account_doc remains None, cleanup will be skipped later
-                    else:
-                         context.error(f"Error fetching account doc {user_id}: {e}. Skipping interaction {interaction_id}.")
-                         failed_count += 1
-                         continue # Skip this interaction if we can't fetch the account doc (other than 404)
-
-                # --- Cleanup Account Arrays (Only if state update was successful) ---
-                if state_update_successful and account_doc: # Check if account_doc was fetched successfully
-                    try:
-                        # Remove the video_id from both lists, regardless of interaction type
-                        needs_update = False
-                        cleaned_liked = [vid for vid in current_account_liked if vid != video_id]
-                        cleaned_disliked = [vid for vid in current_account_disliked if vid != video_id]
-
-                        if len(cleaned_liked) != len(current_account_liked) or len(cleaned_disliked) != len(current_account_disliked):
-                            needs_update = True
-                            context.log(f"Video ID {video_id} found in account arrays, preparing cleanup.")
-                        else:
-                            context.log(f"Video ID {video_id} not found in account arrays, no cleanup needed.")
-
-                        if needs_update:
-                            # Commenting out the cleanup update to preserve arrays in accounts collection
-                            # databases.update_document(
-                            #     database_id=DATABASE_ID,
-                            #     collection_id=ACCOUNTS_COLLECTION_ID,
-                            #     document_id=user_id,
-                            #     data={
-                            #         'videosLiked': cleaned_liked,
-                            #         'videosDisliked': cleaned_disliked
-                            #     }
-                            # )
-                            context.log(f"Skipping cleanup of account arrays for user {user_id}, video {video_id} as requested.")
-                        cleanup_successful = True # Flag success
-                    except AppwriteException as e:
-                         context.error(f"Failed to clean up account arrays for user {user_id}, video {video_id}: {e}. Interaction {interaction_id} will NOT be deleted.")
-                         failed_count += 1
-                         cleanup_successful = False # Flag failure
-                         continue # Skip interaction deletion if cleanup fails
-                elif not account_doc:
-                     context.log(f"Skipping account array cleanup for interaction {interaction_id} as account doc was not found.")
-                     cleanup_successful = True # Consider it "successful" for flow control as there was nothing to clean
-                else:
-                    # This branch is entered if state_update_successful was false
-                    cleanup_successful = False
-
-                # --- Delete Interaction (Only if state update AND cleanup were successful) ---
-                if state_update_successful and cleanup_successful:
-                    try:
-                        databases.delete_document(
-                            DATABASE_ID,
-                            VIDEO_INTERACTIONS_COLLECTION_ID,
-                            interaction_id
-                        )
-                        context.log(f"Deleted interaction {interaction_id}.")
-                        processed_count += 1
-                    except AppwriteException as e:
-                        context.error(f"Failed to delete interaction {interaction_id} after processing: {e}.")
-                        failed_count += 1
-                else:
-                    context.log(f"Skipping deletion of interaction {interaction_id} due to prior failure.")
-
-            except Exception as e:
-                context.error(f"Unexpected error processing interaction: {e}")
-                import traceback
-                context.error(traceback.format_exc())
-                failed_count += 1
+        with stage('trending'):
+            record_trending_deltas(databases, SOURCE_LIKES, dict(like_deltas_by_video), context)
 
         # --- Summary ---
+        processed_count = totals['processed']
+        failed_count = totals['failed']
+        count_writes = totals['countWrites']
+        # The per-interaction approach cost one write per count-changing interaction
+        count_writes_saved = max(0, totals['countChanging'] - count_writes - totals['countWriteFailures'])
         summary = {
             "success": True,
             "processed": processed_count,
             "failed": failed_count,
-            "total": total_fetched
+            "deferred": totals['deferred'],
+            "total": total_fetched,
+            "videoCountWrites": count_writes,
+            "videoCountWriteFailures": totals['countWriteFailures'],
+            "countWritesSaved": count_writes_saved,
+            "recoveredBatches": totals['recoveredBatches'],
+            "pages": drain['pages'],
+            "backlogRemaining": drain['backlogRemaining'],
+            "drained": drain['drained']
         }
-        context.log(f"Processing complete: {processed_count} processed, {failed_count} failed.")
+        context.log(f"Processing complete: {processed_count} processed, {failed_count} failed. Count writes: {count_writes} ({count_writes_saved} saved by batching).")
         context.log("--- Likes Manager Batch Job End (Success) ---")
         return context.res.json(summary)
 
@@ -369,3 +410,5 @@ def main(context):
             "success": False,
             "message": f"Unexpected Server Error: {str(e)}"
         }, 500)
+    finally:
+        release_partitions(databases, leases)
@@ -0,0 +1,65 @@
+# Synced from functions/shared/trending.py by functions/shared/sync.py. Edit the original, not this copy.
+"""
+Per-run engagement deltas for the trending leaderboard.
+
+likes-manager, view-manager and comments-manager each write the engagement they applied in a
+run to trending_deltas, keyed by videoId. A run's deltas are split over as many documents as
+the size of `deltasJson` needs, usually one. The trending-ranker
+function consumes these documents, so ranking costs O(changed videos) instead of a scan
+of every video_counts document.
+"""
+import json
+import time
+
+from appwrite.id import ID
+
+# Configuration Constants
+DATABASE_ID = "database"
+TRENDING_DELTAS_COLLECTION_ID = "trending_deltas"
+DELTAS_JSON_MAX_LENGTH = 90000 # Below the 100000 character size of deltasJson
+
+SOURCE_VIEWS = 'views'
+SOURCE_LIKES = 'likes'
+SOURCE_COMMENTS = 'comments'
+
+
+def split_deltas(deltas):
+    """Splits deltas into dicts whose JSON is at most DELTAS_JSON_MAX_LENGTH characters long."""
+    chunks = [{}]
+    length = 2 # The braces
+    for video_id, count in deltas.items():
+        entry_length = len(json.dumps({video_id: count}, separators=(',', ':'))) - 1 # Without braces, with a comma
+        if chunks[-1] and length + entry_length > DELTAS_JSON_MAX_LENGTH:
+            chunks.append({})
+            length = 2
+        chunks[-1][video_id] = count
+        length += entry_length
+    return chunks
+
+
+def record_trending_deltas(databases, source, deltas_by_video, context):
+    """
+    Writes this run's positive engagement per video, one document per split_deltas chunk.
+    Returns: True if every document was written
+    Never raises: trending is best effort and must not fail the calling manager.
+    """
+    deltas = {video_id: count for video_id, count in deltas_by_video.items() if count > 0}
+    if not deltas:
+        return False
+    written = True
+    for chunk in split_deltas(deltas):
+        try:
+            databases.create_document(
+                DATABASE_ID,
+                TRENDING_DELTAS_COLLECTION_ID,
+                ID.unique(),
+                {
+                    'source': source,
+                    'timestamp': int(time.time()),
+                    'deltasJson': json.dumps(chunk, separators=(',', ':'))
+                }
+            )
+        except Exception as e:
+            context.error(f"Failed to record trending deltas for {len(chunk)} videos ({source}): {e}")
+            written = False
+    return written
@@ -0,0 +1,582 @@
+"""
+An in-memory stand-in for the Appwrite services the functions use, for local load tests.
+
+`FakeAppwrite` holds every collection and bucket in memory and hands out `FakeDatabases` and
+`FakeStorage` objects with the same method names and return shapes as the SDK services. Each
+call can be slowed down and made to fail at a configurable rate, so a run behaves like one
+against a real, somewhat unreliable, Appwrite:
+
+    backend = FakeAppwrite(latency_seconds=0.02, jitter_seconds=0.01, error_rate=0.001)
+    backend.seed_document('video_interactions', {'videoId': 'v1', 'type': 'like'}, permissions)
+    databases = backend.databases()
+
+Injected failures are AppwriteException 503s raised before the call does any work. Calls made
+through the fakes bypass appwrite_client.py, so its retries do not hide them: the function code
+sees every injected failure.
+
+Queries are the JSON strings built by the SDK's `Query` helpers (appwrite 5.0+). Filters,
+ordering, `limit`, `offset`, `cursorAfter`/`cursorBefore` and `select` are supported; list
+totals are capped at 5,000 like Appwrite's default count limit. Equality filters use an index
+that is built the first time an attribute is queried, so queue-sized collections stay fast.
+"""
+import bisect
+import collections
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from appwrite.exception import AppwriteException
+
+# Configuration Constants
+DEFAULT_LIST_LIMIT = 25
+LIST_TOTAL_CAP = 5000 # Appwrite stops counting list totals here by default
+COMPACT_RATIO = 0.5 # Rebuild a collection's order once this share of it is deleted entries
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+
+
+def _copy_document(doc, select=None):
+    """Copies a stored document, one level deep (stored values are scalars or lists of scalars)."""
+    if select is not None:
+        return {key: (list(value) if isinstance(value, list) else value)
+                for key, value in doc.items() if key.startswith('$') or key in select}
+    return {key: (list(value) if isinstance(value, list) else value) for key, value in doc.items()}
+
+
+def parse_query(query):
+    """Returns (method, attribute, values) for a query string built by the SDK's Query helpers."""
+    try:
+        parsed = json.loads(query)
+    except (TypeError, ValueError):
+        raise NotImplementedError(f"Unsupported query format (expected appwrite 5.0+ JSON queries): {query!r}")
+    return parsed.get('method'), parsed.get('attribute'), parsed.get('values') or []
+
+
+def _matches(doc, method, attribute, values):
+    value = doc.get(attribute)
+    if method == 'equal':
+        if isinstance(value, list):
+            return any(item in values for item in value)
+        return value in values
+    if method == 'notEqual':
+        return value not in values
+    if method in ('isNull', 'isNotNull'):
+        return (value is None) == (method == 'isNull')
+    if value is None:
+        return False
+    if method == 'greaterThan':
+        return value > values[0]
+    if method == 'greaterThanEqual':
+        return value >= values[0]
+    if method == 'lessThan':
+        return value < values[0]
+    if method == 'lessThanEqual':
+        return value <= values[0]
+    if method == 'between':
+        return values[0] <= value <= values[1]
+    if method == 'startsWith':
+        return isinstance(value, str) and value.startswith(values[0])
+    if method == 'endsWith':
+        return isinstance(value, str) and value.endswith(values[0])
+    if method == 'contains':
+        return any(item in value for item in values)
+    raise NotImplementedError(f"Query method '{method}' is not supported by the fake")
+
+
+class FakeCollection:
+    """
+    Documents of one collection (or files of one bucket) in creation order.
+
+    `order` lists document IDs by sequence; a deleted document leaves None behind until the
+    list is compacted. `head` skips the deleted prefix, which is where a queue's processed
+    documents pile up.
+    """
+    def __init__(self):
+        self.documents = {}
+        self.order = []
+        self.positions = {}
+        self.head = 0
+        self.deleted_slots = 0
+        self.indexes = {} # attribute -> value -> set of IDs, built on first equality query
+
+    def _index_add(self, doc):
+        for attribute, index in self.indexes.items():
+            value = doc.get(attribute)
+            for item in (value if isinstance(value, list) else [value]):
+                index.setdefault(item, set()).add(doc['$id'])
+
+    def _index_remove(self, doc):
+        for attribute, index in self.indexes.items():
+            value = doc.get(attribute)
+            for item in (value if isinstance(value, list) else [value]):
+                ids = index.get(item)
+                if ids:
+                    ids.discard(doc['$id'])
+
+    def index(self, attribute):
+        if attribute not in self.indexes:
+            index = {}
+            for doc in self.documents.values():
+                value = doc.get(attribute)
+                for item in (value if isinstance(value, list) else [value]):
+                    index.setdefault(item, set()).add(doc['$id'])
+            self.indexes[attribute] = index
+        return self.indexes[attribute]
+
+    def insert(self, doc):
+        self.positions[doc['$id']] = len(self.order)
+        self.order.append(doc['$id'])
+        self.documents[doc['$id']] = doc
+        self._index_add(doc)
+
+    def update(self, doc_id, data):
+        doc = self.documents[doc_id]
+        self._index_remove(doc)
+        doc.update(data)
+        self._index_add(doc)
+        return doc
+
+    def remove(self, doc_id):
+        doc = self.documents.pop(doc_id)
+        self._index_remove(doc)
+        self.order[self.positions.pop(doc_id)] = None
+        self.deleted_slots += 1
+        while self.head < len(self.order) and self.order[self.head] is None:
+            self.head += 1
+        if self.deleted_slots > len(self.order) * COMPACT_RATIO:
+            self.order = [doc_id for doc_id in self.order if doc_id is not None]
+            self.positions = {doc_id: position for position, doc_id in enumerate(self.order)}
+            self.head = 0
+            self.deleted_slots = 0
+        return doc
+
+    def _candidates(self, filters, after_position=-1):
+        """
+        IDs that may match, in sequence order, after `after_position`: from the smallest equality
+        index that applies, else from the whole collection.
+        """
+        equal_sets = []
+        for method, attribute, values in filters:
+            if method != 'equal':
+                continue
+            if attribute == '$id':
+                equal_sets.append({value for value in values if value in self.documents})
+            else:
+                index = self.index(attribute)
+                equal_sets.append(set().union(*(index.get(value, ()) for value in values)))
+        if equal_sets:
+            ids = sorted(min(equal_sets, key=len), key=self.positions.__getitem__)
+            start = bisect.bisect_right([self.positions[doc_id] for doc_id in ids], after_position)
+            return iter(ids[start:])
+        start = max(self.head, after_position + 1)
+        order = self.order
+        return (order[position] for position in range(start, len(order)) if order[position] is not None)
+
+    def _matching(self, filters, after_position=-1):
+        for doc_id in self._candidates(filters, after_position):
+            doc = self.documents[doc_id]
+            if all(_matches(doc, *query_filter) for query_filter in filters):
+                yield doc
+
+    def query(self, queries):
+        """Returns (total, documents) for a list of SDK query strings."""
+        filters = []
+        orders = []
+        limit = DEFAULT_LIST_LIMIT
+        offset = 0
+        cursor = None
+        cursor_before = False
+        select = None
+        for query in queries or []:
+            method, attribute, values = parse_query(query)
+            if method == 'limit':
+                limit = values[0]
+            elif method == 'offset':
+                offset = values[0]
+            elif method in ('cursorAfter', 'cursorBefore'):
+                cursor = values[0]
+                cursor_before = method == 'cursorBefore'
+            elif method in ('orderAsc', 'orderDesc'):
+                orders.append((attribute, method == 'orderDesc'))
+            elif method == 'select':
+                select = set(values)
+            else:
+                filters.append((method, attribute, values))
+
+        if cursor is not None and cursor not in self.documents:
+            raise AppwriteException(f"Document with the requested ID '{cursor}' could not be found.", 400, 'general_cursor_not_found')
+
+        # Creation order is sequence order, so ordering by it needs no sort
+        natural = all(attribute in ('$sequence', '$createdAt', '') and not descending for attribute, descending in orders)
+        if not natural or cursor_before:
+            docs = list(self._matching(filters))
+            if cursor is not None and not self._is_match(cursor, filters):
+                docs.append(self.documents[cursor]) # Only its position matters
+            docs.sort(key=lambda doc: doc['$sequence'])
+            for attribute, descending in reversed(orders):
+                docs.sort(key=lambda doc: (doc.get(attribute) is None, doc.get(attribute)), reverse=descending)
+            total = min(len(docs) - (cursor is not None and not self._is_match(cursor, filters)), LIST_TOTAL_CAP)
+            if cursor is not None:
+                cursor_index = [doc['$id'] for doc in docs].index(cursor)
+                if cursor_before:
+                    end = max(0, cursor_index - offset)
+                    docs = docs[max(0, end - limit):end]
+                    return total, [_copy_document(doc, select) for doc in docs]
+                docs = docs[cursor_index + 1:]
+            return total, [_copy_document(doc, select) for doc in docs[offset:offset + limit]]
+
+        # Count from the head up to the cap, then collect the page after the cursor
+        total = 0
+        for _doc in self._matching(filters):
+            total += 1
+            if total >= LIST_TOTAL_CAP:
+                break
+        page = []
+        for doc in self._matching(filters, self.positions[cursor] if cursor is not None else -1):
+            if offset:
+                offset -= 1
+                continue
+            page.append(_copy_document(doc, select))
+            if len(page) >= limit:
+                break
+        return total, page
+
+    def _is_match(self, doc_id, filters):
+        return all(_matches(self.documents[doc_id], *query_filter) for query_filter in filters)
+
+
+class CallStats:
+    """API calls made through the fakes, by method and by (method, collection)."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.calls_by_collection = collections.Counter()
+        self.injected_errors = 0
+
+    def record(self, method, collection_id):
+        with self.lock:
+            self.calls[method] += 1
+            self.calls_by_collection[(method, collection_id)] += 1
+
+    def total(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+
+class FakeAppwrite:
+    """
+    The shared state behind the fake services.
+
+    latency_seconds/jitter_seconds: every call sleeps latency ± jitter (uniform) before it runs.
+    error_rate: share of calls that fail with an injected 503.
+    on_delete: called with (collection_id, document_id) after a document is deleted.
+    """
+    def __init__(self, latency_seconds=0.0, jitter_seconds=0.0, error_rate=0.0, seed=None, on_delete=None):
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.on_delete = on_delete
+        self.lock = threading.RLock()
+        self.collections = collections.defaultdict(FakeCollection)
+        self.buckets = collections.defaultdict(FakeCollection)
+        self.file_contents = {}
+        self.sequence = 0
+        self.stats = CallStats()
+
+    def databases(self):
+        return FakeDatabases(self)
+
+    def storage(self):
+        return FakeStorage(self)
+
+    def call(self, method, collection_id):
+        """Records a call, then applies the configured latency and error rate."""
+        self.stats.record(method, collection_id)
+        with self.random_lock:
+            delay = self.latency_seconds + self.random.uniform(-self.jitter_seconds, self.jitter_seconds)
+            fail = self.error_rate > 0 and self.random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            with self.stats.lock:
+                self.stats.injected_errors += 1
+            raise AppwriteException(f"Injected failure on {method} {collection_id}", 503, 'general_server_error')
+
+    def new_document(self, document_id, data, permissions):
+        with self.lock:
+            self.sequence += 1
+            created_at = _now_iso()
+            doc = dict(data)
+            doc.update({
+                '$id': document_id if document_id and document_id != 'unique()' else uuid.uuid4().hex[:20],
+                '$sequence': self.sequence,
+                '$createdAt': created_at,
+                '$updatedAt': created_at,
+                '$permissions': list(permissions or []),
+                '$databaseId': 'database'
+            })
+            return doc
+
+    def seed_document(self, collection_id, data, permissions=None, document_id=None):
+        """Stores a document without counting a call or injecting latency. Returns its ID."""
+        doc = self.new_document(document_id, data, permissions)
+        with self.lock:
+            collection = self.collections[collection_id]
+            if doc['$id'] in collection.documents:
+                raise AppwriteException(f"Document with the requested ID '{doc['$id']}' already exists.", 409, 'document_already_exists')
+            doc['$collectionId'] = collection_id
+            collection.insert(doc)
+        return doc['$id']
+
+    def restore_document(self, collection_id, stored_doc):
+        """
+        Stores a captured document with its own ID, permissions and timestamps, without counting a
+        call. It is sequenced after everything already stored. Returns its ID.
+        """
+        with self.lock:
+            self.sequence += 1
+            doc = dict(stored_doc)
+            doc['$sequence'] = self.sequence
+            doc['$collectionId'] = collection_id
+            doc.setdefault('$permissions', [])
+            doc.setdefault('$createdAt', _now_iso())
+            doc.setdefault('$updatedAt', doc['$createdAt'])
+            collection = self.collections[collection_id]
+            if doc['$id'] in collection.documents:
+                raise AppwriteException(f"Document with the requested ID '{doc['$id']}' already exists.", 409, 'document_already_exists')
+            collection.insert(doc)
+        return doc['$id']
+
+    def documents(self, collection_id):
+        """All stored documents of a collection, in creation order (for reports and checks)."""
+        with self.lock:
+            collection = self.collections[collection_id]
+            return [_copy_document(collection.documents[doc_id]) for doc_id in collection.order[collection.head:] if doc_id is not None]
+
+    def count(self, collection_id):
+        with self.lock:
+            return len(self.collections[collection_id].documents)
+
+    def deleted(self, collection_id, document_id):
+        if self.on_delete:
+            self.on_delete(collection_id, document_id)
+
+
+def _not_found(kind, document_id):
+    return AppwriteException(f"{kind} with the requested ID '{document_id}' could not be found.", 404, f"{kind.lower()}_not_found")
+
+
+class FakeDatabases:
+    """The `Databases` service calls made by the functions, against a FakeAppwrite."""
+    def __init__(self, backend):
+        self.backend = backend
+
+    def list_documents(self, database_id, collection_id, queries=None):
+        self.backend.call('list_documents', collection_id)
+        with self.backend.lock:
+            total, documents = self.backend.collections[collection_id].query(queries)
+        return {'total': total, 'documents': documents}
+
+    def get_document(self, database_id, collection_id, document_id, queries=None):
+        self.backend.call('get_document', collection_id)
+        select = None
+        for query in queries or []:
+            method, _attribute, values = parse_query(query)
+            if method == 'select':
+                select = set(values)
+        with self.backend.lock:
+            doc = self.backend.collections[collection_id].documents.get(document_id)
+            if doc is None:
+                raise _not_found('Document', document_id)
+            return _copy_document(doc, select)
+
+    def create_document(self, database_id, collection_id, document_id, data, permissions=None):
+        self.backend.call('create_document', collection_id)
+        doc = self.backend.new_document(document_id, data, permissions)
+        doc['$collectionId'] = collection_id
+        with self.backend.lock:
+            collection = self.backend.collections[collection_id]
+            if doc['$id'] in collection.documents:
+                raise AppwriteException(f"Document with the requested ID '{doc['$id']}' already exists.", 409, 'document_already_exists')
+            collection.insert(doc)
+            return _copy_document(doc)
+
+    def update_document(self, database_id, collection_id, document_id, data=None, permissions=None):
+        self.backend.call('update_document', collection_id)
+        with self.backend.lock:
+            collection = self.backend.collections[collection_id]
+            if document_id not in collection.documents:
+                raise _not_found('Document', document_id)
+            changes = dict(data or {})
+            if permissions is not None:
+                changes['$permissions'] = list(permissions)
+            changes['$updatedAt'] = _now_iso()
+            return _copy_document(collection.update(document_id, changes))
+
+    def _add_to_attribute(self, method, collection_id, document_id, attribute, delta, bound):
+        self.backend.call(method, collection_id)
+        with self.backend.lock:
+            collection = self.backend.collections[collection_id]
+            doc = collection.documents.get(document_id)
+            if doc is None:
+                raise _not_found('Document', document_id)
+            new_value = (doc.get(attribute) or 0) + delta
+            if bound is not None and (new_value > bound if delta > 0 else new_value < bound):
+                raise AppwriteException(f"Attribute '{attribute}' would pass its limit of {bound}.", 400, 'attribute_limit_exceeded')
+            return _copy_document(collection.update(document_id, {attribute: new_value, '$updatedAt': _now_iso()}))
+
+    def increment_document_attribute(self, database_id, collection_id, document_id, attribute, value=None, max=None):
+        return self._add_to_attribute('increment_document_attribute', collection_id, document_id, attribute, 1 if value is None else value, max)
+
+    def decrement_document_attribute(self, database_id, collection_id, document_id, attribute, value=None, min=None):
+        return self._add_to_attribute('decrement_document_attribute', collection_id, document_id, attribute, -(1 if value is None else value), min)
+
+    def delete_document(self, database_id, collection_id, document_id):
+        self.backend.call('delete_document', collection_id)
+        with self.backend.lock:
+            collection = self.backend.collections[collection_id]
+            if document_id not in collection.documents:
+                raise _not_found('Document', document_id)
+            collection.remove(document_id)
+        self.backend.deleted(collection_id, document_id)
+        return {}
+
+    def delete_documents(self, database_id, collection_id, queries=None):
+        """Bulk delete (Appwrite 1.7+): removes every document the queries match."""
+        self.backend.call('delete_documents', collection_id)
+        with self.backend.lock:
+            collection = self.backend.collections[collection_id]
+            _total, matched = collection.query(list(queries or []) + [json.dumps({'method': 'limit', 'values': [len(collection.documents) or 1]})])
+            for doc in matched:
+                collection.remove(doc['$id'])
+        for doc in matched:
+            self.backend.deleted(collection_id, doc['$id'])
+        return {'total': len(matched), 'documents': matched}
+
+
+class FakeStorage:
+    """The `Storage` service calls made by the functions, against a FakeAppwrite."""
+    def __init__(self, backend):
+        self.backend = backend
+
+    def create_file(self, bucket_id, file_id, file, permissions=None, on_progress=None):
+        self.backend.call('create_file', bucket_id)
+        content = getattr(file, 'data', None)
+        if content is None and getattr(file, 'path', None):
+            with open(file.path, 'rb') as f:
+                content = f.read()
+        content = content or b''
+        file_doc = self.backend.new_document(file_id, {
+            'bucketId': bucket_id,
+            'name': getattr(file, 'filename', None) or file_id,
+            'sizeOriginal': len(content),
+            'mimeType': getattr(file, 'mime_type', None) or 'application/octet-stream'
+        }, permissions)
+        with self.backend.lock:
+            bucket = self.backend.buckets[bucket_id]
+            if file_doc['$id'] in bucket.documents:
+                raise AppwriteException(f"File with the requested ID '{file_doc['$id']}' already exists.", 409, 'storage_file_already_exists')
+            bucket.insert(file_doc)
+            self.backend.file_contents[(bucket_id, file_doc['$id'])] = content
+            return _copy_document(file_doc)
+
+    def seed_file(self, bucket_id, file_id, content=b'', created_at=None):
+        """Stores a file without counting a call or injecting latency."""
+        file_doc = self.backend.new_document(file_id, {'bucketId': bucket_id, 'name': file_id, 'sizeOriginal': len(content)}, None)
+        if created_at:
+            file_doc['$createdAt'] = file_doc['$updatedAt'] = created_at
+        with self.backend.lock:
+            self.backend.buckets[bucket_id].insert(file_doc)
+            self.backend.file_contents[(bucket_id, file_doc['$id'])] = content
+        return file_doc['$id']
+
+    def get_file(self, bucket_id, file_id):
+        self.backend.call('get_file', bucket_id)
+        with self.backend.lock:
+            file_doc = self.backend.buckets[bucket_id].documents.get(file_id)
+            if file_doc is None:
+                raise _not_found('File', file_id)
+            return _copy_document(file_doc)
+
+    def get_file_download(self, bucket_id, file_id):
+        self.backend.call('get_file_download', bucket_id)
+        with self.backend.lock:
+            if file_id not in self.backend.buckets[bucket_id].documents:
+                raise _not_found('File', file_id)
+            return self.backend.file_contents.get((bucket_id, file_id), b'')
+
+    def list_files(self, bucket_id, queries=None, search=None):
+        self.backend.call('list_files', bucket_id)
+        with self.backend.lock:
+            total, files = self.backend.buckets[bucket_id].query(queries)
+        return {'total': total, 'files': files}
+
+    def delete_file(self, bucket_id, file_id):
+        self.backend.call('delete_file', bucket_id)
+        with self.backend.lock:
+            bucket = self.backend.buckets[bucket_id]
+            if file_id not in bucket.documents:
+                raise _not_found('File', file_id)
+            bucket.remove(file_id)
+            self.backend.file_contents.pop((bucket_id, file_id), None)
+        return {}
+
+
+class FakeRequest:
+    def __init__(self, body=None, headers=None, path='/', method='POST'):
+        self.headers = {'x-appwrite-key': 'fake-api-key', **(headers or {})}
+        self.body_raw = json.dumps(body) if body is not None else ''
+        self.body = self.body_raw
+        self.body_json = body
+        self.path = path
+        self.method = method
+        self.query = {}
+
+
+class FakeResponse:
+    """Records what the function returned instead of sending it."""
+    def json(self, data, status_code=200, headers=None):
+        return {'statusCode': status_code, 'body': data}
+
+    def text(self, body, status_code=200, headers=None):
+        return {'statusCode': status_code, 'body': body}
+
+    def empty(self):
+        return {'statusCode': 204, 'body': None}
+
+
+class FakeContext:
+    """
+    A function `context` whose log and error lines are counted, with only the last
+    `keep_lines` kept. With `echo=True` every line is also printed.
+    """
+    def __init__(self, body=None, headers=None, keep_lines=200, echo=False):
+        self.req = FakeRequest(body, headers)
+        self.res = FakeResponse()
+        self.logs = collections.deque(maxlen=keep_lines)
+        self.errors = collections.deque(maxlen=keep_lines)
+        self.log_count = 0
+        self.error_count = 0
+        self.echo = echo
+        self.lock = threading.Lock()
+
+    def log(self, message):
+        with self.lock:
+            self.log_count += 1
+            self.logs.append(str(message))
+        if self.echo:
+            print(message)
+
+    def error(self, message):
+        with self.lock:
+            self.error_count += 1
+            self.errors.append(str(message))
+        if self.echo:
+            print(f"ERROR: {message}")
@@ -0,0 +1,197 @@
+"""
+Capturing the interaction queues of a live Appwrite project as replayable fixtures.
+
+Synthetic load spreads items evenly; real traffic has a few viral videos and deep reply chains
+in `commentsJson`. `capture` snapshots the queue collections, plus the `video_counts` and
+`accounts` documents they reference, into one gzipped JSONL file per collection:
+
+    APPWRITE_ENDPOINT=https://cloud.appwrite.io/v1 APPWRITE_PROJECT_ID=... APPWRITE_API_KEY=... \\
+        python functions/loadtest/fixtures.py capture functions/loadtest/fixtures/2026-10-19 --limit 50000
+
+The capture only reads. The fixtures hold production documents (names, comment text), so keep
+them out of the repository (functions/loadtest/fixtures/ is ignored). Replay them with `loadtest.py <function> --fixture <dir>`, which
+loads every file into the fake backend with its original IDs, permissions and timestamps.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+from appwrite.exception import AppwriteException
+from appwrite.query import Query
+
+# Configuration Constants
+DATABASE_ID = "database"
+FIXTURE_SUFFIX = '.jsonl.gz'
+MANIFEST_NAME = 'manifest.json'
+QUEUE_COLLECTION_IDS = ['video_interactions', 'comments-interactions', 'pending_views', 'account_interactions']
+VIDEO_COUNTS_COLLECTION_ID = "video_counts"
+ACCOUNTS_COLLECTION_ID = "accounts"
+PAGE_SIZE = 100
+USER_PERMISSION_PREFIX = 'update("user:'
+
+
+def _user_id(permissions):
+    for perm in permissions or []:
+        if perm.startswith(USER_PERMISSION_PREFIX) and perm.endswith('")'):
+            return perm[len(USER_PERMISSION_PREFIX):-2]
+    return None
+
+
+def capture_collection(databases, collection_id, limit, log):
+    """
+    Reads up to `limit` documents, oldest first. The managers keep deleting from the queue while
+    it is read, so when the cursor document disappears the read resumes from its creation time.
+    """
+    documents = []
+    seen_ids = set()
+    cursor = None
+    resume_from = None
+    while len(documents) < limit:
+        page_size = min(PAGE_SIZE, limit - len(documents))
+        queries = [Query.order_asc('$createdAt'), Query.limit(page_size)]
+        if resume_from:
+            queries.append(Query.greater_than_equal('$createdAt', resume_from))
+        if cursor:
+            queries.append(Query.cursor_after(cursor))
+        try:
+            page = databases.list_documents(DATABASE_ID, collection_id, queries).get('documents', [])
+        except AppwriteException as e:
+            if not cursor or e.code != 400 or not documents:
+                raise
+            log(f"Cursor {cursor} in {collection_id} was deleted during the capture. Resuming by creation time.")
+            resume_from = documents[-1]['$createdAt']
+            cursor = None
+            continue
+        for doc in page:
+            if doc['$id'] not in seen_ids:
+                seen_ids.add(doc['$id'])
+                documents.append(doc)
+        if len(page) < page_size:
+            break
+        cursor = page[-1]['$id']
+    return documents
+
+
+def fetch_documents_by_id(databases, collection_id, doc_ids):
+    """Fetches existing documents by ID, 100 per call. Missing IDs are skipped."""
+    doc_ids = sorted(doc_ids)
+    documents = []
+    for start in range(0, len(doc_ids), PAGE_SIZE):
+        chunk = doc_ids[start:start + PAGE_SIZE]
+        documents.extend(databases.list_documents(
+            DATABASE_ID, collection_id, [Query.equal('$id', chunk), Query.limit(len(chunk))]
+        ).get('documents', []))
+    return documents
+
+
+def referenced_ids(queue_documents):
+    """
+    Returns: A tuple (video_ids, account_ids) referenced by the captured queue documents
+    """
+    video_ids = set()
+    account_ids = set()
+    for documents in queue_documents.values():
+        for doc in documents:
+            if doc.get('videoId'):
+                video_ids.add(doc['videoId'])
+            if doc.get('targetAccountId'):
+                account_ids.add(doc['targetAccountId'])
+            user_id = _user_id(doc.get('$permissions'))
+            if user_id:
+                account_ids.add(user_id)
+    return video_ids, account_ids
+
+
+def write_fixture(path, documents):
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for doc in documents:
+            f.write(json.dumps(doc, separators=(',', ':'), ensure_ascii=False) + '\n')
+
+
+def read_fixture(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def capture(databases, out_dir, limit, log=print):
+    """
+    Writes the queue collections and the documents they reference to `out_dir`.
+    Returns: The manifest dict (collection ID -> document count, and the capture time)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    captured_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+    queue_documents = {}
+    for collection_id in QUEUE_COLLECTION_IDS:
+        queue_documents[collection_id] = capture_collection(databases, collection_id, limit, log)
+        log(f"Captured {len(queue_documents[collection_id])} documents from {collection_id}.")
+
+    video_ids, account_ids = referenced_ids(queue_documents)
+    snapshot = dict(queue_documents)
+    snapshot[VIDEO_COUNTS_COLLECTION_ID] = fetch_documents_by_id(databases, VIDEO_COUNTS_COLLECTION_ID, video_ids)
+    snapshot[ACCOUNTS_COLLECTION_ID] = fetch_documents_by_id(databases, ACCOUNTS_COLLECTION_ID, account_ids)
+    log(f"Captured {len(snapshot[VIDEO_COUNTS_COLLECTION_ID])} of {len(video_ids)} referenced video_counts "
+        f"and {len(snapshot[ACCOUNTS_COLLECTION_ID])} of {len(account_ids)} referenced accounts.")
+
+    for collection_id, documents in snapshot.items():
+        write_fixture(os.path.join(out_dir, collection_id + FIXTURE_SUFFIX), documents)
+    manifest = {
+        'capturedAt': captured_at,
+        'limitPerQueue': limit,
+        'collections': {collection_id: len(documents) for collection_id, documents in snapshot.items()}
+    }
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_fixture(backend, fixture_dir):
+    """
+    Loads every collection of a fixture directory into a FakeAppwrite, keeping IDs, permissions
+    and timestamps. Documents keep their captured order.
+    Returns: A dict collection ID -> list of loaded document IDs
+    """
+    loaded = {}
+    for file_name in sorted(os.listdir(fixture_dir)):
+        if not file_name.endswith(FIXTURE_SUFFIX):
+            continue
+        collection_id = file_name[:-len(FIXTURE_SUFFIX)]
+        loaded[collection_id] = [
+            backend.restore_document(collection_id, doc) for doc in read_fixture(os.path.join(fixture_dir, file_name))
+        ]
+    return loaded
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Capture interaction queues from Appwrite as replayable fixtures.")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    capture_parser = subcommands.add_parser('capture', help="Snapshot the queues and referenced documents")
+    capture_parser.add_argument('out_dir')
+    capture_parser.add_argument('--limit', type=int, default=100000, help="Documents per queue (default 100000)")
+    args = parser.parse_args(argv)
+
+    api_endpoint = os.environ.get("APPWRITE_ENDPOINT")
+    project_id = os.environ.get("APPWRITE_PROJECT_ID")
+    api_key = os.environ.get("APPWRITE_API_KEY")
+    if not all([api_endpoint, project_id, api_key]):
+        print("Set APPWRITE_ENDPOINT, APPWRITE_PROJECT_ID and APPWRITE_API_KEY (a key with read access to the database).")
+        return 1
+
+    # The shared client pools connections and retries throttled reads
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'shared'))
+    from appwrite.services.databases import Databases
+    from appwrite_client import create_client
+
+    databases = Databases(create_client(api_endpoint, project_id, api_key))
+    manifest = capture(databases, args.out_dir, args.limit)
+    print(json.dumps(manifest, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
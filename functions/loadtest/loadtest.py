@@ -0,0 +1,265 @@
+"""
+Load test for the queue-driven managers against the in-memory fake Appwrite.
+
+Seeds a queue with interactions, then calls the function's `main(context)` again and again,
+the way the schedule would, until the queue is empty:
+
+    python functions/loadtest/loadtest.py likes-manager --items 100000 --latency-ms 15 --error-rate 0.001
+
+With `--fixture <dir>` the queue and the documents it references come from a capture of real
+traffic instead (see fixtures.py). `--functions-dir` points at another checkout's `functions/`
+directory, so two versions can be compared on the same fixture.
+
+The report gives items per second of function time, API calls per item (by method) and the
+p50/p99 latency of an item: the time from the start of the first run until the function deleted
+the item's queue document. Every item is queued before that run, so the latency includes the time
+an item waited behind the rest of the backlog; the gaps between scheduled runs are not simulated.
+"""
+import argparse
+import collections
+import importlib.util
+import json
+import os
+import random
+import sys
+import threading
+import time
+import types
+
+from fake_appwrite import FakeAppwrite, FakeContext
+from fixtures import load_fixture
+
+# Configuration Constants
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ACCOUNTS_COLLECTION_ID = "accounts"
+
+
+def _user_permissions(user_id):
+    return [f'read("user:{user_id}")', f'update("user:{user_id}")', f'delete("user:{user_id}")']
+
+
+def _like_item(rng, index, users, videos):
+    return {'videoId': rng.choice(videos), 'type': rng.choice(['like', 'dislike'])}, rng.choice(users)
+
+
+def _comment_item(rng, index, users, videos):
+    return {
+        'videoId': rng.choice(videos),
+        'type': 'create',
+        'commentText': f"Load test comment {index}",
+        'temporaryClientId': f"loadtest-{index}"
+    }, rng.choice(users)
+
+
+def _subscription_item(rng, index, users, videos):
+    creators = users[:max(1, len(users) // 20)] # A few channels get most subscriptions
+    action = 'unsubscribe' if rng.random() < 0.1 else 'subscribe'
+    return {'type': action, 'targetAccountId': rng.choice(creators)}, rng.choice(users)
+
+
+def _view_item(rng, index, users, videos):
+    return {'videoId': rng.choice(videos)}, rng.choice(users)
+
+
+# Function -> (queue collection, item factory returning (data, user ID))
+SCENARIOS = {
+    'likes-manager': ('video_interactions', _like_item),
+    'comments-manager': ('comments-interactions', _comment_item),
+    'subscriptions-manager': ('account_interactions', _subscription_item),
+    'view-manager': ('pending_views', _view_item),
+}
+
+
+def load_function(function_name, functions_dir=FUNCTIONS_DIR):
+    """Imports <functions_dir>/<name>/src/main.py as a package module, so its relative imports work."""
+    src_dir = os.path.join(functions_dir, function_name, 'src')
+    package_name = 'loadtest_' + function_name.replace('-', '_')
+    package = types.ModuleType(package_name)
+    package.__path__ = [src_dir]
+    sys.modules[package_name] = package
+    spec = importlib.util.spec_from_file_location(f"{package_name}.main", os.path.join(src_dir, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def install_fakes(module, backend):
+    """Points the function module's client and services at the fake backend."""
+    module.create_client = lambda *args, **kwargs: backend
+    module.Databases = lambda client: backend.databases()
+    if hasattr(module, 'Storage'):
+        module.Storage = lambda client: backend.storage()
+
+
+def seed_queue(backend, collection_id, make_item, item_count, user_count, video_count, seed):
+    """
+    Seeds accounts and `item_count` queued interactions.
+    Returns: The IDs of the queue documents
+    """
+    rng = random.Random(seed)
+    users = [f"loadtest-user-{n}" for n in range(user_count)]
+    videos = [f"loadtest-video-{n}" for n in range(video_count)]
+    for n, user_id in enumerate(users):
+        backend.seed_document(ACCOUNTS_COLLECTION_ID, {'name': f"Load Test User {n}"}, document_id=user_id)
+    queued_ids = []
+    for index in range(item_count):
+        data, user_id = make_item(rng, index, users, videos)
+        queued_ids.append(backend.seed_document(collection_id, data, _user_permissions(user_id)))
+    return queued_ids
+
+
+def percentile(sorted_values, share):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(share * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_load_test(function_name, item_count=10000, user_count=None, video_count=None, latency_seconds=0.0,
+                  jitter_seconds=0.0, error_rate=0.0, seed=0, max_runs=1000, echo=False,
+                  fixture_dir=None, functions_dir=FUNCTIONS_DIR):
+    """
+    Seeds the function's queue (or loads a fixture) and runs the function until the queue is
+    empty, a run dequeues nothing or `max_runs` is reached.
+    Returns: A report dict
+    """
+    collection_id, make_item = SCENARIOS[function_name]
+    if fixture_dir:
+        user_count = video_count = None
+    else:
+        user_count = user_count or max(1, item_count // 10)
+        video_count = video_count or max(1, item_count // 100)
+
+    latencies = []
+    latencies_lock = threading.Lock()
+    pending_ids = set()
+    first_run_started_at = None
+
+    def on_delete(deleted_collection_id, document_id):
+        if deleted_collection_id != collection_id:
+            return
+        with latencies_lock:
+            if document_id in pending_ids:
+                pending_ids.discard(document_id)
+                latencies.append(time.monotonic() - first_run_started_at)
+
+    backend = FakeAppwrite(latency_seconds, jitter_seconds, error_rate, seed=seed, on_delete=on_delete)
+    seed_started_at = time.monotonic()
+    if fixture_dir:
+        pending_ids.update(load_fixture(backend, fixture_dir).get(collection_id, []))
+        item_count = len(pending_ids)
+    else:
+        pending_ids.update(seed_queue(backend, collection_id, make_item, item_count, user_count, video_count, seed))
+    seed_seconds = time.monotonic() - seed_started_at
+
+    module = load_function(function_name, functions_dir)
+    install_fakes(module, backend)
+
+    runs = []
+    function_seconds = 0.0
+    first_run_started_at = time.monotonic()
+    for _run in range(max_runs):
+        if backend.count(collection_id) == 0:
+            break
+        dequeued_before = len(latencies)
+        calls_before = backend.stats.total()
+        context = FakeContext(echo=echo)
+        run_started_at = time.monotonic()
+        response = module.main(context)
+        run_seconds = time.monotonic() - run_started_at
+        function_seconds += run_seconds
+        dequeued = len(latencies) - dequeued_before
+        runs.append({
+            'statusCode': response.get('statusCode') if isinstance(response, dict) else None,
+            'seconds': round(run_seconds, 3),
+            'dequeued': dequeued,
+            'apiCalls': backend.stats.total() - calls_before,
+            'errorLines': context.error_count
+        })
+        if dequeued == 0:
+            break
+
+    processed = len(latencies)
+    api_calls = backend.stats.total()
+    latencies.sort()
+    p50 = percentile(latencies, 0.50)
+    p99 = percentile(latencies, 0.99)
+    return {
+        'function': function_name,
+        'fixture': fixture_dir,
+        'items': item_count,
+        'users': user_count,
+        'videos': video_count,
+        'seedSeconds': round(seed_seconds, 3),
+        'runs': len(runs),
+        'processed': processed,
+        'remaining': backend.count(collection_id),
+        'functionSeconds': round(function_seconds, 3),
+        'itemsPerSecond': round(processed / function_seconds, 1) if function_seconds else None,
+        'apiCalls': api_calls,
+        'apiCallsPerItem': round(api_calls / processed, 2) if processed else None,
+        'apiCallsByMethod': dict(backend.stats.calls.most_common()),
+        'injectedErrors': backend.stats.injected_errors,
+        'latencyP50Seconds': round(p50, 3) if p50 is not None else None,
+        'latencyP99Seconds': round(p99, 3) if p99 is not None else None,
+        'runDetails': runs
+    }
+
+
+def format_report(report):
+    lines = [
+        f"{report['function']}: {report['processed']}/{report['items']} items in {report['runs']} runs "
+        f"({report['functionSeconds']}s of function time, {report['remaining']} left in the queue)",
+        f"  items/s           {report['itemsPerSecond']}",
+        f"  API calls/item    {report['apiCallsPerItem']} ({report['apiCalls']} calls, {report['injectedErrors']} injected errors)",
+        f"  latency p50/p99   {report['latencyP50Seconds']}s / {report['latencyP99Seconds']}s",
+        "  calls by method:",
+    ]
+    for method, count in report['apiCallsByMethod'].items():
+        per_item = count / report['processed'] if report['processed'] else 0
+        lines.append(f"    {method:<30} {count:>10} ({per_item:.2f}/item)")
+    status_codes = collections.Counter(run['statusCode'] for run in report['runDetails'])
+    lines.append("  run status codes: " + ", ".join(f"{code}: {count}" for code, count in sorted(status_codes.items(), key=str)))
+    return "\n".join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Load test a queue-driven function against an in-memory Appwrite.")
+    parser.add_argument('function', choices=sorted(SCENARIOS))
+    parser.add_argument('--items', type=int, default=10000, help="Interactions to queue (default 10000)")
+    parser.add_argument('--users', type=int, help="Distinct users (default items/10)")
+    parser.add_argument('--videos', type=int, help="Distinct videos (default items/100)")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Latency added to every API call")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="Uniform ± jitter on the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of API calls that fail with a 503")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-runs', type=int, default=1000)
+    parser.add_argument('--fixture', metavar='DIR', help="Replay a captured fixture instead of synthetic items")
+    parser.add_argument('--functions-dir', default=FUNCTIONS_DIR, help="functions/ directory to load the function from")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help="Environment variable for the function, e.g. DB_CONCURRENCY=16 (repeatable)")
+    parser.add_argument('--verbose', action='store_true', help="Print the function's log lines")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    # Read by the functions at import time
+    os.environ.setdefault("APPWRITE_FUNCTION_API_ENDPOINT", "http://fake-appwrite/v1")
+    os.environ.setdefault("APPWRITE_FUNCTION_PROJECT_ID", "loadtest")
+    for assignment in args.env:
+        key, _, value = assignment.partition('=')
+        os.environ[key] = value
+
+    report = run_load_test(
+        args.function, args.items, args.users, args.videos,
+        latency_seconds=args.latency_ms / 1000, jitter_seconds=args.jitter_ms / 1000,
+        error_rate=args.error_rate, seed=args.seed, max_runs=args.max_runs, echo=args.verbose,
+        fixture_dir=args.fixture, functions_dir=os.path.abspath(args.functions_dir)
+    )
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,129 @@
+from appwrite.services.databases import Databases
+from appwrite.services.functions import Functions
+from appwrite.exception import AppwriteException
+from appwrite.query import Query
+from concurrent.futures import ThreadPoolExecutor
+import os
+import json
+import traceback
+
+from .appwrite_client import create_client
+from .metrics import instrumented, stage
+from .partitions import QUEUE_PARTITIONS
+from .profiling import profiled
+
+# Configuration Constants
+DATABASE_ID = "database"
+BACKLOG_COUNT_CAP = 5000 # Appwrite caps list totals; a backlog this large may be larger still
+ACTIVE_EXECUTION_STATUSES = ['waiting', 'processing']
+
+# Worker function ID -> (queue collection, extra queries selecting the queued documents)
+# The interaction managers drain hash partitions of their queue; see shared/partitions.py
+DISPATCH_TARGETS = {
+    'likes-manager': ("video_interactions", []),
+    'comments-manager': ("comments-interactions", []),
+    'subscriptions-manager': ("account_interactions", []),
+    'videos-manager': ("video-processing", [Query.equal('status', 'pending')]),
+}
+PARTITIONED_WORKERS = {'likes-manager', 'comments-manager', 'subscriptions-manager'}
+
+def count_queue(databases, collection_id, queries):
+    """Queued documents, read from the total of a one-document page."""
+    return databases.list_documents(
+        DATABASE_ID, collection_id, queries + [Query.select(['$id']), Query.limit(1)]
+    ).get('total', 0)
+
+def active_executions(functions, function_id):
+    """Executions of the worker still waiting or running, so workers are not started twice."""
+    executions = functions.list_executions(
+        function_id, [Query.select(['$id']), Query.equal('status', ACTIVE_EXECUTION_STATUSES), Query.limit(1)]
+    )
+    return executions.get('total', 0)
+
+def dispatch_body(backlog):
+    """Caps the worker's run at the counted backlog. A capped count may hide more, so then no cap is sent."""
+    return json.dumps({"maxItems": backlog} if backlog < BACKLOG_COUNT_CAP else {})
+
+def dispatch_bodies(function_id, backlog):
+    """
+    One body per execution to start. A partitioned worker gets one execution per partition worker;
+    its backlog is not counted per partition, so no cap is sent.
+    """
+    if function_id in PARTITIONED_WORKERS and QUEUE_PARTITIONS > 1:
+        return [json.dumps({"partition": worker, "partitions": QUEUE_PARTITIONS}) for worker in range(QUEUE_PARTITIONS)]
+    return [dispatch_body(backlog)]
+
+@instrumented("queue-dispatcher")
+@profiled
+def main(context):
+    context.log("--- Queue Dispatcher Start ---")
+
+    # --- Environment & Auth Check ---
+    api_endpoint = os.environ.get("APPWRITE_FUNCTION_API_ENDPOINT")
+    project_id = os.environ.get("APPWRITE_FUNCTION_PROJECT_ID")
+    api_key = context.req.headers.get('x-appwrite-key')
+
+    if not all([api_endpoint, project_id, api_key]):
+        message = "Function configuration error: Missing endpoint, project ID, or API key."
+        context.error(message)
+        return context.res.json({"success": False, "message": message}, 500)
+
+    # --- Initialize Appwrite Client ---
+    client = create_client(api_endpoint, project_id, api_key)
+    databases = Databases(client)
+    functions = Functions(client)
+
+    backlogs = {}
+    dispatched = []
+    skipped_running = []
+    failed = []
+
+    try:
+        # --- Count Every Queue Concurrently ---
+        with stage('count_queues'), ThreadPoolExecutor(max_workers=len(DISPATCH_TARGETS)) as executor:
+            futures = {
+                function_id: executor.submit(count_queue, databases, collection_id, queries)
+                for function_id, (collection_id, queries) in DISPATCH_TARGETS.items()
+            }
+            for function_id, future in futures.items():
+                try:
+                    backlogs[function_id] = future.result()
+                except AppwriteException as e:
+                    context.error(f"Failed to count the queue of {function_id}: {e}")
+                    failed.append(function_id)
+
+        # --- Start Only the Workers That Have Work ---
+        for function_id, backlog in backlogs.items():
+            if backlog == 0:
+                continue
+            try:
+                with stage('dispatch'):
+                    bodies = dispatch_bodies(function_id, backlog)
+                    # With partitions it is not known which ones are running. All are started again;
+                    # the executions of partitions that are still running exit after one lease request.
+                    if active_executions(functions, function_id) >= len(bodies):
+                        skipped_running.append(function_id)
+                        continue
+                    for body in bodies:
+                        functions.create_execution(function_id, body=body, xasync=True)
+                dispatched.append(function_id)
+                context.log(f"Started {len(bodies)} execution(s) of {function_id} for a backlog of {backlog}{'+' if backlog >= BACKLOG_COUNT_CAP else ''}.")
+            except AppwriteException as e:
+                context.error(f"Failed to start {function_id}: {e}")
+                failed.append(function_id)
+
+        context.log(f"Dispatch finished. Started: {len(dispatched)}, Still running: {len(skipped_running)}, Failed: {len(failed)}")
+        return context.res.json({
+            "success": True,
+            "backlogs": backlogs,
+            "dispatched": dispatched,
+            "skippedRunning": skipped_running,
+            "failed": failed
+        })
+
+    except Exception as e:
+        context.error(f"An unexpected error occurred during dispatch: {e}")
+        context.error(traceback.format_exc())
+        return context.res.json({"success": False, "message": f"Unexpected Error: {str(e)}"}, 500)
+    finally:
+        context.log("--- Queue Dispatcher End ---")
@@ -0,0 +1,159 @@
+"""
+A shared Appwrite client with pooled keep-alive connections, retries and a circuit breaker.
+
+The SDK's Client sends every call through a bare `requests.request`, which opens a new
+connection each time. `create_client` routes those calls through one module-level
+`requests.Session` instead, so connections are reused across calls and across warm
+invocations of the same runtime.
+
+Calls that fail with 429, 5xx or a network error are retried with jittered exponential
+backoff, waiting at least as long as the `Retry-After` header asks. Only idempotent methods
+are retried on 5xx/network errors; a POST is retried only on 429, which Appwrite returns
+before doing any work. After CIRCUIT_BREAKER_THRESHOLD consecutive failed calls the breaker
+opens and every call fails fast with CircuitOpenError (an AppwriteException with code 503)
+for CIRCUIT_BREAKER_COOLDOWN_SECONDS, so a run stops hammering a degraded Appwrite and
+finishes early instead.
+
+Every request is timed and reported to metrics.py, which counts it for the run in progress.
+"""
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import appwrite.client as sdk_client
+from appwrite.client import Client
+from appwrite.exception import AppwriteException
+
+try:
+    from .metrics import record_api_call
+except ImportError: # Imported outside a function package, e.g. by the load-test tools
+    def record_api_call(method, path, seconds, failed):
+        pass
+
+# Configuration Constants
+POOL_SIZE = int(os.environ.get("APPWRITE_POOL_SIZE", "16")) # Keep-alive connections per host
+MAX_RETRIES = int(os.environ.get("APPWRITE_MAX_RETRIES", "3"))
+RETRY_BASE_SECONDS = float(os.environ.get("APPWRITE_RETRY_BASE_SECONDS", "0.25"))
+RETRY_MAX_SECONDS = float(os.environ.get("APPWRITE_RETRY_MAX_SECONDS", "8"))
+CIRCUIT_BREAKER_THRESHOLD = int(os.environ.get("APPWRITE_BREAKER_THRESHOLD", "8"))
+CIRCUIT_BREAKER_COOLDOWN_SECONDS = float(os.environ.get("APPWRITE_BREAKER_COOLDOWN_SECONDS", "30"))
+
+IDEMPOTENT_METHODS = {'get', 'put', 'patch', 'delete'}
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(AppwriteException):
+    def __init__(self, retry_in):
+        super().__init__(f"Appwrite circuit breaker is open, retrying in {retry_in:.0f}s", 503)
+
+
+class _PooledRequests:
+    """Stands in for the `requests` module inside the SDK, sending through a shared Session."""
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.local = threading.local()
+
+    def request(self, **kwargs):
+        response = self.session.request(**kwargs)
+        self.local.retry_after = response.headers.get('Retry-After')
+        return response
+
+    def last_retry_after(self):
+        """Seconds asked for by the last response on this thread, or None."""
+        value = getattr(self.local, 'retry_after', None)
+        self.local.retry_after = None
+        try:
+            return max(0.0, float(value)) if value is not None else None
+        except ValueError: # HTTP-date form, not sent by Appwrite
+            return None
+
+    def __getattr__(self, name): # Everything else (exceptions, etc.) from the real module
+        return getattr(requests, name)
+
+
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def check(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(remaining)
+            self.opened_at = None # Half-open: let calls through, one more failure reopens it
+            self.consecutive_failures = self.threshold - 1
+
+    def record(self, success):
+        with self.lock:
+            if success:
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    def is_open(self):
+        with self.lock:
+            return self.opened_at is not None and time.monotonic() < self.opened_at + self.cooldown
+
+
+_pooled_requests = _PooledRequests()
+sdk_client.requests = _pooled_requests # Installed once per runtime; all Clients share the pool
+circuit_breaker = CircuitBreaker(CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_COOLDOWN_SECONDS)
+
+
+def _is_degraded(error):
+    code = error.code or 0
+    return code in RETRYABLE_STATUS_CODES or code == 0 # 0: no response (connection error/timeout)
+
+
+def _is_retryable(method, error):
+    if error.code == 429:
+        return True
+    return method.lower() in IDEMPOTENT_METHODS and _is_degraded(error)
+
+
+class ResilientClient(Client):
+    def call(self, method, path='', headers=None, params=None, response_type='json'):
+        for attempt in range(MAX_RETRIES + 1):
+            circuit_breaker.check()
+            started_at = time.perf_counter()
+            try:
+                result = super().call(method, path, headers, params, response_type)
+                record_api_call(method, path, time.perf_counter() - started_at, False)
+                circuit_breaker.record(True)
+                return result
+            except AppwriteException as e:
+                record_api_call(method, path, time.perf_counter() - started_at, True)
+                # 4xx answers other than 429 mean Appwrite is healthy, only the request was refused
+                circuit_breaker.record(not _is_degraded(e))
+                retryable = _is_retryable(method, e)
+                if not retryable or attempt == MAX_RETRIES:
+                    raise
+                delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** attempt))
+                delay = random.uniform(delay / 2, delay) # Jitter so parallel callers do not retry in lockstep
+                retry_after = _pooled_requests.last_retry_after()
+                if retry_after is not None:
+                    if retry_after > RETRY_MAX_SECONDS: # Longer than we may wait inside one function run
+                        raise
+                    delay = max(delay, retry_after)
+                time.sleep(delay)
+
+
+def create_client(api_endpoint, project_id, api_key):
+    client = ResilientClient()
+    client.set_endpoint(api_endpoint).set_project(project_id).set_key(api_key)
+    return client
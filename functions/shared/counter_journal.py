@@ -0,0 +1,146 @@
+"""
+Exactly-once application of queued interactions to counter documents.
+
+Applying a batch of interactions takes several writes: the per-user state documents (or
+subscription edges), the counter document and the deletes of the queued interactions. A run that
+crashes or times out between them must not apply the batch a second time.
+
+Before any of those writes, a run records the batch's outcome in `counter_journal`, one entry per
+counter document (video or channel) per page. The entry holds the counter deltas, the final state
+per user and the IDs of the interactions it covers:
+
+    entry = record_journal_entry(databases, 'likes', video_id, deltas, states, interaction_ids)
+    finish_journal_entry(databases, entry, apply_states, apply_deltas, 'video_interactions')
+
+finish_journal_entry applies the recorded states, which are absolute and so safe to repeat. It then
+writes the deltas through update_versioned, with journal_key(entry) as idempotency key, and deletes
+the interactions, then the entry. A run that later meets an interaction covered by an entry finishes
+that entry instead of processing the interaction again (find_journal_entries). Its deltas are
+skipped if the counter document already lists the key in `appliedKeys`.
+
+Entries are normally deleted within the run. counts-compactor deletes any left over for
+JOURNAL_RETENTION_SECONDS once none of their interactions are queued.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+from appwrite.exception import AppwriteException
+from appwrite.id import ID
+from appwrite.query import Query
+
+# Configuration Constants
+DATABASE_ID = "database"
+COUNTER_JOURNAL_COLLECTION_ID = "counter_journal"
+JOURNAL_LOOKUP_LIMIT = 100 # Appwrite's limit on the values of one query, and on a page
+JOURNAL_RETENTION_SECONDS = 86400
+
+
+def _parse_entry(doc):
+    return {
+        '$id': doc['$id'],
+        'source': doc.get('source'),
+        'target': doc.get('target'),
+        'deltas': json.loads(doc.get('deltas') or '{}'),
+        'states': json.loads(doc.get('states') or '{}'),
+        'interactionIds': list(doc.get('interactionIds') or [])
+    }
+
+
+def find_journal_entries(databases, source, interaction_ids):
+    """
+    Unfinished journal entries of `source` covering any of `interaction_ids`, oldest first.
+    Returns: A list of entries as returned by record_journal_entry
+    """
+    entries = {}
+    interaction_ids = list(interaction_ids)
+    for start in range(0, len(interaction_ids), JOURNAL_LOOKUP_LIMIT):
+        documents = databases.list_documents(DATABASE_ID, COUNTER_JOURNAL_COLLECTION_ID, [
+            Query.equal('source', source),
+            Query.contains('interactionIds', interaction_ids[start:start + JOURNAL_LOOKUP_LIMIT]),
+            Query.limit(JOURNAL_LOOKUP_LIMIT)
+        ]).get('documents', [])
+        for doc in documents:
+            entries.setdefault(doc['$id'], (doc.get('$createdAt') or '', _parse_entry(doc)))
+    return [entry for _created_at, entry in sorted(entries.values(), key=lambda item: item[0])]
+
+
+def record_journal_entry(databases, source, target, deltas, states, interaction_ids):
+    """
+    Records a batch's outcome before any of it is applied.
+    Returns: The entry: a dict with $id, source, target, deltas, states and interactionIds
+    """
+    data = {
+        'source': source,
+        'target': target,
+        'deltas': json.dumps(deltas, separators=(',', ':')),
+        'states': json.dumps(states, separators=(',', ':')),
+        'interactionIds': list(interaction_ids)
+    }
+    doc = databases.create_document(DATABASE_ID, COUNTER_JOURNAL_COLLECTION_ID, ID.unique(), data)
+    return _parse_entry({**data, '$id': doc['$id']})
+
+
+def journal_key(entry):
+    """The idempotency key of an entry's counter write: `<source>:<entry ID>`."""
+    return f"{entry['source']}:{entry['$id']}"
+
+
+def _delete_if_exists(databases, collection_id, document_id):
+    try:
+        databases.delete_document(DATABASE_ID, collection_id, document_id)
+    except AppwriteException as e:
+        if e.code != 404:
+            raise
+
+
+def apply_journal_entry(entry, apply_states, apply_deltas):
+    """
+    Applies a recorded batch without dequeuing it: `apply_states(entry)`, then `apply_deltas(entry)`
+    (which must pass journal_key(entry) as idempotency key). Both may be repeated.
+    """
+    apply_states(entry)
+    if any(entry['deltas'].values()):
+        apply_deltas(entry)
+
+
+def delete_journal_entry(databases, entry):
+    """Deletes a finished entry, once its interactions are dequeued."""
+    _delete_if_exists(databases, COUNTER_JOURNAL_COLLECTION_ID, entry['$id'])
+
+
+def finish_journal_entry(databases, entry, apply_states, apply_deltas, queue_collection_id):
+    """
+    Applies a recorded batch (apply_journal_entry), then dequeues the interactions and deletes the
+    entry. Any step may be repeated, so a failure leaves the entry for the next run to finish.
+    Raises: Whatever a step raised; the entry is then kept
+    """
+    apply_journal_entry(entry, apply_states, apply_deltas)
+    for interaction_id in entry['interactionIds']:
+        _delete_if_exists(databases, queue_collection_id, interaction_id)
+    delete_journal_entry(databases, entry)
+
+
+def purge_finished_entries(databases, queue_collection_by_source, max_entries=100):
+    """
+    Deletes entries older than JOURNAL_RETENTION_SECONDS whose interactions are all gone from the
+    queue: their run applied them but failed to delete the entry itself. An entry whose
+    interactions are still queued is left for the next run of its queue to finish.
+    Returns: The number deleted
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=JOURNAL_RETENTION_SECONDS)).isoformat()
+    documents = databases.list_documents(DATABASE_ID, COUNTER_JOURNAL_COLLECTION_ID, [
+        Query.less_than('$createdAt', cutoff), Query.limit(max_entries)
+    ]).get('documents', [])
+    deleted = 0
+    for doc in documents:
+        queue_collection_id = queue_collection_by_source.get(doc.get('source'))
+        interaction_ids = list(doc.get('interactionIds') or [])[:JOURNAL_LOOKUP_LIMIT]
+        if not queue_collection_id:
+            continue
+        if interaction_ids and databases.list_documents(DATABASE_ID, queue_collection_id, [
+            Query.equal('$id', interaction_ids), Query.select(['$id']), Query.limit(1)
+        ]).get('total', 0) > 0:
+            continue
+        _delete_if_exists(databases, COUNTER_JOURNAL_COLLECTION_ID, doc['$id'])
+        deleted += 1
+    return deleted
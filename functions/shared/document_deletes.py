@@ -0,0 +1,60 @@
+"""
+Deleting many documents with bounded concurrency.
+
+A 404 counts as deleted, so every helper here is safe to call again with ids that may already
+be gone. Retries of 429 and 5xx responses happen in the shared client (appwrite_client.py).
+When the SDK has the bulk delete endpoint (Appwrite 1.7+) a batch is deleted with one call per
+100 ids instead.
+"""
+import concurrent.futures
+import os
+
+from appwrite.exception import AppwriteException
+from appwrite.query import Query
+
+# Configuration Constants
+DATABASE_ID = "database"
+DELETE_CONCURRENCY = int(os.environ.get("DELETE_CONCURRENCY", "8"))
+BULK_DELETE_CHUNK_SIZE = 100
+
+
+def delete_if_exists(databases, collection_id, doc_id):
+    """Deletes one document. A 404 counts as deleted."""
+    try:
+        databases.delete_document(DATABASE_ID, collection_id, doc_id)
+    except AppwriteException as e:
+        if e.code != 404:
+            raise
+
+
+def bulk_delete(databases, collection_id, doc_ids):
+    """Deletes documents with the bulk delete endpoint (Appwrite 1.7+), 100 ids per call."""
+    for start in range(0, len(doc_ids), BULK_DELETE_CHUNK_SIZE):
+        chunk = doc_ids[start:start + BULK_DELETE_CHUNK_SIZE]
+        databases.delete_documents(DATABASE_ID, collection_id, [Query.equal('$id', chunk)])
+
+
+def delete_documents_concurrently(databases, collection_id, doc_ids, context):
+    """
+    Deletes documents through a bounded thread pool (or the bulk endpoint when the SDK has it).
+    Returns: A tuple (deleted_count, failed_ids)
+    """
+    if not doc_ids:
+        return 0, []
+    if hasattr(databases, 'delete_documents'):
+        try:
+            bulk_delete(databases, collection_id, doc_ids)
+            return len(doc_ids), []
+        except AppwriteException as e:
+            context.log(f"Bulk delete unavailable or failed ({e}). Falling back to concurrent single deletes.")
+
+    failed_ids = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=DELETE_CONCURRENCY) as executor:
+        futures = {executor.submit(delete_if_exists, databases, collection_id, doc_id): doc_id for doc_id in doc_ids}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as delete_err:
+                context.error(f"Failed to delete document {futures[future]} from {collection_id}: {delete_err}")
+                failed_ids.append(futures[future])
+    return len(doc_ids) - len(failed_ids), failed_ids
@@ -0,0 +1,180 @@
+"""
+Per-run stage timings and Appwrite call counts, reported by every function.
+
+Decorating `main` with `instrumented` starts a RunMetrics for the run. Code marks its stages with
+`stage`, and the shared client (appwrite_client.py) reports every request it sends, timed and
+keyed by operation and collection or bucket:
+
+    @instrumented("likes-manager")
+    def main(context):
+        with stage('fetch'):
+            ...
+
+Every dict passed to `context.res.json` gets a compact "metrics" entry, and one JSON log line
+starting with `run_metrics` is written when the run ends. Stage times are wall-clock time summed
+over every entry into the stage; a stage entered from several threads at once can add up to more
+than the run took, and a nested stage is also counted in its parent. Recording costs two
+perf_counter reads and a dict update, so it stays on in production.
+"""
+import contextlib
+import functools
+import json
+import threading
+import time
+
+# Configuration Constants
+CALL_LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500] # Upper bounds; slower calls go in the last bucket
+
+# Path segment after the collection or bucket ID -> operation, by HTTP method
+_DOCUMENT_OPERATIONS = {
+    ('GET', False): 'list_documents', ('POST', False): 'create_document',
+    ('PATCH', False): 'update_documents', ('DELETE', False): 'delete_documents',
+    ('GET', True): 'get_document', ('PATCH', True): 'update_document',
+    ('PUT', True): 'upsert_document', ('DELETE', True): 'delete_document',
+}
+_FILE_OPERATIONS = {
+    ('GET', False): 'list_files', ('POST', False): 'create_file',
+    ('GET', True): 'get_file', ('PUT', True): 'update_file', ('DELETE', True): 'delete_file',
+}
+
+
+def describe_call(method, path):
+    """
+    Names an Appwrite REST call after the SDK method that makes it.
+    Returns: A tuple (operation, resource), where resource is the collection or bucket ID
+    """
+    method = method.upper()
+    parts = path.strip('/').split('/')
+    if parts[0] == 'databases' and 'collections' in parts:
+        index = parts.index('collections')
+        resource = parts[index + 1] if len(parts) > index + 1 else '-'
+        rest = parts[index + 2:]
+        if rest[:1] == ['documents']:
+            if len(rest) == 4 and rest[3] in ('increment', 'decrement'):
+                return f"{rest[3]}_document_attribute", resource
+            return _DOCUMENT_OPERATIONS.get((method, len(rest) > 1), method.lower() + '_document'), resource
+    if parts[0] == 'storage' and len(parts) > 3 and parts[1] == 'buckets' and parts[3] == 'files':
+        rest = parts[4:]
+        if len(rest) == 2:
+            return f"get_file_{rest[1]}", parts[2] # download, view, preview
+        return _FILE_OPERATIONS.get((method, bool(rest)), method.lower() + '_file'), parts[2]
+    return f"{method.lower()} /{parts[0]}", '-'
+
+
+class RunMetrics:
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.started_at = time.perf_counter()
+        self.lock = threading.Lock()
+        self.stages = {} # name -> [count, seconds]
+        self.calls = {} # resource -> operation -> count
+        self.call_count = 0
+        self.call_errors = 0
+        self.call_seconds = 0.0
+        self.call_latency_counts = [0] * (len(CALL_LATENCY_BUCKETS_MS) + 1)
+
+    def add_stage(self, name, seconds):
+        with self.lock:
+            totals = self.stages.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def add_call(self, operation, resource, seconds, failed):
+        milliseconds = seconds * 1000
+        bucket = 0
+        while bucket < len(CALL_LATENCY_BUCKETS_MS) and milliseconds >= CALL_LATENCY_BUCKETS_MS[bucket]:
+            bucket += 1
+        with self.lock:
+            by_operation = self.calls.setdefault(resource, {})
+            by_operation[operation] = by_operation.get(operation, 0) + 1
+            self.call_count += 1
+            self.call_errors += failed
+            self.call_seconds += seconds
+            self.call_latency_counts[bucket] += 1
+
+    def summary(self):
+        """The compact form included in responses."""
+        with self.lock:
+            latency = {}
+            for bucket, count in enumerate(self.call_latency_counts):
+                if count:
+                    label = f"<{CALL_LATENCY_BUCKETS_MS[bucket]}" if bucket < len(CALL_LATENCY_BUCKETS_MS) else f">={CALL_LATENCY_BUCKETS_MS[-1]}"
+                    latency[label] = count
+            return {
+                "durationMs": round((time.perf_counter() - self.started_at) * 1000),
+                "stages": {name: {"count": count, "ms": round(seconds * 1000, 1)} for name, (count, seconds) in self.stages.items()},
+                "apiCalls": self.call_count,
+                "apiCallErrors": self.call_errors,
+                "apiCallMs": round(self.call_seconds * 1000, 1),
+                "callLatencyMs": latency,
+                "calls": {resource: dict(by_operation) for resource, by_operation in self.calls.items()}
+            }
+
+    def log_line(self):
+        return "run_metrics " + json.dumps({"function": self.function_name, **self.summary()}, separators=(',', ':'))
+
+
+_active_run = None # The run in progress in this runtime, if any
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Times a block of the current run as `name`. Does nothing outside an instrumented run."""
+    run = _active_run
+    if run is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.add_stage(name, time.perf_counter() - started_at)
+
+
+def record_api_call(method, path, seconds, failed):
+    """Called by the shared client after every request it sends."""
+    run = _active_run
+    if run is not None:
+        operation, resource = describe_call(method, path)
+        run.add_call(operation, resource, seconds, failed)
+
+
+class _MeteredResponse:
+    """Adds the run's metrics to JSON object responses; everything else passes through."""
+    def __init__(self, res, run):
+        self._res = res
+        self._run = run
+
+    def json(self, data, *args, **kwargs):
+        if isinstance(data, dict):
+            data = {**data, "metrics": self._run.summary()}
+        return self._res.json(data, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._res, name)
+
+
+class _MeteredContext:
+    def __init__(self, context, run):
+        self._context = context
+        self.res = _MeteredResponse(context.res, run)
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+
+def instrumented(function_name):
+    """Decorates a function's `main` so each run collects and reports its metrics."""
+    def decorator(main):
+        @functools.wraps(main)
+        def wrapper(context):
+            global _active_run
+            run = RunMetrics(function_name)
+            _active_run = run
+            try:
+                return main(_MeteredContext(context, run))
+            finally:
+                _active_run = None
+                context.log(run.log_line())
+        return wrapper
+    return decorator
@@ -0,0 +1,143 @@
+"""
+Hash partitions of the interaction queues, so up to PARTITION_SLOTS workers can drain one queue
+in parallel without two of them touching the same video or channel.
+
+Clients store `partition = fnv1a(key) % PARTITION_SLOTS` on every queued document
+(src/lib/queuePartition.js), where the key is the document's videoId, or targetAccountId for
+subscriptions. All documents of one key share a slot, so per-key ordering holds as long as one
+run at a time processes a slot.
+
+A run owns a slot while it holds the slot's lease document in `run_locks`. With
+QUEUE_PARTITIONS = N, worker i of N tries the slots `s % N == i`; queue-dispatcher starts one
+execution per worker, and an event run takes the worker of its document's slot. Ownership comes
+only from the leases, so changing N while runs are in flight is safe: a slot that is still leased
+under the old N is skipped until its holder releases it.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from appwrite.exception import AppwriteException
+from appwrite.query import Query
+
+from .run_lock import DATABASE_ID, acquire_run_lock, acquire_run_locks, is_event_run, release_run_lock
+
+# Configuration Constants
+PARTITION_SLOTS = 16 # Range of the `partition` attribute; changing it means re-partitioning the queues
+QUEUE_PARTITIONS = max(1, min(PARTITION_SLOTS, int(os.environ.get("QUEUE_PARTITIONS", "1")))) # Workers per queue
+PARTITION_ATTRIBUTE = 'partition'
+UNASSIGNED_PAGE_SIZE = 100 # Legacy documents given a partition per page
+ASSIGN_TIME_BUDGET_SHARE = 0.2 # Share of the timeout a run may spend assigning partitions
+LEASE_CONCURRENCY = 8
+
+
+def partition_of(key):
+    """32-bit FNV-1a of the key's UTF-8 bytes, modulo PARTITION_SLOTS. Matches queuePartition.js."""
+    hash_value = 0x811c9dc5
+    for byte in (key or '').encode('utf-8'):
+        hash_value = ((hash_value ^ byte) * 0x01000193) & 0xffffffff
+    return hash_value % PARTITION_SLOTS
+
+
+def worker_slots(worker, workers=QUEUE_PARTITIONS):
+    return [slot for slot in range(PARTITION_SLOTS) if slot % workers == worker]
+
+
+def run_slots(context, key_attribute):
+    """
+    The slots this run tries to lease: its worker's slots when queue-dispatcher sent
+    {"partition": i} or the run was started by a queued document's event, and every slot otherwise.
+    """
+    try:
+        body = json.loads(context.req.body_raw or '{}')
+    except (ValueError, AttributeError):
+        body = {}
+    if not isinstance(body, dict):
+        body = {}
+    if is_event_run(context):
+        slot = body.get(PARTITION_ATTRIBUTE)
+        if not isinstance(slot, int) or not 0 <= slot < PARTITION_SLOTS:
+            slot = partition_of(body.get(key_attribute))
+        return worker_slots(slot % QUEUE_PARTITIONS)
+    worker = body.get('partition')
+    workers = body.get('partitions', QUEUE_PARTITIONS)
+    if isinstance(worker, int) and isinstance(workers, int) and 0 <= worker < workers <= PARTITION_SLOTS:
+        return worker_slots(worker, workers)
+    return list(range(PARTITION_SLOTS))
+
+
+def _lease_id(lock_prefix, slot):
+    return f"{lock_prefix}-{slot}"
+
+
+def lease_partitions(databases, lock_prefix, slots, lease_seconds):
+    """
+    Leases as many of `slots` as are free. If the first slot is held, the worker is assumed busy
+    and no more are tried, so a run that is coalesced costs one or two requests.
+    Returns: A dict slot -> lease token, empty if no slot could be leased
+    """
+    if not slots:
+        return {}
+    first_holder = acquire_run_lock(databases, _lease_id(lock_prefix, slots[0]), lease_seconds)
+    if not first_holder:
+        return {}
+    leases = {slots[0]: first_holder}
+    holders = acquire_run_locks(databases, [_lease_id(lock_prefix, slot) for slot in slots[1:]], lease_seconds)
+    leases.update((slot, holders[_lease_id(lock_prefix, slot)]) for slot in slots[1:] if _lease_id(lock_prefix, slot) in holders)
+    return leases
+
+
+def release_partitions(databases, leases):
+    """
+    Releases the run's leases. Each release touches only the lease generation this run took, so a
+    lease taken over after it expired is left with its new holder. A failed release leaves the
+    lease to expire on its own.
+    """
+    if leases:
+        with ThreadPoolExecutor(max_workers=min(len(leases), LEASE_CONCURRENCY)) as executor:
+            list(executor.map(lambda holder: release_run_lock(databases, holder), list(leases.values())))
+
+
+def partition_queries(leases):
+    """Queries selecting the queued documents of the leased slots."""
+    return [Query.equal(PARTITION_ATTRIBUTE, sorted(leases))]
+
+
+def assign_missing_partitions(databases, collection_id, key_attribute, context, deadline):
+    """
+    Stores the partition on documents queued without one (by clients older than the partitioning),
+    so the owner of their slot picks them up. Any worker does this, a page at a time, until none
+    are left or `deadline` (a time.monotonic() value) passes; the rest of the run stays for the
+    drain. Every write is the same value, so runs can overlap.
+    Returns: The number of documents assigned
+    """
+    assigned = 0
+    cursor = None # Assigned documents leave the result set, so the cursor only skips past failures
+
+    def assign(doc):
+        try:
+            databases.update_document(DATABASE_ID, collection_id, doc['$id'], {
+                PARTITION_ATTRIBUTE: partition_of(doc.get(key_attribute))
+            })
+            return True
+        except AppwriteException as e:
+            context.warning("Failed to assign a partition to %s in %s: %s", doc['$id'], collection_id, e)
+            return False
+
+    with ThreadPoolExecutor(max_workers=LEASE_CONCURRENCY) as executor:
+        while time.monotonic() < deadline:
+            queries = [Query.is_null(PARTITION_ATTRIBUTE), Query.limit(UNASSIGNED_PAGE_SIZE)]
+            if cursor:
+                queries.append(Query.cursor_after(cursor))
+            documents = databases.list_documents(DATABASE_ID, collection_id, queries).get('documents', [])
+            results = list(executor.map(assign, documents))
+            assigned += sum(results)
+            failed_ids = [doc['$id'] for doc, ok in zip(documents, results) if not ok]
+            if failed_ids:
+                cursor = failed_ids[-1]
+            if len(documents) < UNASSIGNED_PAGE_SIZE:
+                break
+    if assigned:
+        context.log(f"Assigned partitions to {assigned} documents queued without one in {collection_id}.")
+    return assigned
@@ -0,0 +1,144 @@
+"""
+Opt-in cProfile and tracemalloc profiling of a function run.
+
+Decorating `main` with `profiled` leaves normal runs alone: the decorator checks one header and
+one setting and calls `main` directly. A run is profiled when PROFILE_RUNS=1 is set on the
+function, or when it is executed with the `x-profile: 1` header by a server (API key) execution.
+The header is ignored on executions made by a signed-in user.
+
+A profiled run reports the functions with the most cumulative time and the peak traced memory,
+with the allocation sites still live when the response is built. The report is added to a dict
+response as "profile" and logged as one `run_profile {...}` JSON line.
+
+On Python 3.12 the profiler sees calls from every thread. On earlier versions each thread started
+during the run gets its own profiler, and the results are merged.
+"""
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+
+# Configuration Constants
+PROFILE_HEADER = 'x-profile'
+PROFILE_RUNS = os.environ.get("PROFILE_RUNS", "0") == "1" # Profile every run, e.g. for a scheduled function
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", "25")) # Functions and allocation sites reported
+PROFILE_TRACEBACK_FRAMES = 1 # tracemalloc frames per allocation; more frames cost more memory
+
+
+def profiling_requested(context):
+    if PROFILE_RUNS:
+        return True
+    headers = getattr(context.req, 'headers', None) or {}
+    return headers.get(PROFILE_HEADER) == '1' and not headers.get('x-appwrite-user-id')
+
+
+def _short_path(path):
+    return '/'.join(path.replace('\\', '/').split('/')[-2:])
+
+
+def top_functions(profiles, limit=PROFILE_TOP_N):
+    """The functions with the most cumulative time across `profiles`."""
+    stats = pstats.Stats(profiles[0])
+    for profile in profiles[1:]:
+        stats.add(profile)
+    rows = []
+    for (file_name, line, name), (_primitive_calls, calls, own_seconds, cumulative_seconds, _callers) in stats.stats.items():
+        rows.append((cumulative_seconds, {
+            "function": f"{_short_path(file_name)}:{line}({name})",
+            "calls": calls,
+            "cumulativeMs": round(cumulative_seconds * 1000, 1),
+            "ownMs": round(own_seconds * 1000, 1)
+        }))
+    rows.sort(key=lambda row: row[0], reverse=True)
+    return [row for _seconds, row in rows[:limit]]
+
+
+def top_allocations(snapshot, limit=PROFILE_TOP_N):
+    """The allocation sites holding the most memory in a tracemalloc snapshot."""
+    return [{
+        "site": f"{_short_path(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+        "kib": round(stat.size / 1024, 1),
+        "blocks": stat.count
+    } for stat in snapshot.statistics('lineno')[:limit]]
+
+
+class _ProfiledResponse:
+    """Holds back `json` until profiling has stopped, so the report can be added to the body."""
+    def __init__(self, res, on_json):
+        self._res = res
+        self._on_json = on_json
+        self.pending = None
+
+    def json(self, data, *args, **kwargs):
+        self._on_json()
+        self.pending = (data, args, kwargs)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._res, name)
+
+
+class _ProfiledContext:
+    def __init__(self, context, on_json):
+        self._context = context
+        self.res = _ProfiledResponse(context.res, on_json)
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+
+def profiled(main):
+    """Decorates a function's `main` so requested runs are profiled. Other runs call `main` directly."""
+    @functools.wraps(main)
+    def wrapper(context):
+        if not profiling_requested(context):
+            return main(context)
+
+        snapshots = []
+        def take_snapshot():
+            snapshots.append(tracemalloc.take_snapshot())
+
+        profiles = [cProfile.Profile()]
+        profiles_lock = threading.Lock()
+        def start_thread_profile(frame, event, arg):
+            # Replaces itself with the new profiler for the rest of the thread
+            profile = cProfile.Profile()
+            with profiles_lock:
+                profiles.append(profile)
+            profile.enable()
+
+        profiled_context = _ProfiledContext(context, take_snapshot)
+        tracemalloc.start(PROFILE_TRACEBACK_FRAMES)
+        if sys.version_info < (3, 12):
+            threading.setprofile(start_thread_profile)
+        profiles[0].enable()
+        try:
+            result = main(profiled_context)
+        finally:
+            profiles[0].disable()
+            if sys.version_info < (3, 12):
+                threading.setprofile(None)
+            _current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            if not snapshots:
+                take_snapshot()
+            tracemalloc.stop()
+
+            with profiles_lock:
+                report = {
+                    "topCumulative": top_functions(list(profiles)),
+                    "peakTracedKiB": round(peak_bytes / 1024, 1),
+                    "liveAllocations": top_allocations(snapshots[0])
+                }
+            context.log("run_profile " + json.dumps(report, separators=(',', ':')))
+
+        if result is not profiled_context.res or profiled_context.res.pending is None:
+            return result
+        data, args, kwargs = profiled_context.res.pending
+        if isinstance(data, dict):
+            data = {**data, "profile": report}
+        return context.res.json(data, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,160 @@
+"""
+One batch run at a time per queue or queue partition, so a burst of queue events is handled by a single run.
+
+The managers run on the create events of their queue collection as well as from queue-dispatcher.
+Every run first takes the function's lock document in `run_locks`. A run that finds the lock held
+exits at once, since the holder will pick up its document. A run started by an event then waits
+EVENT_COALESCE_SECONDS before draining, so the events of a burst end up in one batch:
+
+    holder = acquire_run_lock(databases, 'likes-manager', FUNCTION_TIMEOUT_SECONDS)
+    if not holder:
+        return ...  # Another run has it
+    wait_for_burst(context)
+    try:
+        ... drain the queue ...
+    finally:
+        release_run_lock(databases, holder)
+
+The interaction managers hold one such lock per queue partition (see partitions.py).
+
+The lock expires after `lease_seconds`, so a run that crashed or timed out cannot block the queue.
+A document queued after the holder's last page but before the lock was released is picked up by
+the next event or by queue-dispatcher's sweep.
+
+A lock is a sequence of generation documents `{lock_id}_{n}`, and the highest generation is the
+lock. A run takes the lock over by creating the next generation once the current one has expired
+or been released. The create is atomic, so exactly one of the runs that saw the same generation
+wins, and nothing has to be deleted first. A takeover deletes the generation two below the new
+one, so each lock keeps at most GENERATIONS_KEPT documents. A run whose view was so stale that it
+recreated a deleted generation finds a higher one right after and backs off.
+"""
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from appwrite.exception import AppwriteException
+from appwrite.query import Query
+
+# Configuration Constants
+DATABASE_ID = "database"
+RUN_LOCKS_COLLECTION_ID = "run_locks"
+EVENT_COALESCE_SECONDS = float(os.environ.get("EVENT_COALESCE_SECONDS", "2")) # Wait before an event run drains
+LOCK_LEASE_MARGIN_SECONDS = 5
+GENERATIONS_KEPT = 3 # Generation documents per lock; older ones are deleted on takeover
+LOCK_LOOKUP_BATCH = 30 # Locks per list request, so their generations fit in one page
+LOCK_CONCURRENCY = 8
+
+
+def is_event_run(context):
+    """True if the run was started by a database event rather than a schedule or an execution."""
+    return context.req.headers.get('x-appwrite-trigger') == 'event'
+
+
+def _generation_id(lock_id, generation):
+    return f"{lock_id}_{generation}"
+
+
+def _latest_generations(databases, lock_ids):
+    """Map lock ID -> its highest generation document, for the locks that were ever taken."""
+    latest = {}
+    for start in range(0, len(lock_ids), LOCK_LOOKUP_BATCH):
+        documents = databases.list_documents(DATABASE_ID, RUN_LOCKS_COLLECTION_ID, [
+            Query.equal('lockId', lock_ids[start:start + LOCK_LOOKUP_BATCH]),
+            Query.order_desc('generation'),
+            Query.limit(LOCK_LOOKUP_BATCH * GENERATIONS_KEPT)
+        ]).get('documents', [])
+        for doc in documents:
+            latest.setdefault(doc['lockId'], doc)
+    return latest
+
+
+def _create_generation(databases, lock_id, generation, lease_seconds):
+    try:
+        databases.create_document(DATABASE_ID, RUN_LOCKS_COLLECTION_ID, _generation_id(lock_id, generation), {
+            'lockId': lock_id,
+            'generation': generation,
+            'holder': uuid.uuid4().hex,
+            'expiresAt': time.time() + lease_seconds + LOCK_LEASE_MARGIN_SECONDS
+        })
+        return True
+    except AppwriteException as e:
+        if e.code == 409:
+            return False
+        raise
+
+
+def _delete_generation(databases, lock_id, generation):
+    try:
+        databases.delete_document(DATABASE_ID, RUN_LOCKS_COLLECTION_ID, _generation_id(lock_id, generation))
+    except AppwriteException:
+        pass # Deleted by another taker, or left for the next takeover
+
+
+def acquire_run_locks(databases, lock_ids, lease_seconds):
+    """
+    Takes each of the locks `lock_ids` that is free by creating its next generation, with one list
+    before and one after the creates.
+    Returns: A dict lock ID -> holder token (the generation's document ID) for the locks taken
+    """
+    lock_ids = list(lock_ids)
+    if not lock_ids:
+        return {}
+    now = time.time()
+    latest = _latest_generations(databases, lock_ids)
+    next_generations = {
+        lock_id: (latest[lock_id].get('generation') or 0) + 1 if lock_id in latest else 0
+        for lock_id in lock_ids
+        if lock_id not in latest or (latest[lock_id].get('expiresAt') or 0) <= now
+    }
+    if not next_generations:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(next_generations), LOCK_CONCURRENCY)) as executor:
+        created = list(executor.map(
+            lambda lock_id: _create_generation(databases, lock_id, next_generations[lock_id], lease_seconds),
+            list(next_generations)
+        ))
+    taken = {lock_id: generation for (lock_id, generation), won in zip(next_generations.items(), created) if won}
+    if not taken:
+        return {}
+
+    # A generation is only deleted once two above it exist, so a higher one is visible here if
+    # this run's view of the lock was stale
+    latest = _latest_generations(databases, list(taken))
+    holders = {}
+    for lock_id, generation in taken.items():
+        holder = _generation_id(lock_id, generation)
+        if (latest.get(lock_id, {}).get('generation') or 0) > generation:
+            release_run_lock(databases, holder)
+            continue
+        if generation >= GENERATIONS_KEPT - 1:
+            _delete_generation(databases, lock_id, generation - GENERATIONS_KEPT + 1)
+        holders[lock_id] = holder
+    return holders
+
+
+def acquire_run_lock(databases, lock_id, lease_seconds):
+    """
+    Takes the lock `lock_id` if its current generation has expired or been released.
+    Returns: The holder token to release the lock with, or None if another run holds it
+    """
+    return acquire_run_locks(databases, [lock_id], lease_seconds).get(lock_id)
+
+
+def release_run_lock(databases, holder):
+    """
+    Releases the generation `holder` took by expiring it. Only that run's own generation document is
+    touched: if the lock was taken over after its lease expired, the newer generation is unaffected.
+    Returns: False if the release failed; the lease then expires on its own
+    """
+    try:
+        databases.update_document(DATABASE_ID, RUN_LOCKS_COLLECTION_ID, holder, {'expiresAt': 0})
+    except AppwriteException as e:
+        return e.code == 404
+    return True
+
+
+def wait_for_burst(context):
+    """Lets an event run's burst finish queueing before the drain starts."""
+    if is_event_run(context) and EVENT_COALESCE_SECONDS > 0:
+        time.sleep(EVENT_COALESCE_SECONDS)
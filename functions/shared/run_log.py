@@ -0,0 +1,106 @@
+"""
+Leveled, lazily formatted and sampled logging for function runs.
+
+Every `context.log` line is formatted and shipped, even the per-item ones nobody reads.
+Decorating `main` with `leveled_logging` gives it a context with `debug`, `info` and `warning`
+methods that take a %-style message and its arguments. The message is only formatted when the
+line is written:
+
+    @instrumented("likes-manager")
+    @leveled_logging
+    def main(context):
+        context.debug("Processing interaction %s...", interaction_id)
+        context.count('stateCreates')
+
+LOG_LEVEL (debug, info, warning or error) sets the lowest level written. Debug lines are sampled
+per run: the first LOG_SAMPLE_FIRST lines of each message are written, then one in every
+LOG_SAMPLE_EVERY (0 writes no more). Counters from `count` and the number of debug lines sampled
+out are written as one `run_log {...}` JSON line when the run ends. `log` stays an info line and
+`error` is always written in full.
+"""
+import functools
+import json
+import os
+import threading
+
+# Configuration Constants
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+LOG_LEVEL = LEVELS.get(os.environ.get("LOG_LEVEL", "info").strip().lower(), LEVELS['info'])
+LOG_SAMPLE_FIRST = int(os.environ.get("LOG_SAMPLE_FIRST", "5")) # Debug lines written per message and run before sampling
+LOG_SAMPLE_EVERY = int(os.environ.get("LOG_SAMPLE_EVERY", "100")) # After that, write one line in this many
+
+
+def _format(message, args):
+    if not args:
+        return message
+    try:
+        return message % args
+    except (TypeError, ValueError):
+        return f"{message} {args!r}"
+
+
+class LeveledContext:
+    """Proxies a function context, adding leveled logging, sampling and run counters."""
+    def __init__(self, context, level=LOG_LEVEL):
+        self._context = context
+        self.level = level
+        self._lock = threading.Lock()
+        self._debug_seen = {} # message -> debug lines requested this run
+        self._counters = {}
+
+    def debug(self, message, *args):
+        if self.level > LEVELS['debug']:
+            return
+        with self._lock:
+            seen = self._debug_seen.get(message, 0) + 1
+            self._debug_seen[message] = seen
+        if seen <= LOG_SAMPLE_FIRST or (LOG_SAMPLE_EVERY and (seen - LOG_SAMPLE_FIRST) % LOG_SAMPLE_EVERY == 0):
+            self._context.log(_format(message, args))
+
+    def info(self, message, *args):
+        if self.level <= LEVELS['info']:
+            self._context.log(_format(message, args))
+
+    def log(self, message, *args):
+        self.info(message, *args)
+
+    def warning(self, message, *args):
+        if self.level <= LEVELS['warning']:
+            self._context.log("Warning: " + _format(message, args))
+
+    def error(self, message, *args):
+        self._context.error(_format(message, args))
+
+    def count(self, name, amount=1):
+        """Adds to a run counter. Counters are written once, at the end of the run."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def summary_line(self):
+        """The `run_log` line, or None when there is nothing to report."""
+        with self._lock:
+            sampled_out = sum(
+                seen - LOG_SAMPLE_FIRST - ((seen - LOG_SAMPLE_FIRST) // LOG_SAMPLE_EVERY if LOG_SAMPLE_EVERY else 0)
+                for seen in self._debug_seen.values() if seen > LOG_SAMPLE_FIRST
+            )
+            if not self._counters and not sampled_out:
+                return None
+            summary = {"counters": dict(self._counters), "debugLinesSampledOut": sampled_out}
+        return "run_log " + json.dumps(summary, separators=(',', ':'))
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+
+def leveled_logging(main):
+    """Decorates a function's `main` so it logs through a LeveledContext."""
+    @functools.wraps(main)
+    def wrapper(context):
+        leveled = LeveledContext(context)
+        try:
+            return main(leveled)
+        finally:
+            line = leveled.summary_line()
+            if line:
+                context.log(line)
+    return wrapper
@@ -0,0 +1,76 @@
+"""
+Copies the shared modules into the src/ directory of every function that uses them.
+
+Appwrite packages each function from its own directory, so code shared between functions
+has to be vendored into each of them. Edit the originals in functions/shared/ and run:
+
+    python functions/shared/sync.py          # update the copies
+    python functions/shared/sync.py --check  # exit 1 if any copy is out of date
+"""
+import os
+import sys
+
+SHARED_DIR = os.path.dirname(os.path.abspath(__file__))
+FUNCTIONS_DIR = os.path.dirname(SHARED_DIR)
+
+# Every function that talks to Appwrite through the shared client
+CLIENT_FUNCTIONS = [
+    'comments-manager', 'counts-compactor', 'feed-fanout', 'liked-videos-projector', 'likes-manager',
+    'queue-dispatcher', 'storage-gc', 'subscriptions-manager', 'subscriptions-migrator', 'trending-ranker',
+    'video-deletion-manager', 'video-manager', 'video-purger', 'view-manager',
+]
+
+# Shared module -> functions that import it
+SHARED_MODULES = {
+    'appwrite_client.py': CLIENT_FUNCTIONS,
+    'metrics.py': CLIENT_FUNCTIONS, # Imported by appwrite_client.py
+    'profiling.py': CLIENT_FUNCTIONS,
+    'video_counters.py': ['likes-manager', 'view-manager', 'counts-compactor'],
+    'versioned_writes.py': ['likes-manager', 'view-manager', 'counts-compactor', 'comments-manager', 'subscriptions-manager', 'subscriptions-migrator', 'feed-fanout'], # Imported by video_counters.py and subscription_edges.py
+    'counter_journal.py': ['likes-manager', 'subscriptions-manager', 'view-manager', 'counts-compactor'],
+    'trending.py': ['likes-manager', 'view-manager', 'comments-manager'],
+    'subscription_edges.py': ['subscriptions-manager', 'subscriptions-migrator'],
+    'document_deletes.py': ['view-manager', 'video-purger', 'subscriptions-manager'],
+    'async_databases.py': ['likes-manager', 'comments-manager', 'subscriptions-manager', 'view-manager'],
+    'queue_worker.py': ['likes-manager', 'comments-manager', 'subscriptions-manager', 'view-manager'],
+    'run_lock.py': ['likes-manager', 'comments-manager', 'subscriptions-manager', 'queue-dispatcher'], # Imported by partitions.py
+    'partitions.py': ['likes-manager', 'comments-manager', 'subscriptions-manager', 'queue-dispatcher'],
+    'run_log.py': ['likes-manager', 'comments-manager', 'subscriptions-manager', 'view-manager'],
+}
+
+HEADER = "# Synced from functions/shared/{name} by functions/shared/sync.py. Edit the original, not this copy.\n"
+
+
+def expected_copy(name):
+    with open(os.path.join(SHARED_DIR, name), 'r', encoding='utf-8') as f:
+        return HEADER.format(name=name) + f.read()
+
+
+def main(argv):
+    check_only = '--check' in argv
+    stale = []
+    for name, function_names in SHARED_MODULES.items():
+        content = expected_copy(name)
+        for function_name in function_names:
+            target = os.path.join(FUNCTIONS_DIR, function_name, 'src', name)
+            current = None
+            if os.path.exists(target):
+                with open(target, 'r', encoding='utf-8') as f:
+                    current = f.read()
+            if current == content:
+                continue
+            stale.append(os.path.relpath(target, FUNCTIONS_DIR))
+            if not check_only:
+                with open(target, 'w', encoding='utf-8') as f:
+                    f.write(content)
+
+    if check_only and stale:
+        print("Out of date: " + ", ".join(stale))
+        return 1
+    for path in stale:
+        print(f"Updated {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,231 @@
+from appwrite.services.databases import Databases
+from appwrite.services.storage import Storage
+from appwrite.exception import AppwriteException
+from appwrite.query import Query
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+import time
+import traceback
+
+from .appwrite_client import create_client
+from .metrics import instrumented, stage
+from .profiling import profiled
+
+# Configuration Constants
+DATABASE_ID = "database"
+VIDEOS_COLLECTION_ID = "videos"
+VIDEO_PROCESSING_COLLECTION_ID = "video-processing"
+JOB_CHECKPOINTS_COLLECTION_ID = "job_checkpoints"
+CHECKPOINT_ID = "storage-gc" # Sweep position as "bucketId/fileId"
+VIDEOS_UNCOMPRESSED_BUCKET_ID = "videos-uncompressed"
+VIDEOS_BUCKET_ID = "videos"
+SWEPT_BUCKETS = [VIDEOS_UNCOMPRESSED_BUCKET_ID, VIDEOS_BUCKET_ID]
+LIVE_PROCESSING_STATUSES = ['pending', 'processing'] # Failed jobs are never retried, so they hold no files
+PAGE_SIZE = 100
+GC_GRACE_HOURS = float(os.environ.get("GC_GRACE_HOURS", "24")) # Never delete files younger than this
+GC_DRY_RUN = os.environ.get("GC_DRY_RUN", "false").lower() == "true"
+GC_DELETE_CONCURRENCY = int(os.environ.get("GC_DELETE_CONCURRENCY", "4"))
+TIME_BUDGET_SECONDS = float(os.environ.get("TIME_BUDGET_SECONDS", "240")) # Stop sweeping after this long
+
+def file_key(file_id):
+    """64-bit hash of a file ID. A collision can only keep an orphan alive, never delete a referenced file."""
+    return int.from_bytes(hashlib.blake2b(file_id.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def page_documents(databases, collection_id, queries):
+    """Pages through every document matching `queries` with a cursor."""
+    cursor = None
+    while True:
+        page_queries = queries + [Query.limit(PAGE_SIZE)]
+        if cursor:
+            page_queries.append(Query.cursor_after(cursor))
+        documents = databases.list_documents(DATABASE_ID, collection_id, page_queries).get('documents', [])
+        yield from documents
+        if len(documents) < PAGE_SIZE:
+            return
+        cursor = documents[-1]['$id']
+
+def mark_referenced_files(databases):
+    """
+    Mark phase: collects the IDs of every file a document still points to.
+    Returns: A dict bucketId -> set of file_key() values
+    """
+    referenced = {bucket_id: set() for bucket_id in SWEPT_BUCKETS}
+    for video_doc in page_documents(databases, VIDEOS_COLLECTION_ID, [Query.select(['$id', 'video_id', 'thumbnail_id'])]):
+        for attribute in ('video_id', 'thumbnail_id'):
+            if video_doc.get(attribute):
+                referenced[VIDEOS_BUCKET_ID].add(file_key(video_doc[attribute]))
+    processing_queries = [
+        Query.equal('status', LIVE_PROCESSING_STATUSES),
+        Query.select(['$id', 'uncompressedFileId', 'thumbnailId'])
+    ]
+    for processing_doc in page_documents(databases, VIDEO_PROCESSING_COLLECTION_ID, processing_queries):
+        for attribute in ('uncompressedFileId', 'thumbnailId'):
+            if processing_doc.get(attribute):
+                referenced[VIDEOS_UNCOMPRESSED_BUCKET_ID].add(file_key(processing_doc[attribute]))
+    return referenced
+
+def load_checkpoint(databases):
+    """Returns (bucketId, fileId) where the previous sweep stopped, or (None, None)."""
+    try:
+        checkpoint_doc = databases.get_document(DATABASE_ID, JOB_CHECKPOINTS_COLLECTION_ID, CHECKPOINT_ID)
+    except AppwriteException as e:
+        if e.code == 404:
+            return None, None
+        raise
+    bucket_id, _, file_id = (checkpoint_doc.get('cursor') or '').partition('/')
+    if bucket_id not in SWEPT_BUCKETS:
+        return None, None
+    return bucket_id, file_id or None
+
+def save_checkpoint(databases, cursor):
+    data = {'cursor': cursor}
+    try:
+        databases.update_document(DATABASE_ID, JOB_CHECKPOINTS_COLLECTION_ID, CHECKPOINT_ID, data)
+    except AppwriteException as e:
+        if e.code != 404:
+            raise
+        databases.create_document(DATABASE_ID, JOB_CHECKPOINTS_COLLECTION_ID, CHECKPOINT_ID, data)
+
+def list_files_page(storage, bucket_id, cursor, context):
+    queries = [Query.limit(PAGE_SIZE)]
+    if cursor:
+        queries.append(Query.cursor_after(cursor))
+    try:
+        return storage.list_files(bucket_id, queries).get('files', [])
+    except AppwriteException as e:
+        if not cursor or e.code != 400:
+            raise
+        # The cursor file was deleted since it was saved: start the bucket over
+        context.log(f"Sweep cursor {cursor} in {bucket_id} no longer exists. Restarting the bucket.")
+        return storage.list_files(bucket_id, [Query.limit(PAGE_SIZE)]).get('files', [])
+
+def is_past_grace(file_doc, cutoff):
+    created_at = datetime.fromisoformat(file_doc['$createdAt'])
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.timestamp() < cutoff
+
+@instrumented("storage-gc")
+@profiled
+def main(context):
+    context.log("--- Storage GC Start ---")
+    deadline = time.monotonic() + TIME_BUDGET_SECONDS
+
+    # --- Environment & Auth Check ---
+    api_endpoint = os.environ.get("APPWRITE_FUNCTION_API_ENDPOINT")
+    project_id = os.environ.get("APPWRITE_FUNCTION_PROJECT_ID")
+    api_key = context.req.headers.get('x-appwrite-key')
+
+    if not all([api_endpoint, project_id, api_key]):
+        message = "Function configuration error: Missing endpoint, project ID, or API key."
+        context.error(message)
+        return context.res.json({"success": False, "message": message}, 500)
+
+    # A manual execution can ask for a dry run with {"dryRun": true}
+    dry_run = GC_DRY_RUN
+    try:
+        payload = json.loads(context.req.body_raw or '{}')
+        if isinstance(payload, dict) and 'dryRun' in payload:
+            dry_run = payload['dryRun'] is True
+    except ValueError:
+        pass
+
+    # --- Initialize Appwrite Client ---
+    client = create_client(api_endpoint, project_id, api_key)
+    databases = Databases(client)
+    storage = Storage(client)
+
+    files_scanned = 0
+    orphaned_files = 0
+    orphaned_bytes = 0
+    deleted_files = 0
+    failed_count = 0
+    pass_completed = False
+
+    try:
+        # --- Mark: Collect Referenced File IDs ---
+        with stage('mark'):
+            referenced = mark_referenced_files(databases)
+        referenced_count = sum(len(keys) for keys in referenced.values())
+        context.log(f"Mark phase found {referenced_count} referenced files.")
+
+        # --- Sweep: Page Through Each Bucket ---
+        # Dry runs always scan from the start and never move the checkpoint
+        start_bucket, cursor = (None, None) if dry_run else load_checkpoint(databases)
+        start_index = SWEPT_BUCKETS.index(start_bucket) if start_bucket else 0
+        cutoff = time.time() - GC_GRACE_HOURS * 3600
+        stopped_at = None
+
+        with ThreadPoolExecutor(max_workers=GC_DELETE_CONCURRENCY) as executor:
+            for bucket_id in SWEPT_BUCKETS[start_index:]:
+                if bucket_id != start_bucket:
+                    cursor = None
+                while True:
+                    if time.monotonic() >= deadline:
+                        stopped_at = f"{bucket_id}/{cursor or ''}"
+                        break
+                    with stage('list_files'):
+                        files = list_files_page(storage, bucket_id, cursor, context)
+                    files_scanned += len(files)
+                    orphans = [
+                        file_doc for file_doc in files
+                        if file_key(file_doc['$id']) not in referenced[bucket_id] and is_past_grace(file_doc, cutoff)
+                    ]
+                    orphaned_files += len(orphans)
+                    orphaned_bytes += sum(file_doc.get('sizeOriginal', 0) or 0 for file_doc in orphans)
+
+                    deleted_ids = set()
+                    if orphans and not dry_run:
+                        def delete_orphan(file_doc):
+                            try:
+                                storage.delete_file(bucket_id, file_doc['$id'])
+                                return file_doc['$id']
+                            except AppwriteException as e:
+                                if e.code == 404:
+                                    return file_doc['$id']
+                                context.error(f"Failed to delete orphaned file {file_doc['$id']} from {bucket_id}: {e}")
+                                return None
+                        with stage('delete_orphans'):
+                            deleted_ids = {file_id for file_id in executor.map(delete_orphan, orphans) if file_id}
+                        deleted_files += len(deleted_ids)
+                        failed_count += len(orphans) - len(deleted_ids)
+
+                    # A deleted file cannot be a cursor, so continue after the last file that was kept
+                    kept_ids = [file_doc['$id'] for file_doc in files if file_doc['$id'] not in deleted_ids]
+                    if kept_ids:
+                        cursor = kept_ids[-1]
+                    if len(files) < PAGE_SIZE:
+                        break
+                if stopped_at:
+                    break
+            else:
+                pass_completed = True
+
+        if not dry_run:
+            save_checkpoint(databases, stopped_at)
+
+        context.log(
+            f"GC finished ({'dry run' if dry_run else 'deleting'}). Scanned: {files_scanned}, Orphaned: {orphaned_files} "
+            f"({orphaned_bytes} bytes), Deleted: {deleted_files}, Failed: {failed_count}, Pass completed: {pass_completed}"
+        )
+        return context.res.json({
+            "success": True,
+            "dryRun": dry_run,
+            "referencedFiles": referenced_count,
+            "filesScanned": files_scanned,
+            "orphanedFiles": orphaned_files,
+            "reclaimableBytes": orphaned_bytes,
+            "deletedFiles": deleted_files,
+            "failed": failed_count,
+            "passCompleted": pass_completed
+        })
+
+    except Exception as e:
+        context.error(f"An unexpected error occurred during storage GC: {e}")
+        context.error(traceback.format_exc())
+        return context.res.json({"success": False, "message": f"Unexpected Error: {str(e)}"}, 500)
+    finally:
+        context.log("--- Storage GC End ---")
@@ -1,23 +1,315 @@
-from appwrite.client import Client
 from appwrite.services.databases import Databases
 from appwrite.exception import AppwriteException
 from appwrite.permission import Permission
 from appwrite.role import Role
-from appwrite.query import Query
 import os
 import json
+import time
 import traceback
+import collections
+
+from .appwrite_client import create_client
+from .async_databases import DB_CONCURRENCY, run_keyed
+from .counter_journal import find_journal_entries, finish_journal_entry, journal_key, record_journal_entry
+from .document_deletes import delete_if_exists
+from .metrics import instrumented, stage
+from .partitions import ASSIGN_TIME_BUDGET_SHARE, assign_missing_partitions, lease_partitions, partition_queries, release_partitions, run_slots
+from .profiling import profiled
+from .queue_worker import drain_queue, requested_max_items
+from .run_lock import wait_for_burst
+from .run_log import leveled_logging
+from .subscription_edges import (
+    add_subscription,
+    remove_subscription,
+    is_subscribed,
+    migrate_legacy_subscriptions,
+    delete_legacy_subscriptions,
+    reverse_index_shard,
+    apply_reverse_index_changes
+)
+from .versioned_writes import update_versioned, VersionConflictError
 
 # Configuration Constants
 DATABASE_ID = "database"
 ACCOUNTS_COLLECTION_ID = "accounts"
 CHANNEL_STATS_COLLECTION_ID = "channel_stats"
 ACCOUNT_INTERACTIONS_COLLECTION_ID = "account_interactions"
-USER_SUBSCRIPTIONS_COLLECTION_ID = "user_subscriptions"
-MAX_PROCESSING_LIMIT = 50  # Number of interactions to process per run
+MAX_PROCESSING_LIMIT = 50  # Number of interactions to process per page
+FUNCTION_TIMEOUT_SECONDS = float(os.environ.get("FUNCTION_TIMEOUT_SECONDS", "15")) # Keep in sync with appwrite.json
+RUN_LOCK_ID = "subscriptions-manager" # Prefix of the partition leases in run_locks, held while a run drains its slots
+JOURNAL_SOURCE = 'subscriptions' # Marks this function's entries in counter_journal
+
+class CountWriteError(Exception):
+    """The channel_stats write of a journaled batch failed; the batch is finished by a later run."""
+
+
+def get_user_id_from_permissions(permissions):
+    """Returns the user ID from the creator's update permission, or None."""
+    update_permission_prefix = 'update("user:'
+    for perm in permissions:
+        if perm.startswith(update_permission_prefix):
+            start_index = len(update_permission_prefix)
+            end_index = perm.find('")', start_index)
+            if end_index != -1:
+                return perm[start_index:end_index]
+    return None
+
+def apply_subscriber_count_change(databases, creator_id, count_change, idempotency_key, context):
+    """
+    Applies a creator's summed subscriberCount change with one versioned read-modify-write,
+    at most once per idempotency key.
+    Returns: True if written, False if the key was already applied
+    """
+    written = update_versioned(
+        databases, CHANNEL_STATS_COLLECTION_ID, creator_id,
+        lambda stats_doc: {'subscriberCount': max(0, ((stats_doc or {}).get('subscriberCount', 0) or 0) + count_change)},
+        idempotency_key, permissions=[Permission.read(Role.any())] # Public read access
+    )
+    if written is None:
+        context.debug("subscriberCount change of batch %s was already applied to %s.", idempotency_key, creator_id)
+        return False
+    context.debug("Updated channel stats for %s by %s. New count: %s", creator_id, count_change, written['subscriberCount'])
+    return True
+
+def finish_creator_batch(databases, entry, counted, context):
+    """
+    Applies a journaled batch of one creator's interactions (see counter_journal.py): the edges and
+    reverse index entries as absolute states, then the subscriberCount delta. What was written is
+    counted in `counted`.
+    """
+    creator_id = entry['target']
+
+    def apply_states(entry):
+        reverse_index_changes = {} # Map shard -> {subscriberId: +1/-1}
+        for subscriber_id, subscribed in entry['states'].items():
+            if subscribed:
+                add_subscription(databases, subscriber_id, creator_id)
+            else:
+                remove_subscription(databases, subscriber_id, creator_id)
+            counted['subscriptionEdgeWrites'] += 1
+            reverse_index_changes.setdefault(reverse_index_shard(subscriber_id), {})[subscriber_id] = 1 if subscribed else -1
+        for shard, changes in reverse_index_changes.items():
+            apply_reverse_index_changes(databases, creator_id, shard, changes)
+            counted['reverseIndexWrites'] += 1
+
+    def apply_deltas(entry):
+        count_change = entry['deltas'].get('subscriberCount', 0)
+        try:
+            written = apply_subscriber_count_change(databases, creator_id, count_change, journal_key(entry), context)
+        except Exception as e:
+            raise CountWriteError(f"Failed to apply subscriberCount change {count_change} for {creator_id}: {e}") from e
+        counted['channelStatsWrites'] += written
+
+    finish_journal_entry(databases, entry, apply_states, apply_deltas, ACCOUNT_INTERACTIONS_COLLECTION_ID)
+
+def process_creator_interactions(databases, creator_id, interaction_docs_by_subscriber, context):
+    """
+    Applies one creator's new interactions exactly once. The last interaction of each subscriber
+    wins; subscribers whose edge already matches it change nothing. The changes are journaled,
+    then applied and dequeued.
+    Returns: A Counter of the writes made
+    """
+    counted = collections.Counter()
+    states = {} # Map subscriberId -> should_be_subscribed, for the subscribers that change
+    for subscriber_id, interaction_docs in interaction_docs_by_subscriber.items():
+        should_be_subscribed = interaction_docs[-1].get('type') == 'subscribe'
+        if is_subscribed(databases, subscriber_id, creator_id) == should_be_subscribed:
+            context.debug("%s is already %s to %s.", subscriber_id, 'subscribed' if should_be_subscribed else 'unsubscribed', creator_id)
+            context.count('unchangedEdges')
+            continue
+        states[subscriber_id] = should_be_subscribed
+    interaction_ids = [doc['$id'] for docs in interaction_docs_by_subscriber.values() for doc in docs]
+    if not states:
+        for interaction_id in interaction_ids: # Some may be gone already, deleted by an interrupted run
+            delete_if_exists(databases, ACCOUNT_INTERACTIONS_COLLECTION_ID, interaction_id)
+        return counted
+
+    deltas = {'subscriberCount': sum(1 if subscribed else -1 for subscribed in states.values())}
+    entry = record_journal_entry(databases, JOURNAL_SOURCE, creator_id, deltas, states, interaction_ids)
+    finish_creator_batch(databases, entry, counted, context)
+    return counted
+
+def add_batch_writes(totals, counted):
+    """Adds the writes counted by finish_creator_batch to the run's totals."""
+    for key in ('subscriptionEdgeWrites', 'reverseIndexWrites', 'channelStatsWrites'):
+        totals[key] += counted[key]
+
+def process_interaction_page(databases, interaction_docs, totals, blocked_creator_ids, context):
+    """
+    Processes one page of subscription interactions. Returns the IDs of the interactions left in the queue.
+    A creator whose batch failed is added to `blocked_creator_ids`: their later interactions wait
+    for the next run, so they are never applied before the failed ones.
+    """
+    kept_ids = []
+    self_subscription_ids = []
+
+    # --- Finish Batches an Earlier Run Journaled but Did Not Complete ---
+    with stage('journal'):
+        entries = find_journal_entries(databases, JOURNAL_SOURCE, [doc['$id'] for doc in interaction_docs])
+    covered_ids = {interaction_id for entry in entries for interaction_id in entry['interactionIds']}
+    if entries:
+        context.log(f"Finishing {len(entries)} journaled batches covering {len(covered_ids)} interactions.")
+
+    def finish_recovered(entry):
+        counted = collections.Counter()
+        finish_creator_batch(databases, entry, counted, context)
+        return counted
+
+    with stage('journal_recovery'):
+        results = run_keyed(entries, lambda entry: entry['target'], finish_recovered)
+    page_ids = {doc['$id'] for doc in interaction_docs}
+    for entry, result in zip(entries, results):
+        entry_page_ids = [interaction_id for interaction_id in entry['interactionIds'] if interaction_id in page_ids]
+        if isinstance(result, Exception):
+            context.error(f"Failed to finish journaled batch {entry['$id']} for {entry['target']}: {result}")
+            totals['channelStatsFailures'] += isinstance(result, CountWriteError)
+            totals['failed'] += len(entry_page_ids)
+            kept_ids.extend(entry_page_ids)
+            blocked_creator_ids.add(entry['target'])
+            continue
+        totals['recoveredBatches'] += 1
+        totals['processed'] += len(entry_page_ids)
+        add_batch_writes(totals, result)
 
+    # --- Group New Interactions by Creator, Then by Subscriber in Queue Order ---
+    interaction_docs_by_creator = {} # Map creatorId -> {subscriberId: [interaction docs]}
+    for interaction_doc in interaction_docs:
+        interaction_id = interaction_doc["$id"]
+        if interaction_id in covered_ids:
+            continue
+        subscriber_id = get_user_id_from_permissions(interaction_doc.get('$permissions', []))
+        if not subscriber_id:
+            context.error(f"Could not determine user ID from permissions on interaction {interaction_id}.")
+            totals['failed'] += 1
+            kept_ids.append(interaction_id)
+            continue
+
+        action = interaction_doc.get('type')
+        creator_id = interaction_doc.get('targetAccountId')
+        if not creator_id or action not in ['subscribe', 'unsubscribe']:
+            context.error(f"Invalid interaction data in {interaction_id}: Missing targetAccountId or invalid type.")
+            totals['failed'] += 1
+            kept_ids.append(interaction_id)
+            continue
+
+        if subscriber_id == creator_id:
+            context.debug("User %s attempted to subscribe to themselves. Skipping.", subscriber_id)
+            context.count('selfSubscriptions')
+            # Delete the invalid interaction and count as processed
+            self_subscription_ids.append(interaction_id)
+            continue
+
+        if creator_id in blocked_creator_ids:
+            totals['deferred'] += 1
+            kept_ids.append(interaction_id)
+            continue
+        interaction_docs_by_creator.setdefault(creator_id, {}).setdefault(subscriber_id, []).append(interaction_doc)
+
+    # --- Move Subscribers Still on the Legacy Array to Edges, Subscribers in Parallel ---
+    # Their edges and reverse index entries must exist before the batches compare against and change them
+    subscriber_ids = list({subscriber_id for docs_by_subscriber in interaction_docs_by_creator.values() for subscriber_id in docs_by_subscriber})
+    with stage('legacy_migration'):
+        results = run_keyed(subscriber_ids, lambda subscriber_id: subscriber_id, lambda subscriber_id: migrate_legacy_subscriptions(databases, subscriber_id))
+    reverse_index_changes = {} # Map (creatorId, shard) -> {subscriberId: +1}
+    migrated_subscriber_ids = []
+    failed_subscriber_ids = set()
+    for subscriber_id, result in zip(subscriber_ids, results):
+        if isinstance(result, Exception):
+            context.error(f"Error migrating legacy subscriptions of {subscriber_id}: {result}")
+            failed_subscriber_ids.add(subscriber_id)
+        elif result is not None:
+            legacy_creator_ids, created = result
+            migrated_subscriber_ids.append(subscriber_id)
+            context.debug("Migrated %s legacy subscriptions of %s to edges.", len(created), subscriber_id)
+            for creator_id in legacy_creator_ids:
+                reverse_index_changes.setdefault((creator_id, reverse_index_shard(subscriber_id)), {})[subscriber_id] = 1
+
+    # --- Add Migrated Subscribers to the Reverse Index Once per (Creator, Shard), Shards in Parallel ---
+    # These writes run outside the creators' partition leases, so they only add subscribers whose edge still exists
+    shard_keys = list(reverse_index_changes)
+    with stage('reverse_index'):
+        results = run_keyed(
+            shard_keys,
+            lambda shard_key: shard_key,
+            lambda shard_key: apply_reverse_index_changes(databases, shard_key[0], shard_key[1], reverse_index_changes[shard_key], unleased=True)
+        )
+    for (creator_id, shard), result in zip(shard_keys, results):
+        if isinstance(result, (AppwriteException, VersionConflictError)):
+            context.error(f"Failed to update reverse index shard {shard} of {creator_id}: {result}")
+            totals['reverseIndexFailures'] += 1
+            failed_subscriber_ids.update(reverse_index_changes[(creator_id, shard)]) # Their legacy documents stay for a retry
+        elif isinstance(result, Exception):
+            raise result
+        else:
+            totals['reverseIndexWrites'] += 1
+
+    # --- Delete the Legacy Documents Whose Edges and Reverse Index Entries All Exist ---
+    migrated_subscriber_ids = [subscriber_id for subscriber_id in migrated_subscriber_ids if subscriber_id not in failed_subscriber_ids]
+    with stage('legacy_delete'):
+        results = run_keyed(migrated_subscriber_ids, lambda subscriber_id: subscriber_id, lambda subscriber_id: delete_legacy_subscriptions(databases, subscriber_id))
+    for subscriber_id, result in zip(migrated_subscriber_ids, results):
+        if isinstance(result, Exception):
+            context.error(f"Failed to delete legacy subscriptions of {subscriber_id}: {result}")
+            failed_subscriber_ids.add(subscriber_id)
+        else:
+            totals['legacyDocsMigrated'] += 1
+
+    # --- Hold Back the Creators of Subscribers Whose Migration Did Not Finish ---
+    for creator_id in list(interaction_docs_by_creator):
+        if failed_subscriber_ids & set(interaction_docs_by_creator[creator_id]):
+            interaction_ids = [doc['$id'] for docs in interaction_docs_by_creator.pop(creator_id).values() for doc in docs]
+            totals['failed'] += len(interaction_ids)
+            kept_ids.extend(interaction_ids)
+            blocked_creator_ids.add(creator_id)
+
+    # --- Apply Each Creator's Interactions Once, Creators in Parallel ---
+    creator_ids = list(interaction_docs_by_creator)
+    context.log(f"Processing interactions on {len(creator_ids)} channels with up to {DB_CONCURRENCY} concurrent database calls...")
+    with stage('subscription_batches'):
+        results = run_keyed(
+            creator_ids,
+            lambda creator_id: creator_id,
+            lambda creator_id: process_creator_interactions(databases, creator_id, interaction_docs_by_creator[creator_id], context)
+        )
+    for creator_id, result in zip(creator_ids, results):
+        interaction_ids = [doc['$id'] for docs in interaction_docs_by_creator[creator_id].values() for doc in docs]
+        if isinstance(result, Exception):
+            # Whatever was journaled is finished by the next run; the rest is simply processed again
+            context.error(f"Error applying subscription interactions for {creator_id}: {result}")
+            if not isinstance(result, AppwriteException):
+                context.error("".join(traceback.format_exception(type(result), result, result.__traceback__)))
+            totals['channelStatsFailures'] += isinstance(result, CountWriteError)
+            totals['failed'] += len(interaction_ids)
+            kept_ids.extend(interaction_ids)
+            blocked_creator_ids.add(creator_id)
+            continue
+        totals['processed'] += len(interaction_ids)
+        add_batch_writes(totals, result)
+
+    # --- Delete Self-Subscription Interactions ---
+    with stage('dequeue'):
+        results = run_keyed(
+            self_subscription_ids,
+            lambda interaction_id: interaction_id,
+            lambda interaction_id: delete_if_exists(databases, ACCOUNT_INTERACTIONS_COLLECTION_ID, interaction_id)
+        )
+    for interaction_id, result in zip(self_subscription_ids, results):
+        if isinstance(result, AppwriteException):
+            context.error(f"Failed to delete processed interaction {interaction_id}: {result.message}")
+            totals['failed'] += 1
+            kept_ids.append(interaction_id)
+        elif isinstance(result, Exception):
+            raise result
+        else:
+            totals['processed'] += 1
+    return kept_ids
+
+@instrumented("subscriptions-manager")
+@leveled_logging
+@profiled
 def main(context):
     context.log("--- Subscriptions Manager Batch Job Start ---")
+    started_at = time.monotonic()
 
     # Environment Variable Check
     api_endpoint = os.environ.get("APPWRITE_FUNCTION_API_ENDPOINT")
@@ -30,25 +322,39 @@ def main(context):
         return context.res.json({"success": False, "message": message}, 500)
 
     # Initialize Appwrite Client
-    client = Client()
-    client.set_endpoint(api_endpoint).set_project(project_id).set_key(api_key)
+    client = create_client(api_endpoint, project_id, api_key)
     databases = Databases(client)
 
-    processed_count = 0
-    failed_count = 0
+    totals = collections.Counter() # Run-wide counts, keyed like the summary
+    blocked_creator_ids = set() # Creators with a failed batch this run
+
+    leases = {} # Partition slot -> lease token; runs started by queue events coalesce into the holders' runs
 
     try:
-        # --- Fetch Pending Interaction Documents ---
+        # --- Lease This Run's Partitions of the Queue ---
+        leases = lease_partitions(databases, RUN_LOCK_ID, run_slots(context, 'targetAccountId'), FUNCTION_TIMEOUT_SECONDS)
+        if not leases:
+            context.log("Other runs hold this run's queue partitions and will process the queued subscription interactions.")
+            context.log("--- Subscriptions Manager Batch Job End (Coalesced) ---")
+            return context.res.json({"success": True, "message": "Other runs are processing these partitions.", "coalesced": True})
+        wait_for_burst(context)
+        context.log(f"Leased partitions {sorted(leases)}.")
+        with stage('assign_partitions'):
+            assign_missing_partitions(
+                databases, ACCOUNT_INTERACTIONS_COLLECTION_ID, 'targetAccountId', context,
+                started_at + FUNCTION_TIMEOUT_SECONDS * ASSIGN_TIME_BUDGET_SHARE
+            )
+
+        # --- Drain the Queue Page by Page Within the Time Budget ---
         context.log("Fetching subscription interaction documents...")
-        interactions_response = databases.list_documents(
-            DATABASE_ID,
-            ACCOUNT_INTERACTIONS_COLLECTION_ID,
-            [Query.limit(MAX_PROCESSING_LIMIT)]
+        drain = drain_queue(
+            databases, ACCOUNT_INTERACTIONS_COLLECTION_ID,
+            lambda page: process_interaction_page(databases, page, totals, blocked_creator_ids, context),
+            context, FUNCTION_TIMEOUT_SECONDS, page_size=MAX_PROCESSING_LIMIT, started_at=started_at,
+            queries=partition_queries(leases), max_items=requested_max_items(context)
         )
-        
-        interaction_docs = interactions_response.get('documents', [])
-        total_fetched = len(interaction_docs)
-        context.log(f"Fetched {total_fetched} interaction documents to process.")
+        total_fetched = drain['fetched']
+        context.log(f"Fetched {total_fetched} interaction documents in {drain['pages']} pages. Backlog remaining: {drain['backlogRemaining']}.")
 
         if total_fetched == 0:
             context.log("No subscription interactions to process.")
@@ -56,198 +362,25 @@ def main(context):
             return context.res.json({"success": True, "message": "No interactions found", 
                                     "processed": 0, "failed": 0, "totalFetched": 0})
 
-        # --- Process Each Interaction Document ---
-        for interaction_doc in interaction_docs:
-            interaction_id = interaction_doc["$id"]
-            context.log(f"Processing interaction {interaction_id}...")
-
-            try:
-                # --- Extract User ID from Permissions ---
-                subscriber_id = None
-                doc_permissions = interaction_doc.get('$permissions', [])
-                
-                # Look for update permission to determine the creator
-                update_permission_prefix = 'update("user:'
-                for perm in doc_permissions:
-                    if perm.startswith(update_permission_prefix):
-                        start_index = len(update_permission_prefix)
-                        end_index = perm.find('")', start_index)
-                        if end_index != -1:
-                            subscriber_id = perm[start_index:end_index]
-                            break # Found the user ID
-
-                if not subscriber_id:
-                    context.error(f"Could not determine user ID from permissions on interaction {interaction_id}.")
-                    failed_count += 1
-                    continue
-
-                # --- Extract Interaction Data ---
-                action = interaction_doc.get('type')
-                creator_id = interaction_doc.get('targetAccountId')
-
-                # --- Validate Data ---
-                if not creator_id or action not in ['subscribe', 'unsubscribe']:
-                    context.error(f"Invalid interaction data in {interaction_id}: Missing targetAccountId or invalid type.")
-                    failed_count += 1
-                    continue
-
-                # --- Check for Self-Subscription ---
-                if subscriber_id == creator_id:
-                    context.log(f"User {subscriber_id} attempted to subscribe to themselves. Skipping.")
-                    # Delete the invalid interaction and count as processed
-                    databases.delete_document(
-                        DATABASE_ID,
-                        ACCOUNT_INTERACTIONS_COLLECTION_ID, 
-                        interaction_id
-                    )
-                    processed_count += 1
-                    continue
-
-                context.log(f"Processing Action: {action}, Subscriber: {subscriber_id}, Target: {creator_id}")
-
-                # --- Fetch Subscriber's Subscriptions Document ---
-                create_subscription_doc = False
-                try:
-                    subscription_doc = databases.get_document(DATABASE_ID, USER_SUBSCRIPTIONS_COLLECTION_ID, subscriber_id)
-                    subscribing_to_list = subscription_doc.get('subscribedToChannelIds', []) or []
-                    subscribing_to_set = set(subscribing_to_list)
-                    is_currently_subscribed = creator_id in subscribing_to_set
-                    context.log(f"Currently subscribed: {is_currently_subscribed}")
-                except AppwriteException as e:
-                    if e.code == 404:
-                        # No subscriptions document exists yet, initialize with empty set
-                        subscribing_to_set = set()
-                        is_currently_subscribed = False
-                        create_subscription_doc = True
-                        context.log(f"No subscriptions document found for user {subscriber_id}. Will create if needed.")
-                    else:
-                        # Re-throw other errors
-                        context.error(f"Error fetching subscriptions document for {subscriber_id}: {e}")
-                        raise e
-
-                count_change = 0
-                new_subscription_state = is_currently_subscribed # Default to current state
-
-                # --- Determine Necessary Changes ---
-                if action == 'subscribe' and not is_currently_subscribed:
-                    count_change = 1
-                    new_subscription_state = True
-                    subscribing_to_set.add(creator_id)
-                elif action == 'unsubscribe' and is_currently_subscribed:
-                    count_change = -1
-                    new_subscription_state = False
-                    subscribing_to_set.discard(creator_id)
-                else:
-                    # No change needed (e.g., subscribing when already subscribed)
-                    context.log("No change in subscription state required.")
-
-                # --- Update Subscriber's Document if State Changed ---
-                subscription_updated = True
-                if new_subscription_state != is_currently_subscribed:
-                    updated_subscribing_list = list(subscribing_to_set)
-                    context.log(f"Updating subscriber subscriptions {subscriber_id} with new list (size {len(updated_subscribing_list)})...")
-                    try:
-                        if create_subscription_doc:
-                            # Create new subscriptions document if it doesn't exist
-                            databases.create_document(
-                                database_id=DATABASE_ID,
-                                collection_id=USER_SUBSCRIPTIONS_COLLECTION_ID,
-                                document_id=subscriber_id,
-                                data={'subscribedToChannelIds': updated_subscribing_list},
-                                permissions=[
-                                    Permission.read(Role.user(subscriber_id))  # Only user can read their subscriptions
-                                ]
-                            )
-                            context.log(f"Created new subscriptions document for {subscriber_id}")
-                        else:
-                            # Update existing subscriptions document
-                            databases.update_document(
-                                database_id=DATABASE_ID,
-                                collection_id=USER_SUBSCRIPTIONS_COLLECTION_ID,
-                                document_id=subscriber_id,
-                                data={'subscribedToChannelIds': updated_subscribing_list}
-                            )
-                            context.log(f"Updated subscriptions document for {subscriber_id}")
-                    except AppwriteException as update_err:
-                        context.error(f"Failed to update subscriptions document {subscriber_id}: {update_err}")
-                        subscription_updated = False
-                        raise update_err  # Re-raise to be caught by the outer try-except
-                    
-                    # --- Update Channel Stats if Count Changed ---
-                    stats_updated = True
-                    if count_change != 0:
-                        context.log(f"Updating channel stats for creator {creator_id} (change: {count_change})...")
-                        try:
-                            stats_doc = databases.get_document(DATABASE_ID, CHANNEL_STATS_COLLECTION_ID, creator_id)
-                            current_count = stats_doc.get('subscriberCount', 0)
-                            new_count = max(0, current_count + count_change)
-                            context.log(f"Updating existing stats doc {creator_id}. New count: {new_count}")
-                            databases.update_document(
-                                database_id=DATABASE_ID,
-                                collection_id=CHANNEL_STATS_COLLECTION_ID,
-                                document_id=creator_id,
-                                data={'subscriberCount': new_count}
-                            )
-                            context.log(f"Channel stats updated for {creator_id}.")
-                        except AppwriteException as e:
-                            if e.code == 404:
-                                # Create stats document if it doesn't exist
-                                new_count = max(0, count_change) # Should be 1 if subscribing
-                                context.log(f"Creating new stats doc {creator_id}. Initial count: {new_count}")
-                                try:
-                                    databases.create_document(
-                                        database_id=DATABASE_ID,
-                                        collection_id=CHANNEL_STATS_COLLECTION_ID,
-                                        document_id=creator_id,
-                                        data={'subscriberCount': new_count},
-                                        permissions=[Permission.read(Role.any())] # Public read access
-                                    )
-                                    context.log(f"Channel stats document created for {creator_id}.")
-                                except AppwriteException as create_err:
-                                    context.error(f"Failed to create channel stats document for {creator_id}: {create_err}")
-                                    stats_updated = False
-                                    raise create_err  # Re-raise to be caught by the outer try-except
-                            else:
-                                context.error(f"Failed to get/update channel stats for {creator_id}: {e}")
-                                stats_updated = False
-                                raise e  # Re-raise to be caught by the outer try-except
-
-                    # --- All Operations Succeeded, Delete Interaction Document ---
-                    if subscription_updated and stats_updated:
-                        context.log(f"Successfully processed interaction {interaction_id}, deleting document...")
-                        databases.delete_document(
-                            DATABASE_ID, 
-                            ACCOUNT_INTERACTIONS_COLLECTION_ID, 
-                            interaction_id
-                        )
-                        processed_count += 1
-                        context.log(f"Interaction {interaction_id} processed and deleted.")
-                    else:
-                        context.log(f"Interaction {interaction_id} partially processed but document not deleted.")
-                        failed_count += 1
-
-            except AppwriteException as e:
-                if e.code == 404 and e.message.__contains__(subscriber_id):
-                    context.error(f"Subscriber account document not found for {subscriber_id}. Cannot process interaction {interaction_id}.")
-                else:
-                    context.error(f"Database error processing interaction {interaction_id}: {e.message}")
-                failed_count += 1
-                # Don't delete the interaction document on failure
-                    
-            except Exception as e:
-                context.error(f"Error processing interaction {interaction_id}: {e}")
-                context.error(traceback.format_exc())
-                failed_count += 1
-                # Don't delete the interaction document on failure
-
         # --- Return Summary ---
-        context.log(f"Processing complete: {processed_count} processed, {failed_count} failed.")
+        context.log(f"Processing complete: {totals['processed']} processed, {totals['failed']} failed. Edge writes: {totals['subscriptionEdgeWrites']}, Channel stats writes: {totals['channelStatsWrites']}.")
         context.log("--- Subscriptions Manager Batch Job End (Success) ---")
         return context.res.json({
             "success": True,
-            "processed": processed_count,
-            "failed": failed_count,
-            "totalFetched": total_fetched
+            "processed": totals['processed'],
+            "failed": totals['failed'],
+            "deferred": totals['deferred'],
+            "totalFetched": total_fetched,
+            "subscriptionEdgeWrites": totals['subscriptionEdgeWrites'],
+            "legacyDocsMigrated": totals['legacyDocsMigrated'],
+            "channelStatsWrites": totals['channelStatsWrites'],
+            "channelStatsFailures": totals['channelStatsFailures'],
+            "reverseIndexWrites": totals['reverseIndexWrites'],
+            "reverseIndexFailures": totals['reverseIndexFailures'],
+            "recoveredBatches": totals['recoveredBatches'],
+            "pages": drain['pages'],
+            "backlogRemaining": drain['backlogRemaining'],
+            "drained": drain['drained']
         })
 
     except Exception as e:
@@ -255,4 +388,6 @@ def main(context):
         context.error(traceback.format_exc())
         context.log("--- Subscriptions Manager Batch Job End (Error) ---")
         return context.res.json({"success": False, "message": str(e),
-                               "processed": processed_count, "failed": failed_count}, 500)
+                               "processed": totals['processed'], "failed": totals['failed']}, 500)
+    finally:
+        release_partitions(databases, leases)
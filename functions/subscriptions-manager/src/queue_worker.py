@@ -0,0 +1,117 @@
+# Synced from functions/shared/queue_worker.py by functions/shared/sync.py. Edit the original, not this copy.
+"""
+Draining a queue collection within a share of the function's timeout.
+
+The interaction managers process the documents queued in a collection and delete them. Instead
+of taking one fixed page per run, `drain_queue` keeps fetching pages with `Query.cursor_after`
+until the queue is empty or the run has used QUEUE_TIME_BUDGET_SHARE of its timeout. It does not
+start a page that would not fit: the slowest page so far is used as the estimate for the next one.
+
+`process_page(documents)` handles one page and returns the IDs it left in the queue (failed or
+deferred documents). Processed documents are deleted, so the cursor only has to move past the
+ones that stay behind; the next page then starts after the last of them.
+
+When queue-dispatcher starts a run it sends {"maxItems": n}, the backlog it counted, and the run
+stops after that many documents (`requested_max_items`).
+"""
+import json
+import os
+import time
+
+from appwrite.exception import AppwriteException
+from appwrite.query import Query
+
+from .metrics import stage
+
+# Configuration Constants
+DATABASE_ID = "database"
+QUEUE_PAGE_SIZE = 100
+QUEUE_TIME_BUDGET_SHARE = float(os.environ.get("QUEUE_TIME_BUDGET_SHARE", "0.6")) # Share of the timeout spent draining
+
+
+def fetch_page(databases, collection_id, queries, page_size, cursor, context):
+    page_queries = queries + [Query.limit(page_size)]
+    if cursor:
+        page_queries.append(Query.cursor_after(cursor))
+    try:
+        return databases.list_documents(DATABASE_ID, collection_id, page_queries).get('documents', [])
+    except AppwriteException as e:
+        if not cursor or e.code != 400:
+            raise
+        # The cursor document was deleted since (e.g. by an overlapping run): start over from the head
+        context.log(f"Queue cursor {cursor} in {collection_id} no longer exists. Restarting from the head.")
+        return databases.list_documents(DATABASE_ID, collection_id, queries + [Query.limit(page_size)]).get('documents', [])
+
+
+def count_backlog(databases, collection_id, queries):
+    """Documents still queued. Appwrite caps list totals (5,000 by default), so large backlogs read as the cap."""
+    return databases.list_documents(DATABASE_ID, collection_id, queries + [Query.limit(1)]).get('total', 0)
+
+
+def requested_max_items(context):
+    """The `maxItems` sent by queue-dispatcher, or None for a scheduled or manual run."""
+    try:
+        max_items = json.loads(context.req.body_raw or '{}').get('maxItems')
+    except (ValueError, AttributeError):
+        return None
+    return max_items if isinstance(max_items, int) and max_items > 0 else None
+
+
+def drain_queue(databases, collection_id, process_page, context, timeout_seconds,
+                page_size=QUEUE_PAGE_SIZE, started_at=None, queries=None, max_items=None):
+    """
+    Processes pages of `collection_id` until it is empty, the time budget is used up or
+    `max_items` documents have been fetched.
+    Returns: A dict with pages, fetched, backlogRemaining and drained (True if the queue was emptied)
+    """
+    queries = list(queries or [])
+    started_at = time.monotonic() if started_at is None else started_at
+    budget_seconds = timeout_seconds * QUEUE_TIME_BUDGET_SHARE
+    cursor = None
+    attempted_ids = set() # A cursor restart must not process the same document twice in one run
+    pages = 0
+    fetched = 0
+    slowest_page_seconds = 0.0
+    drained = False
+
+    while True:
+        elapsed = time.monotonic() - started_at
+        if elapsed + slowest_page_seconds >= budget_seconds:
+            context.log(f"Time budget reached after {pages} pages ({elapsed:.1f}s of {budget_seconds:.1f}s). Leaving the rest for the next run.")
+            break
+
+        if max_items is not None and fetched >= max_items:
+            context.log(f"Fetched the {max_items} requested documents. Leaving the rest for the next run.")
+            break
+
+        page_limit = page_size if max_items is None else min(page_size, max_items - fetched)
+        page_started_at = time.monotonic()
+        with stage('queue_fetch'):
+            documents = fetch_page(databases, collection_id, queries, page_limit, cursor, context)
+        new_documents = [doc for doc in documents if doc['$id'] not in attempted_ids]
+        seen_ids = {doc['$id'] for doc in documents if doc['$id'] in attempted_ids}
+        attempted_ids.update(doc['$id'] for doc in new_documents)
+        pages += 1
+        fetched += len(new_documents)
+
+        with stage('queue_process'):
+            kept_ids = set(process_page(new_documents) or []) if new_documents else set()
+        kept_ids |= seen_ids
+        # Continue after the last document that is still queued; processed ones are gone
+        remaining_in_page = [doc['$id'] for doc in documents if doc['$id'] in kept_ids]
+        if remaining_in_page:
+            cursor = remaining_in_page[-1]
+
+        slowest_page_seconds = max(slowest_page_seconds, time.monotonic() - page_started_at)
+        if len(documents) < page_limit:
+            drained = True
+            break
+
+    with stage('queue_backlog'):
+        backlog_remaining = count_backlog(databases, collection_id, queries)
+    return {
+        "pages": pages,
+        "fetched": fetched,
+        "backlogRemaining": backlog_remaining,
+        "drained": drained
+    }
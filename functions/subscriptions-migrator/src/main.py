@@ -0,0 +1,123 @@
+from appwrite.services.databases import Databases
+from appwrite.exception import AppwriteException
+from appwrite.query import Query
+import os
+import time
+import traceback
+
+from .appwrite_client import create_client
+from .metrics import instrumented, stage
+from .profiling import profiled
+from .subscription_edges import (
+    LEGACY_USER_SUBSCRIPTIONS_COLLECTION_ID,
+    migrate_legacy_subscriptions,
+    delete_legacy_subscriptions,
+    reverse_index_shard,
+    apply_reverse_index_changes
+)
+from .versioned_writes import VersionConflictError
+
+# Configuration Constants
+DATABASE_ID = "database"
+LEGACY_PAGE_SIZE = 25 # Legacy documents fetched per page
+TIME_BUDGET_SECONDS = float(os.environ.get("TIME_BUDGET_SECONDS", "240")) # Stop migrating after this long
+
+@instrumented("subscriptions-migrator")
+@profiled
+def main(context):
+    context.log("--- Subscriptions Migrator Start ---")
+    started_at = time.monotonic()
+
+    # --- Environment & Auth Check ---
+    api_endpoint = os.environ.get("APPWRITE_FUNCTION_API_ENDPOINT")
+    project_id = os.environ.get("APPWRITE_FUNCTION_PROJECT_ID")
+    api_key = context.req.headers.get('x-appwrite-key')
+
+    if not all([api_endpoint, project_id, api_key]):
+        message = "Function configuration error: Missing endpoint, project ID, or API key."
+        context.error(message)
+        return context.res.json({"success": False, "message": message}, 500)
+
+    # --- Initialize Appwrite Client ---
+    client = create_client(api_endpoint, project_id, api_key)
+    databases = Databases(client)
+
+    users_migrated = 0
+    edges_created = 0
+    failed_count = 0
+    reverse_index_failures = 0
+    cursor = None # Documents that failed stay in the collection, so page past them
+    pass_completed = False
+
+    try:
+        # --- Migrate Legacy Documents Until None Are Left or the Budget Runs Out ---
+        # Migrated documents are deleted, so the collection itself is the progress checkpoint
+        while time.monotonic() - started_at < TIME_BUDGET_SECONDS:
+            queries = [Query.limit(LEGACY_PAGE_SIZE)]
+            if cursor:
+                queries.append(Query.cursor_after(cursor))
+            with stage('legacy_fetch'):
+                legacy_docs = databases.list_documents(DATABASE_ID, LEGACY_USER_SUBSCRIPTIONS_COLLECTION_ID, queries).get('documents', [])
+
+            reverse_index_changes = {} # Map (creatorId, shard) -> {subscriberId: +1}
+            migrated_ids = []
+            failed_ids = set()
+            for legacy_doc in legacy_docs:
+                subscriber_id = legacy_doc['$id']
+                try:
+                    with stage('migrate'):
+                        creator_ids, created = migrate_legacy_subscriptions(databases, subscriber_id, legacy_doc)
+                    migrated_ids.append(subscriber_id)
+                    edges_created += len(created)
+                    for creator_id in creator_ids:
+                        reverse_index_changes.setdefault((creator_id, reverse_index_shard(subscriber_id)), {})[subscriber_id] = 1
+                except AppwriteException as e:
+                    context.error(f"Failed to migrate subscriptions of {subscriber_id}: {e}")
+                    failed_ids.add(subscriber_id)
+
+            # --- Backfill the Reverse Index Once per (Creator, Shard) of This Page ---
+            # Outside the creators' partition leases, so only subscribers whose edge still exists are added
+            for (creator_id, shard), changes in reverse_index_changes.items():
+                try:
+                    with stage('reverse_index'):
+                        apply_reverse_index_changes(databases, creator_id, shard, changes, unleased=True)
+                except (AppwriteException, VersionConflictError) as e:
+                    context.error(f"Failed to backfill reverse index shard {shard} of {creator_id}: {e}")
+                    reverse_index_failures += 1
+                    failed_ids.update(changes) # Their legacy documents stay, so the next pass retries them
+
+            # --- Delete the Legacy Documents Whose Edges and Reverse Index Entries All Exist ---
+            for subscriber_id in migrated_ids:
+                if subscriber_id in failed_ids:
+                    continue
+                try:
+                    with stage('legacy_delete'):
+                        delete_legacy_subscriptions(databases, subscriber_id)
+                    users_migrated += 1
+                except AppwriteException as e:
+                    context.error(f"Failed to delete legacy subscriptions of {subscriber_id}: {e}")
+                    failed_ids.add(subscriber_id)
+            failed_count += len(failed_ids)
+            if failed_ids:
+                cursor = [doc['$id'] for doc in legacy_docs if doc['$id'] in failed_ids][-1] # The last document left on this page
+
+            if len(legacy_docs) < LEGACY_PAGE_SIZE:
+                pass_completed = True
+                break
+
+        context.log(f"Migration finished. Users: {users_migrated}, Edges: {edges_created}, Failed: {failed_count}, Pass completed: {pass_completed}")
+        return context.res.json({
+            "success": True,
+            "usersMigrated": users_migrated,
+            "edgesCreated": edges_created,
+            "failed": failed_count,
+            "reverseIndexFailures": reverse_index_failures,
+            "passCompleted": pass_completed
+        })
+
+    except Exception as e:
+        context.error(f"An unexpected error occurred during migration: {e}")
+        context.error(traceback.format_exc())
+        return context.res.json({"success": False, "message": f"Unexpected Error: {str(e)}"}, 500)
+    finally:
+        context.log("--- Subscriptions Migrator End ---")
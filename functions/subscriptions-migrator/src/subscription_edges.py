@@ -0,0 +1,217 @@
+# Synced from functions/shared/subscription_edges.py by functions/shared/sync.py. Edit the original, not this copy.
+"""
+Subscriptions stored as one document per (subscriber, creator) edge.
+
+The edge document ID is derived from the pair, so subscribing is a single create (409 means
+already subscribed), unsubscribing is a single delete (404 means not subscribed) and a
+membership check is a single get, however many channels the user follows. Both outcomes are
+idempotent, which also makes replaying an interaction safe.
+
+Before edges existed every subscription lived in the `subscribedToChannelIds` array of the
+user's `user_subscriptions` document. `migrate_legacy_subscriptions` turns such a document into
+edges; the caller backfills the reverse index and then deletes the document. subscriptions-manager
+migrates active users lazily and the subscriptions-migrator function sweeps the rest.
+
+The `channel_subscribers` reverse index lists each creator's subscribers for feed-fanout. A
+subscriber belongs to one of REVERSE_INDEX_SHARDS shards, and a shard is a chain of page
+documents of at most SUBSCRIBERS_PER_PAGE ids, so no document grows with the channel. Pages are
+written with update_versioned: subscriptions-manager and subscriptions-migrator change the same
+pages concurrently.
+"""
+import hashlib
+import zlib
+
+from appwrite.exception import AppwriteException
+from appwrite.permission import Permission
+from appwrite.role import Role
+from appwrite.query import Query
+
+from .versioned_writes import update_versioned
+
+# Configuration Constants
+DATABASE_ID = "database"
+SUBSCRIPTIONS_COLLECTION_ID = "subscriptions"
+LEGACY_USER_SUBSCRIPTIONS_COLLECTION_ID = "user_subscriptions"
+CHANNEL_SUBSCRIBERS_COLLECTION_ID = "channel_subscribers" # Reverse index: creator -> subscribers
+REVERSE_INDEX_SHARDS = 16 # Shards per creator in the reverse index
+SUBSCRIBERS_PER_PAGE = 1000 # Subscriber ids per reverse index document; a full shard opens another page
+PAGE_LIST_LIMIT = 100
+
+
+def edge_document_id(subscriber_id, creator_id):
+    # Two user IDs do not fit in Appwrite's 36 character ID limit, so hash the pair
+    return hashlib.blake2b(f"{subscriber_id}:{creator_id}".encode('utf-8'), digest_size=16).hexdigest()
+
+
+def add_subscription(databases, subscriber_id, creator_id):
+    """Creates the edge. Returns True if it was created, False if it already existed."""
+    try:
+        databases.create_document(
+            DATABASE_ID,
+            SUBSCRIPTIONS_COLLECTION_ID,
+            edge_document_id(subscriber_id, creator_id),
+            {'subscriberId': subscriber_id, 'creatorId': creator_id},
+            [Permission.read(Role.user(subscriber_id))] # Only the subscriber can read their subscriptions
+        )
+        return True
+    except AppwriteException as e:
+        if e.code == 409:
+            return False
+        raise
+
+
+def remove_subscription(databases, subscriber_id, creator_id):
+    """Deletes the edge. Returns True if it was deleted, False if it did not exist."""
+    try:
+        databases.delete_document(DATABASE_ID, SUBSCRIPTIONS_COLLECTION_ID, edge_document_id(subscriber_id, creator_id))
+        return True
+    except AppwriteException as e:
+        if e.code == 404:
+            return False
+        raise
+
+
+def is_subscribed(databases, subscriber_id, creator_id):
+    try:
+        databases.get_document(DATABASE_ID, SUBSCRIPTIONS_COLLECTION_ID, edge_document_id(subscriber_id, creator_id))
+        return True
+    except AppwriteException as e:
+        if e.code == 404:
+            return False
+        raise
+
+
+def migrate_legacy_subscriptions(databases, subscriber_id, legacy_doc=None):
+    """
+    Converts a user's legacy subscriptions array into edges. The legacy document stays until the
+    caller has added the subscriber to the reverse index of every creator it returns and called
+    delete_legacy_subscriptions, so a migration that fails halfway is retried from the same array.
+    Subscriber counts are not touched: channel_stats already includes these subscriptions.
+    Returns: (every creator ID in the legacy array, the creator IDs whose edges were created), or None if there was no legacy document
+    """
+    if legacy_doc is None:
+        try:
+            legacy_doc = databases.get_document(DATABASE_ID, LEGACY_USER_SUBSCRIPTIONS_COLLECTION_ID, subscriber_id)
+        except AppwriteException as e:
+            if e.code == 404:
+                return None
+            raise
+
+    creator_ids = [creator_id for creator_id in dict.fromkeys(legacy_doc.get('subscribedToChannelIds', []) or []) if creator_id != subscriber_id]
+    created = [creator_id for creator_id in creator_ids if add_subscription(databases, subscriber_id, creator_id)]
+    return creator_ids, created
+
+
+def delete_legacy_subscriptions(databases, subscriber_id):
+    """Deletes a user's legacy subscriptions document once its edges and reverse index entries exist."""
+    try:
+        databases.delete_document(DATABASE_ID, LEGACY_USER_SUBSCRIPTIONS_COLLECTION_ID, subscriber_id)
+    except AppwriteException as e:
+        if e.code != 404: # Already migrated by a concurrent run
+            raise
+
+
+def reverse_index_shard(subscriber_id):
+    """Stable shard number of a subscriber within a creator's reverse index."""
+    return zlib.crc32(subscriber_id.encode('utf-8')) % REVERSE_INDEX_SHARDS
+
+
+def reverse_index_page_id(creator_id, shard, page):
+    # Page 0 keeps the ID shards had before they were paged
+    return f"{creator_id}_{shard}" if page == 0 else f"{creator_id}_{shard}_{page}"
+
+
+def list_reverse_index_pages(databases, creator_id, shard):
+    """Returns: The page documents of one shard of a creator's reverse index"""
+    page_docs = []
+    cursor = None
+    while True:
+        queries = [Query.equal('creatorId', creator_id), Query.equal('shard', shard), Query.limit(PAGE_LIST_LIMIT)]
+        if cursor:
+            queries.append(Query.cursor_after(cursor))
+        docs = databases.list_documents(DATABASE_ID, CHANNEL_SUBSCRIBERS_COLLECTION_ID, queries).get('documents', [])
+        page_docs.extend(docs)
+        if len(docs) < PAGE_LIST_LIMIT:
+            return page_docs
+        cursor = docs[-1]['$id']
+
+
+def apply_reverse_index_changes(databases, creator_id, shard, changes, unleased=False):
+    """
+    Adds/removes subscribers (subscriberId -> +1/-1) in one shard of a creator's reverse index.
+    Removals apply to every page of the shard. Additions fill the pages in order and open a new
+    page once every page holds SUBSCRIBERS_PER_PAGE ids.
+
+    subscriptions-manager's creator batches hold the creator's partition lease and change the edge
+    before the index. Legacy migrations run outside that lease and pass `unleased`: they only add,
+    a subscriber is added only while its edge exists, and once written each edge is checked again.
+    A subscriber whose edge an unsubscribe removed meanwhile is taken back out. A leased addition of
+    a subscriber already listed rewrites its page, so a take-back cannot overtake a re-subscribe.
+    Raises: VersionConflictError if a page kept changing under the write; AppwriteException on database errors
+    """
+    page_docs = list_reverse_index_pages(databases, creator_id, shard)
+    listed_ids = {subscriber_id for doc in page_docs for subscriber_id in (doc.get('subscriberIds', []) or [])}
+    removed = {subscriber_id for subscriber_id, change in changes.items() if change < 0}
+    added = [subscriber_id for subscriber_id, change in changes.items() if change > 0]
+    pending = [subscriber_id for subscriber_id in added if subscriber_id not in listed_ids]
+    relisted = set() if unleased else {subscriber_id for subscriber_id in added if subscriber_id in listed_ids}
+    last_page = max((doc.get('page', 0) or 0 for doc in page_docs), default=0)
+
+    written = [] # Subscribers this call added to a page
+    found = set() # Relisted subscribers still on their page
+    page = 0
+    while page <= last_page or pending:
+        page_ids = []
+        added_ids = []
+        dropped = set() # Unleased additions whose edge is gone
+
+        def build(page_doc):
+            subscriber_ids = (page_doc or {}).get('subscriberIds', []) or []
+            kept_ids = [subscriber_id for subscriber_id in subscriber_ids if subscriber_id not in removed]
+            room = max(SUBSCRIBERS_PER_PAGE - len(kept_ids), 0)
+            added_ids.clear()
+            dropped.clear()
+            for subscriber_id in pending:
+                if len(added_ids) >= room:
+                    break
+                if subscriber_id in subscriber_ids:
+                    continue
+                # Checked after this version of the page was read, so a write of it conflicts with any later removal
+                if unleased and not is_subscribed(databases, subscriber_id, creator_id):
+                    dropped.add(subscriber_id)
+                    continue
+                added_ids.append(subscriber_id)
+            page_ids[:] = kept_ids + added_ids
+            if len(kept_ids) == len(subscriber_ids) and not added_ids and not relisted.intersection(subscriber_ids):
+                return None
+            return {'subscriberIds': kept_ids + added_ids}
+
+        update_versioned(
+            databases, CHANNEL_SUBSCRIBERS_COLLECTION_ID, reverse_index_page_id(creator_id, shard, page), build,
+            create_data={'creatorId': creator_id, 'shard': shard, 'page': page}
+        )
+        written.extend(added_ids)
+        found.update(relisted.intersection(page_ids))
+        on_page = set(page_ids)
+        pending = [subscriber_id for subscriber_id in pending if subscriber_id not in on_page and subscriber_id not in dropped]
+        page += 1
+
+    if unleased:
+        unsubscribed = [subscriber_id for subscriber_id in written if not is_subscribed(databases, subscriber_id, creator_id)]
+        if unsubscribed:
+            _take_back_unsubscribed(databases, creator_id, shard, unsubscribed)
+    if relisted - found: # Taken back since the listing, so add them again
+        apply_reverse_index_changes(databases, creator_id, shard, {subscriber_id: 1 for subscriber_id in relisted - found})
+
+
+def _take_back_unsubscribed(databases, creator_id, shard, subscriber_ids):
+    """Removes the subscribers whose edge is gone from every page of a shard, checking each edge inside the versioned build."""
+    for page_doc in list_reverse_index_pages(databases, creator_id, shard):
+        def build(page_doc):
+            listed = (page_doc or {}).get('subscriberIds', []) or []
+            stale = {subscriber_id for subscriber_id in subscriber_ids if subscriber_id in listed and not is_subscribed(databases, subscriber_id, creator_id)}
+            if not stale:
+                return None
+            return {'subscriberIds': [subscriber_id for subscriber_id in listed if subscriber_id not in stale]}
+
+        update_versioned(databases, CHANNEL_SUBSCRIBERS_COLLECTION_ID, page_doc['$id'], build)
@@ -0,0 +1,201 @@
+# Synced from functions/shared/versioned_writes.py by functions/shared/sync.py. Edit the original, not this copy.
+"""
+Optimistic concurrency and idempotency keys for counter documents.
+
+A counter document (video_counts, video_count_shards, channel_stats, subscription_feeds,
+channel_subscribers) carries a `version` and a `writtenVersion`. A writer reads the document at
+version v, computes its new values and claims version v+1 with a bounded atomic increment of
+`version` (max v+1, Appwrite 1.7+). Appwrite has no compare-and-swap on updates, but the bound
+makes the increment one: only one writer moves the version from v to v+1, and the others re-read
+and retry with a jittered backoff. The winner then writes its values with `writtenVersion` v+1:
+
+    update_versioned(databases, 'channel_stats', creator_id,
+                     lambda stats_doc: {'subscriberCount': ...}, idempotency_key='subscriptions:' + entry_id)
+
+While `version` is ahead of `writtenVersion`, a write is in flight and the other writers wait. A
+claim whose writer died is taken over once the document has not changed for CLAIM_LEASE_SECONDS:
+its values were never written, so the document is still consistent at `writtenVersion`. Nothing is
+written outside the target document, so there is nothing to clean up.
+
+A write may carry an idempotency key, `<scope>:<id>`, e.g. `likes:<journal entry ID>`. The key is
+stored in the document's `appliedKeys` by the same update as the new values, so a write retried
+after a crash finds its key and is skipped. Each stored key carries the time it was applied. Keys
+are pruned by age: a key older than APPLIED_KEY_TTL_SECONDS is dropped unless it is the newest of
+its scope. A scope's next keyed write only comes after its earlier batches are finished
+(counter_journal.py), so the newest key is the only old one a retry can still need. The TTL covers
+runs whose leases overlapped.
+
+Every read-modify-write of a versioned counter field has to go through update_versioned.
+"""
+import os
+import random
+import time
+from datetime import datetime
+
+from appwrite.exception import AppwriteException
+
+# Configuration Constants
+DATABASE_ID = "database"
+VERSION_ATTRIBUTE = 'version'
+WRITTEN_VERSION_ATTRIBUTE = 'writtenVersion'
+APPLIED_KEYS_ATTRIBUTE = 'appliedKeys'
+APPLIED_KEY_TTL_SECONDS = 900 # Longer than any run (FUNCTION_TIMEOUT_SECONDS) plus its lease
+VERSION_CONFLICT_RETRIES = int(os.environ.get("VERSION_CONFLICT_RETRIES", "8"))
+CONFLICT_BACKOFF_SECONDS = 0.05 # Doubles with every retry, with full jitter
+CLAIM_LEASE_SECONDS = 30 # A claimed version not written for this long is taken over
+
+
+class VersionConflictError(Exception):
+    """A versioned write lost VERSION_CONFLICT_RETRIES races for the next version in a row."""
+
+
+def _split_record(record):
+    """A stored `appliedKeys` entry `<key>@<applied at>` as (key, applied at)."""
+    key, _sep, applied_at = record.rpartition('@')
+    try:
+        return key, int(applied_at)
+    except ValueError:
+        return record, 0
+
+
+def _scope(key):
+    return key.split(':', 1)[0]
+
+
+def applied_keys(doc):
+    """The idempotency keys applied to a document."""
+    return {_split_record(record)[0] for record in ((doc or {}).get(APPLIED_KEYS_ATTRIBUTE) or [])}
+
+
+def _prune_applied_keys(records, now):
+    """Keeps the newest key of each scope and every key younger than APPLIED_KEY_TTL_SECONDS, each key once."""
+    latest = {}
+    for record in records:
+        key, applied_at = _split_record(record)
+        if applied_at >= latest.get(key, (None, -1))[1]:
+            latest[key] = (record, applied_at)
+    newest_by_scope = {}
+    for key, (_record, applied_at) in latest.items():
+        newest_by_scope[_scope(key)] = max(newest_by_scope.get(_scope(key), -1), applied_at)
+    return [
+        record for key, (record, applied_at) in latest.items()
+        if applied_at == newest_by_scope[_scope(key)] or now - applied_at < APPLIED_KEY_TTL_SECONDS
+    ]
+
+
+def add_applied_key(records, key, now=None):
+    """`records` with `key` added as applied now."""
+    now = int(time.time()) if now is None else now
+    kept = [record for record in (records or []) if _split_record(record)[0] != key]
+    return _prune_applied_keys(kept + [f"{key}@{now}"], now)
+
+
+def merge_applied_keys(records, more_records, now=None):
+    """The stored keys of `records` and `more_records`, pruned like add_applied_key."""
+    now = int(time.time()) if now is None else now
+    return _prune_applied_keys(list(records or []) + list(more_records or []), now)
+
+
+def _seconds_since_update(doc):
+    try:
+        return time.time() - datetime.fromisoformat(doc['$updatedAt']).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return float('inf')
+
+
+def _claim_next_version(databases, collection_id, document_id, version):
+    """
+    Moves the document's `version` from `version` to `version + 1`.
+    Returns: True if this writer claimed it, False if another writer got there first
+    """
+    try:
+        databases.increment_document_attribute(
+            DATABASE_ID, collection_id, document_id, VERSION_ATTRIBUTE, 1, version + 1
+        )
+        return True
+    except AppwriteException as e:
+        if e.code in (400, 404, 409): # Past the bound: the version moved on, or the document went away
+            return False
+        raise
+
+
+def update_versioned(databases, collection_id, document_id, build, idempotency_key=None,
+                     create_data=None, permissions=None):
+    """
+    Reads the document and writes the fields `build(document)` returns at the next version. The
+    document is None if it does not exist yet; it is then created from `create_data` and the fields.
+    `build` runs again after every conflict, so it must not have side effects. It returns None
+    when there is nothing to write.
+    Returns: The fields written, or None if nothing was written or the key was already applied
+    Raises: VersionConflictError if every attempt lost its race; AppwriteException on database errors
+    """
+    for attempt in range(VERSION_CONFLICT_RETRIES):
+        if attempt:
+            time.sleep(random.uniform(0, CONFLICT_BACKOFF_SECONDS * 2 ** attempt))
+        try:
+            doc = databases.get_document(DATABASE_ID, collection_id, document_id)
+        except AppwriteException as e:
+            if e.code != 404:
+                raise
+            doc = None
+        if idempotency_key and idempotency_key in applied_keys(doc):
+            return None
+
+        version = (doc or {}).get(VERSION_ATTRIBUTE) or 0
+        written_version = (doc or {}).get(WRITTEN_VERSION_ATTRIBUTE)
+        if doc and written_version is not None and written_version < version and _seconds_since_update(doc) < CLAIM_LEASE_SECONDS:
+            continue # Another writer is between its claim and its write
+
+        data = build(doc)
+        if data is None:
+            return None
+        data = {**data, VERSION_ATTRIBUTE: version + 1, WRITTEN_VERSION_ATTRIBUTE: version + 1}
+        if idempotency_key:
+            data[APPLIED_KEYS_ATTRIBUTE] = add_applied_key(
+                data.get(APPLIED_KEYS_ATTRIBUTE, (doc or {}).get(APPLIED_KEYS_ATTRIBUTE)), idempotency_key
+            )
+        if doc:
+            if not _claim_next_version(databases, collection_id, document_id, version):
+                continue
+            databases.update_document(DATABASE_ID, collection_id, document_id, data)
+            return data
+        try:
+            databases.create_document(DATABASE_ID, collection_id, document_id, {**(create_data or {}), **data}, permissions)
+            return data
+        except AppwriteException as e:
+            if e.code != 409: # Created by another writer since the read
+                raise
+    raise VersionConflictError(f"Gave up writing {collection_id}/{document_id} after {VERSION_CONFLICT_RETRIES} version conflicts.")
+
+
+def delete_versioned(databases, collection_id, document_id, should_delete):
+    """
+    Deletes the document if `should_delete(document)` is true of its current version. The delete
+    claims the next version first, so a writer that read the document before cannot write it back.
+    Returns: True if the document was deleted or is already gone
+    Raises: VersionConflictError if every attempt lost its race; AppwriteException on database errors
+    """
+    for attempt in range(VERSION_CONFLICT_RETRIES):
+        if attempt:
+            time.sleep(random.uniform(0, CONFLICT_BACKOFF_SECONDS * 2 ** attempt))
+        try:
+            doc = databases.get_document(DATABASE_ID, collection_id, document_id)
+        except AppwriteException as e:
+            if e.code != 404:
+                raise
+            return True
+        version = doc.get(VERSION_ATTRIBUTE) or 0
+        written_version = doc.get(WRITTEN_VERSION_ATTRIBUTE)
+        if written_version is not None and written_version < version and _seconds_since_update(doc) < CLAIM_LEASE_SECONDS:
+            continue
+        if not should_delete(doc):
+            return False
+        if not _claim_next_version(databases, collection_id, document_id, version):
+            continue
+        try:
+            databases.delete_document(DATABASE_ID, collection_id, document_id)
+        except AppwriteException as e:
+            if e.code != 404:
+                raise
+        return True
+    raise VersionConflictError(f"Gave up deleting {collection_id}/{document_id} after {VERSION_CONFLICT_RETRIES} version conflicts.")
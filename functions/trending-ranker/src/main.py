@@ -0,0 +1,322 @@
+from appwrite.services.databases import Databases
+from appwrite.exception import AppwriteException
+from appwrite.id import ID
+from appwrite.permission import Permission
+from appwrite.role import Role
+from appwrite.query import Query
+import os
+import json
+import math
+import time
+import traceback
+import numpy as np
+
+from .appwrite_client import create_client
+from .metrics import instrumented, stage
+from .profiling import profiled
+
+# Configuration Constants
+DATABASE_ID = "database"
+TRENDING_DELTAS_COLLECTION_ID = "trending_deltas"
+TRENDING_SCORES_COLLECTION_ID = "trending_scores"
+LEADERBOARDS_COLLECTION_ID = "leaderboards"
+TRENDING_LEADERBOARD_ID = "trending"
+TOP_K = int(os.environ.get("TRENDING_TOP_K", "50"))
+CANDIDATES_K = TOP_K * 2 # Extra candidates kept so the top K is stable when entries drop out
+HALF_LIFE_HOURS = float(os.environ.get("TRENDING_HALF_LIFE_HOURS", "24"))
+DECAY_RATE = math.log(2) / (HALF_LIFE_HOURS * 3600) # Per second
+REBASE_AFTER = 30.0 # Move the score epoch forward once exp(DECAY_RATE * age) exceeds e^30
+MAX_DELTA_DOCS_PER_RUN = 500
+PAGE_SIZE = 100
+# Scores that have decayed below this are deleted from trending_scores
+PRUNE_BELOW_SCORE = float(os.environ.get("TRENDING_PRUNE_BELOW_SCORE", "0.01"))
+FUNCTION_TIMEOUT_SECONDS = 60 # Keep in sync with the function's timeout in appwrite.json
+PRUNE_TIME_SHARE = 0.8 # Pruning stops once this share of the timeout has passed
+MAX_TIMESTAMP = 9999999999
+
+# Engagement weights per source
+SOURCE_WEIGHTS = {
+    'views': 1.0,
+    'likes': 5.0,
+    'comments': 10.0
+}
+
+# Scores use forward decay: an event at time t adds weight * exp(DECAY_RATE * (t - epoch)).
+# Every stored score grows by the same factor over time, so the ranking of videos with no new
+# events never changes and each run only has to touch the videos that received events.
+# The decayed score at time `now` is forward_score * exp(-DECAY_RATE * (now - epoch)).
+#
+# A run applies its delta documents as one batch. The batch is recorded on the leaderboard
+# (pendingBatchId, pendingDeltaIdsJson) before any score is written, and every score written by
+# it carries its batchId. A run that finds a pending batch finishes that one first: scores that
+# already carry the batchId are not added to again, and the batch is only cleared once all its
+# delta documents are deleted. A crash therefore never applies a delta document twice.
+
+def load_leaderboard(databases, now):
+    """
+    Returns: A tuple (epoch, candidates, leaderboard document or None), where candidates maps
+    videoId -> forward score at that epoch
+    """
+    try:
+        leaderboard_doc = databases.get_document(DATABASE_ID, LEADERBOARDS_COLLECTION_ID, TRENDING_LEADERBOARD_ID)
+        return leaderboard_doc.get('epoch') or now, json.loads(leaderboard_doc.get('candidatesJson') or '{}'), leaderboard_doc
+    except AppwriteException as e:
+        if e.code == 404:
+            return now, {}, None
+        raise
+
+def write_leaderboard(databases, leaderboard_exists, data):
+    if leaderboard_exists:
+        databases.update_document(DATABASE_ID, LEADERBOARDS_COLLECTION_ID, TRENDING_LEADERBOARD_ID, data)
+    else:
+        databases.create_document(
+            DATABASE_ID, LEADERBOARDS_COLLECTION_ID, TRENDING_LEADERBOARD_ID, data,
+            [Permission.read(Role.any())]
+        )
+
+def fetch_delta_documents(databases):
+    """Fetches up to MAX_DELTA_DOCS_PER_RUN trending_deltas documents, oldest first."""
+    delta_docs = []
+    cursor = None
+    while len(delta_docs) < MAX_DELTA_DOCS_PER_RUN:
+        queries = [Query.limit(PAGE_SIZE)]
+        if cursor:
+            queries.append(Query.cursor_after(cursor))
+        documents = databases.list_documents(DATABASE_ID, TRENDING_DELTAS_COLLECTION_ID, queries).get('documents', [])
+        delta_docs.extend(documents)
+        if len(documents) < PAGE_SIZE:
+            break
+        cursor = documents[-1]['$id']
+    return delta_docs[:MAX_DELTA_DOCS_PER_RUN]
+
+def fetch_delta_documents_by_id(databases, delta_ids):
+    """Fetches the trending_deltas documents of a pending batch that have not been deleted yet."""
+    delta_docs = []
+    for start in range(0, len(delta_ids), PAGE_SIZE):
+        chunk = delta_ids[start:start + PAGE_SIZE]
+        delta_docs.extend(databases.list_documents(
+            DATABASE_ID, TRENDING_DELTAS_COLLECTION_ID,
+            [Query.equal('$id', chunk), Query.limit(PAGE_SIZE)]
+        ).get('documents', []))
+    return delta_docs
+
+def aggregate_contributions(delta_docs, epoch, context):
+    """
+    Turns delta documents into one forward-decayed contribution per video, vectorized.
+    Returns: A tuple (video_ids, contributions) of equal-length numpy arrays.
+    """
+    video_ids = []
+    weights = []
+    timestamps = []
+    for delta_doc in delta_docs:
+        weight = SOURCE_WEIGHTS.get(delta_doc.get('source'))
+        if weight is None:
+            context.log(f"Warning: Unknown trending source '{delta_doc.get('source')}' in {delta_doc['$id']}. Ignoring.")
+            continue
+        try:
+            deltas = json.loads(delta_doc.get('deltasJson') or '{}')
+        except json.JSONDecodeError:
+            context.log(f"Warning: Invalid deltasJson in {delta_doc['$id']}. Ignoring.")
+            continue
+        for video_id, count in deltas.items():
+            video_ids.append(video_id)
+            weights.append(weight * count)
+            timestamps.append(delta_doc.get('timestamp') or epoch)
+
+    if not video_ids:
+        return np.array([], dtype=object), np.array([], dtype=float)
+
+    unique_ids, inverse = np.unique(np.array(video_ids, dtype=object), return_inverse=True)
+    forward = np.array(weights, dtype=float) * np.exp(DECAY_RATE * (np.array(timestamps, dtype=float) - epoch))
+    return unique_ids, np.bincount(inverse, weights=forward, minlength=len(unique_ids))
+
+def fetch_stored_scores(databases, video_ids, epoch, batch_id):
+    """
+    Returns: A tuple (scores, exists, applied) of numpy arrays: the stored forward scores of
+    `video_ids` converted to `epoch`, whether each score document exists, and whether the batch
+    `batch_id` was already added to it
+    """
+    scores = np.zeros(len(video_ids), dtype=float)
+    exists = np.zeros(len(video_ids), dtype=bool)
+    applied = np.zeros(len(video_ids), dtype=bool)
+    positions = {video_id: index for index, video_id in enumerate(video_ids)}
+    for start in range(0, len(video_ids), PAGE_SIZE):
+        chunk = list(video_ids[start:start + PAGE_SIZE])
+        documents = databases.list_documents(
+            DATABASE_ID, TRENDING_SCORES_COLLECTION_ID,
+            [Query.equal('$id', chunk), Query.limit(PAGE_SIZE)]
+        ).get('documents', [])
+        for score_doc in documents:
+            index = positions[score_doc['$id']]
+            scores[index] = (score_doc.get('score') or 0.0) * math.exp(DECAY_RATE * ((score_doc.get('epoch') or epoch) - epoch))
+            exists[index] = True
+            applied[index] = score_doc.get('batchId') == batch_id
+    return scores, exists, applied
+
+def expires_at(score, epoch):
+    """The time at which a forward score at `epoch` decays below PRUNE_BELOW_SCORE."""
+    if score <= PRUNE_BELOW_SCORE:
+        return epoch
+    return min(int(epoch + math.log(score / PRUNE_BELOW_SCORE) / DECAY_RATE), MAX_TIMESTAMP)
+
+def prune_expired_scores(databases, now, deadline, context):
+    """
+    Deletes trending_scores documents whose score has decayed below PRUNE_BELOW_SCORE, page by
+    page until none are left or `deadline` (time.monotonic()) passes.
+    Returns: The number of documents deleted
+    """
+    deleted = 0
+    cursor = None # Documents that failed to delete stay, so page past them
+    while time.monotonic() < deadline:
+        # Scores written before expiresAt existed have 0 and are kept until their next write
+        queries = [Query.greater_than('expiresAt', 0), Query.less_than('expiresAt', now), Query.select(['$id']), Query.limit(PAGE_SIZE)]
+        if cursor:
+            queries.append(Query.cursor_after(cursor))
+        score_docs = databases.list_documents(DATABASE_ID, TRENDING_SCORES_COLLECTION_ID, queries).get('documents', [])
+        for score_doc in score_docs:
+            try:
+                databases.delete_document(DATABASE_ID, TRENDING_SCORES_COLLECTION_ID, score_doc['$id'])
+                deleted += 1
+            except AppwriteException as e:
+                if e.code != 404:
+                    context.error(f"Failed to delete expired trending score {score_doc['$id']}: {e}")
+                    cursor = score_doc['$id']
+        if len(score_docs) < PAGE_SIZE:
+            break
+    return deleted
+
+@instrumented("trending-ranker")
+@profiled
+def main(context):
+    context.log("--- Trending Ranker Start ---")
+    started_at = time.monotonic()
+
+    # --- Environment & Auth Check ---
+    api_endpoint = os.environ.get("APPWRITE_FUNCTION_API_ENDPOINT")
+    project_id = os.environ.get("APPWRITE_FUNCTION_PROJECT_ID")
+    api_key = context.req.headers.get('x-appwrite-key')
+
+    if not all([api_endpoint, project_id, api_key]):
+        message = "Function configuration error: Missing endpoint, project ID, or API key."
+        context.error(message)
+        return context.res.json({"success": False, "message": message}, 500)
+
+    # --- Initialize Appwrite Client ---
+    client = create_client(api_endpoint, project_id, api_key)
+    databases = Databases(client)
+
+    try:
+        now = int(time.time())
+        epoch, candidates, leaderboard_doc = load_leaderboard(databases, now)
+        leaderboard_exists = leaderboard_doc is not None
+
+        # --- Move the Epoch Forward Before Forward Scores Get Too Large ---
+        if DECAY_RATE * (now - epoch) > REBASE_AFTER:
+            factor = math.exp(DECAY_RATE * (epoch - now))
+            candidates = {video_id: score * factor for video_id, score in candidates.items()}
+            context.log(f"Rebased trending epoch from {epoch} to {now}.")
+            epoch = now
+
+        # --- Finish the Batch of an Interrupted Run, or Start a New One ---
+        batch_id = (leaderboard_doc or {}).get('pendingBatchId')
+        with stage('fetch_deltas'):
+            if batch_id:
+                delta_docs = fetch_delta_documents_by_id(databases, json.loads(leaderboard_doc.get('pendingDeltaIdsJson') or '[]'))
+                context.log(f"Resuming trending batch {batch_id} with {len(delta_docs)} delta documents left.")
+            else:
+                delta_docs = fetch_delta_documents(databases)
+                context.log(f"Fetched {len(delta_docs)} trending delta documents.")
+                if delta_docs:
+                    batch_id = ID.unique()
+                    write_leaderboard(databases, leaderboard_exists, {
+                        'pendingBatchId': batch_id,
+                        'pendingDeltaIdsJson': json.dumps([delta_doc['$id'] for delta_doc in delta_docs], separators=(',', ':'))
+                    })
+                    leaderboard_exists = True
+        with stage('aggregate'):
+            video_ids, contributions = aggregate_contributions(delta_docs, epoch, context)
+
+        # --- Update Stored Scores of the Changed Videos Only ---
+        score_write_failures = 0
+        if len(video_ids):
+            with stage('score_writes'):
+                stored_scores, exists, applied = fetch_stored_scores(databases, video_ids, epoch, batch_id)
+                new_scores = stored_scores + np.where(applied, 0.0, contributions)
+                for video_id, score, existed, was_applied in zip(video_ids, new_scores.tolist(), exists.tolist(), applied.tolist()):
+                    if not was_applied:
+                        data = {'score': score, 'epoch': epoch, 'batchId': batch_id, 'expiresAt': expires_at(score, epoch)}
+                        try:
+                            if existed:
+                                databases.update_document(DATABASE_ID, TRENDING_SCORES_COLLECTION_ID, video_id, data)
+                            else:
+                                databases.create_document(DATABASE_ID, TRENDING_SCORES_COLLECTION_ID, video_id, data)
+                        except AppwriteException as e:
+                            context.error(f"Failed to store trending score for {video_id}: {e}")
+                            score_write_failures += 1
+                            continue
+                    candidates[video_id] = score
+
+        # --- Keep the Top Candidates (unchanged videos keep their relative order) ---
+        with stage('rank'):
+            candidate_ids = np.array(list(candidates.keys()), dtype=object)
+            candidate_scores = np.array(list(candidates.values()), dtype=float)
+            if len(candidate_ids) > CANDIDATES_K:
+                keep = np.argpartition(-candidate_scores, CANDIDATES_K - 1)[:CANDIDATES_K]
+                candidate_ids, candidate_scores = candidate_ids[keep], candidate_scores[keep]
+            order = np.argsort(-candidate_scores, kind='stable')
+            candidate_ids, candidate_scores = candidate_ids[order], candidate_scores[order]
+
+            decay_now = math.exp(-DECAY_RATE * (now - epoch))
+            entries = [
+                {'videoId': video_id, 'score': round(score * decay_now, 4)}
+                for video_id, score in zip(candidate_ids[:TOP_K].tolist(), candidate_scores[:TOP_K].tolist())
+            ]
+            leaderboard_data = {
+                'entriesJson': json.dumps(entries, separators=(',', ':')),
+                'candidatesJson': json.dumps(dict(zip(candidate_ids.tolist(), candidate_scores.tolist())), separators=(',', ':')),
+                'epoch': epoch,
+                'updatedAt': now
+            }
+        with stage('leaderboard_write'):
+            write_leaderboard(databases, leaderboard_exists, leaderboard_data)
+
+        # --- Delete Consumed Delta Documents, Then Clear the Batch ---
+        # A batch with failed score writes stays pending, so the next run retries exactly those videos
+        deltas_deleted = 0
+        batch_pending = bool(batch_id)
+        if batch_id and not score_write_failures:
+            with stage('delete_deltas'):
+                delete_failures = 0
+                for delta_doc in delta_docs:
+                    try:
+                        databases.delete_document(DATABASE_ID, TRENDING_DELTAS_COLLECTION_ID, delta_doc['$id'])
+                        deltas_deleted += 1
+                    except AppwriteException as e:
+                        if e.code != 404:
+                            context.error(f"Failed to delete trending delta document {delta_doc['$id']}: {e}")
+                            delete_failures += 1
+                if not delete_failures:
+                    write_leaderboard(databases, True, {'pendingBatchId': None, 'pendingDeltaIdsJson': None})
+                    batch_pending = False
+
+        # --- Delete Scores That Have Decayed Away ---
+        with stage('prune_scores'):
+            scores_pruned = prune_expired_scores(databases, now, started_at + FUNCTION_TIMEOUT_SECONDS * PRUNE_TIME_SHARE, context)
+
+        context.log(f"Trending updated. Changed videos: {len(video_ids)}, Leaderboard size: {len(entries)}, Deltas consumed: {deltas_deleted}, Scores pruned: {scores_pruned}")
+        return context.res.json({
+            "success": True,
+            "changedVideos": int(len(video_ids)),
+            "leaderboardSize": len(entries),
+            "deltaDocsConsumed": deltas_deleted,
+            "batchPending": batch_pending,
+            "scoreWriteFailures": score_write_failures,
+            "scoresPruned": scores_pruned
+        })
+
+    except Exception as e:
+        context.error(f"An unexpected error occurred while ranking: {e}")
+        context.error(traceback.format_exc())
+        return context.res.json({"success": False, "message": f"Unexpected Error: {str(e)}"}, 500)
+    finally:
+        context.log("--- Trending Ranker End ---")
@@ -1,17 +1,136 @@
-from appwrite.client import Client
 from appwrite.services.databases import Databases
-from appwrite.services.storage import Storage
 from appwrite.exception import AppwriteException
 from appwrite.permission import Permission
 from appwrite.role import Role
+from appwrite.query import Query
+from concurrent.futures import ThreadPoolExecutor
 import os
 import json
+import threading
+import time
+
+from .appwrite_client import create_client
+from .metrics import instrumented, stage
+from .profiling import profiled
 
 # Configuration Constants (Match your project - appwriteConfig.js)
 DATABASE_ID = "database"
 VIDEOS_COLLECTION_ID = "videos"
-STORAGE_VIDEOS_BUCKET_ID = "videos"
+VIDEO_TOMBSTONES_COLLECTION_ID = "video_tombstones" # Consumed by the video-purger function
+ACCOUNTS_COLLECTION_ID = "accounts"
+MAX_BATCH_SIZE = 200 # Videos per batch request
+OWNERSHIP_QUERY_CHUNK_SIZE = 100 # Ids per `$id IN (...)` query
+DELETE_CONCURRENCY = int(os.environ.get("DELETE_CONCURRENCY", "8"))
+DELETE_RATE_PER_SECOND = float(os.environ.get("DELETE_RATE_PER_SECOND", "20")) # Videos deleted per second, across threads
+
+class RateLimiter:
+    """Spaces calls to at most `rate` per second across threads."""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
 
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def tombstone_and_delete(databases, video_doc, user_id, context):
+    """Writes the video's tombstone for video-purger, then deletes its videos document."""
+    video_id = video_doc['$id']
+    try:
+        databases.create_document(
+            DATABASE_ID,
+            VIDEO_TOMBSTONES_COLLECTION_ID,
+            video_id, # One tombstone per video, so repeated requests are harmless
+            {
+                'videoId': video_id,
+                'creatorId': user_id,
+                'videoFileId': video_doc.get('video_id'),
+                'thumbnailFileId': video_doc.get('thumbnail_id')
+            }
+        )
+        context.log(f"Tombstone written for video {video_id}.")
+    except AppwriteException as e:
+        if e.code != 409:
+            raise
+        context.log(f"Tombstone for video {video_id} already exists.")
+
+    # Hides the video right away; the purger also deletes it if this call fails
+    try:
+        databases.delete_document(DATABASE_ID, VIDEOS_COLLECTION_ID, video_id)
+    except AppwriteException as e:
+        if e.code != 404:
+            raise
+
+def fetch_video_chunk(databases, video_ids):
+    """Fetches up to 100 video documents with one `$id IN (...)` query. Missing ids are absent from the result."""
+    video_docs = databases.list_documents(
+        DATABASE_ID, VIDEOS_COLLECTION_ID, [Query.equal('$id', video_ids), Query.limit(len(video_ids))]
+    ).get('documents', [])
+    return {video_doc['$id']: video_doc for video_doc in video_docs}
+
+def fetch_videos_by_id(databases, video_ids):
+    videos_by_id = {}
+    for start in range(0, len(video_ids), OWNERSHIP_QUERY_CHUNK_SIZE):
+        videos_by_id.update(fetch_video_chunk(databases, video_ids[start:start + OWNERSHIP_QUERY_CHUNK_SIZE]))
+    return videos_by_id
+
+def fetch_remaining_uploads(databases, uploaded_ids, limit):
+    """
+    Finds uploads that still have a videos document; deleted ones stay in videosUploaded until purged.
+    Returns: A tuple (video_ids, videos_by_id, has_more) with at most `limit` videos.
+    """
+    videos_by_id = {}
+    for start in range(0, len(uploaded_ids), OWNERSHIP_QUERY_CHUNK_SIZE):
+        chunk = uploaded_ids[start:start + OWNERSHIP_QUERY_CHUNK_SIZE]
+        videos_by_id.update(fetch_video_chunk(databases, chunk))
+        if len(videos_by_id) >= limit:
+            video_ids = [video_id for video_id in uploaded_ids[:start + len(chunk)] if video_id in videos_by_id]
+            return video_ids[:limit], videos_by_id, len(video_ids) > limit or start + len(chunk) < len(uploaded_ids)
+    return [video_id for video_id in uploaded_ids if video_id in videos_by_id], videos_by_id, False
+
+def delete_videos_batch(databases, video_ids, user_id, context, videos_by_id=None):
+    """
+    Deletes many of a user's videos: one bulk ownership check, then rate-limited concurrent deletes.
+    Returns: A list of per-video results {videoId, status, message?} in request order.
+    """
+    if videos_by_id is None:
+        videos_by_id = fetch_videos_by_id(databases, video_ids)
+    required_permission = f'update("user:{user_id}")'
+    results = {}
+    owned_docs = []
+    for video_id in video_ids:
+        video_doc = videos_by_id.get(video_id)
+        if video_doc is None:
+            results[video_id] = {"videoId": video_id, "status": "not_found"}
+        elif required_permission not in video_doc.get('$permissions', []):
+            results[video_id] = {"videoId": video_id, "status": "forbidden"}
+        else:
+            owned_docs.append(video_doc)
+    context.log(f"Ownership check: {len(owned_docs)} of {len(video_ids)} videos owned by {user_id}.")
+
+    rate_limiter = RateLimiter(DELETE_RATE_PER_SECOND)
+
+    def delete_one(video_doc):
+        rate_limiter.wait()
+        try:
+            tombstone_and_delete(databases, video_doc, user_id, context)
+            return {"videoId": video_doc['$id'], "status": "deleted"}
+        except AppwriteException as e:
+            context.error(f"Failed to delete video {video_doc['$id']}: {e.message}")
+            return {"videoId": video_doc['$id'], "status": "failed", "message": e.message}
+
+    with ThreadPoolExecutor(max_workers=DELETE_CONCURRENCY) as executor:
+        for result in executor.map(delete_one, owned_docs):
+            results[result['videoId']] = result
+    return [results[video_id] for video_id in video_ids]
+
+@instrumented("video-deletion-manager")
+@profiled
 def main(context):
     context.log("--- Video Deletion Manager Invocation Start ---")
 
@@ -34,13 +153,28 @@ def main(context):
     context.log(f"Authenticated User ID: {user_id}")
 
     # --- Input Parsing ---
+    # {"videoId": "..."} deletes one video, {"videoIds": [...]} a batch, {"allMyVideos": true} every video of the caller
     video_id_to_delete = None
+    batch_video_ids = None
+    delete_all_videos = False
     try:
         payload = json.loads(context.req.body_raw)
         video_id_to_delete = payload.get('videoId')
-        if not video_id_to_delete:
-            raise ValueError("'videoId' is required in the request body.")
-        context.log(f"Requested deletion for Video ID: {video_id_to_delete}")
+        batch_video_ids = payload.get('videoIds')
+        delete_all_videos = payload.get('allMyVideos') is True
+        if batch_video_ids is not None:
+            if not isinstance(batch_video_ids, list) or not all(isinstance(video_id, str) and video_id for video_id in batch_video_ids):
+                raise ValueError("'videoIds' must be a list of video IDs.")
+            batch_video_ids = list(dict.fromkeys(batch_video_ids)) # Drop duplicates, keep order
+            if len(batch_video_ids) > MAX_BATCH_SIZE:
+                raise ValueError(f"At most {MAX_BATCH_SIZE} videos can be deleted per request.")
+            context.log(f"Requested batch deletion of {len(batch_video_ids)} videos.")
+        elif delete_all_videos:
+            context.log(f"Requested deletion of all videos of {user_id}.")
+        elif not video_id_to_delete:
+            raise ValueError("'videoId', 'videoIds' or 'allMyVideos' is required in the request body.")
+        else:
+            context.log(f"Requested deletion for Video ID: {video_id_to_delete}")
 
     except Exception as e:
         message = f"Invalid request payload: {e}. Raw: '{context.req.body_raw}'"
@@ -49,15 +183,55 @@ def main(context):
 
     # --- Initialize Appwrite Client ---
     # Use API key for elevated privileges to delete files/docs
-    client = Client()
-    client.set_endpoint(api_endpoint).set_project(project_id).set_key(api_key)
+    client = create_client(api_endpoint, project_id, api_key)
     databases = Databases(client)
-    storage = Storage(client)
+
+    # --- Batch and Channel-Level Deletion ---
+    if batch_video_ids is not None or delete_all_videos:
+        try:
+            videos_by_id = None
+            has_more = False
+            if delete_all_videos:
+                try:
+                    account_doc = databases.get_document(DATABASE_ID, ACCOUNTS_COLLECTION_ID, user_id)
+                    uploaded_ids = list(dict.fromkeys(account_doc.get('videosUploaded', []) or []))
+                except AppwriteException as e:
+                    if e.code != 404:
+                        raise
+                    uploaded_ids = []
+                with stage('fetch_uploads'):
+                    batch_video_ids, videos_by_id, has_more = fetch_remaining_uploads(databases, uploaded_ids, MAX_BATCH_SIZE)
+                context.log(f"Found {len(batch_video_ids)} videos to delete for {user_id} (more remaining: {has_more}).")
+
+            with stage('delete_batch'):
+                results = delete_videos_batch(databases, batch_video_ids, user_id, context, videos_by_id)
+            deleted_count = sum(1 for result in results if result['status'] == 'deleted')
+            response_payload = {
+                "success": True,
+                "deleted": deleted_count,
+                "failed": len(results) - deleted_count,
+                "results": results
+            }
+            if delete_all_videos:
+                response_payload["hasMore"] = has_more # Call again to delete the next batch
+            context.log(f"Batch deletion finished. Deleted: {deleted_count}, Not deleted: {len(results) - deleted_count}")
+            context.log("--- Video Deletion Manager Invocation End (Success) ---")
+            return context.res.json(response_payload)
+        except AppwriteException as e:
+            message = f"Appwrite error during batch deletion: {e.message}"
+            context.error(message)
+            return context.res.json({"success": False, "message": message}, e.code if e.code >= 400 else 500)
+        except Exception as e:
+            message = f"Unexpected server error: {e}"
+            context.error(message)
+            context.log("--- Video Deletion Manager Invocation End (Error) ---")
+            return context.res.json({"success": False, "message": message}, 500)
 
     try:
         # --- Fetch Video Document ---
         context.log(f"Fetching video document: {video_id_to_delete}")
-        video_doc = databases.get_document(DATABASE_ID, VIDEOS_COLLECTION_ID, video_id_to_delete)
+        with stage('fetch_video'):
+            video_doc = databases.get_document(DATABASE_ID, VIDEOS_COLLECTION_ID, video_id_to_delete)
         context.log(f"Video document fetched successfully.")
 
         # --- Authorization Check ---
@@ -71,47 +245,14 @@ def main(context):
             return context.res.json({"success": False, "message": "Forbidden: You do not own this video."}, 403)
         context.log(f"User {user_id} authorized to delete video {video_id_to_delete}.")
 
-        # --- Get File IDs from the fetched document ---
-        video_file_id = video_doc.get('video_id')
-        thumbnail_file_id = video_doc.get('thumbnail_id')
-        context.log(f"Video File ID: {video_file_id}, Thumbnail File ID: {thumbnail_file_id}")
-
-        # --- Delete Storage Files (Attempt both, log errors but continue) ---
-        # Delete Video File
-        if video_file_id:
-            try:
-                context.log(f"Attempting to delete video file: {video_file_id}")
-                storage.delete_file(STORAGE_VIDEOS_BUCKET_ID, video_file_id)
-                context.log(f"Successfully deleted video file: {video_file_id}")
-            except AppwriteException as e:
-                if e.code != 404: # Log error if it's not "Not Found"
-                     context.log(f"Warning: Failed to delete video file {video_file_id}. Code: {e.code}, Message: {e.message}. Continuing...")
-                else:
-                     context.log(f"Video file {video_file_id} not found (already deleted?). Continuing...")
-        else:
-            context.log("No video file ID found in document.")
-
-        # Delete Thumbnail File
-        if thumbnail_file_id:
-            try:
-                context.log(f"Attempting to delete thumbnail file: {thumbnail_file_id}")
-                storage.delete_file(STORAGE_VIDEOS_BUCKET_ID, thumbnail_file_id)
-                context.log(f"Successfully deleted thumbnail file: {thumbnail_file_id}")
-            except AppwriteException as e:
-                if e.code != 404: # Log error if it's not "Not Found"
-                    context.log(f"Warning: Failed to delete thumbnail file {thumbnail_file_id}. Code: {e.code}, Message: {e.message}. Continuing...")
-                else:
-                    context.log(f"Thumbnail file {thumbnail_file_id} not found (already deleted?). Continuing...")
-        else:
-            context.log("No thumbnail file ID found in document.")
-
-        # --- Delete Database Document ---
-        context.log(f"Attempting to delete video document: {video_id_to_delete}")
-        databases.delete_document(DATABASE_ID, VIDEOS_COLLECTION_ID, video_id_to_delete)
+        # --- Tombstone and Delete ---
+        # Storage files and dependent records are removed in the background by video-purger
+        with stage('tombstone'):
+            tombstone_and_delete(databases, video_doc, user_id, context)
         context.log(f"Successfully deleted video document: {video_id_to_delete}")
 
         # --- Success Response ---
-        response_payload = {"success": True, "message": "Video deleted successfully."}
+        response_payload = {"success": True, "message": "Video deleted successfully. Related data is purged in the background."}
         context.log(f"Operation successful. Returning: {response_payload}")
         context.log("--- Video Deletion Manager Invocation End (Success) ---")
         return context.res.json(response_payload)
@@ -1,4 +1,3 @@
-from appwrite.client import Client
 from appwrite.services.databases import Databases
 from appwrite.services.storage import Storage
 from appwrite.exception import AppwriteException
@@ -12,12 +11,17 @@ import subprocess # For running FFmpeg
 import traceback # For detailed error logging
 import json # For handling JSON data
 
+from .appwrite_client import create_client
+from .metrics import instrumented, stage
+from .profiling import profiled
+
 # --- Configuration ---
 DATABASE_ID = "database"
 ACCOUNTS_COLLECTION_ID = "accounts" 
 CHANNEL_STATS_COLLECTION_ID = "channel_stats"
 VIDEO_PROCESSING_COLLECTION_ID = "video-processing"
 VIDEOS_COLLECTION_ID = "videos"
+FEED_FANOUT_JOBS_COLLECTION_ID = "feed_fanout_jobs" # Consumed by the feed-fanout function
 VIDEOS_UNCOMPRESSED_BUCKET_ID = "videos-uncompressed"
 VIDEOS_BUCKET_ID = "videos" # Bucket for compressed videos and thumbnails
 MAX_PROCESSING_LIMIT = 5 # Number of videos to process per run
@@ -114,39 +118,11 @@ def run_ffmpeg(input_path, output_path, context):
         return False
 
 
+@instrumented("video-manager")
+@profiled
 def main(context):
     context.log("--- Video Manager Processing Start ---")
 
-    # --- Dynamically install ffmpeg using apk add at runtime ---
-    try:
-        # Update package list first (good practice)
-        apk_update_command = ['apk', 'update']
-        context.log(f"Executing apk command: {' '.join(apk_update_command)}")
-        update_result = subprocess.run(apk_update_command, check=True, capture_output=True, text=True)
-        context.log("APK package list updated.")
-
-        # Install ffmpeg
-        apk_command = ['apk', 'add', 'ffmpeg']
-        context.log(f"Executing apk command: {' '.join(apk_command)}")
-        install_result = subprocess.run(apk_command, check=True, capture_output=True, text=True)
-        context.log("ffmpeg installed successfully via apk add.")
-        context.log(f"apk stdout: {install_result.stdout}")
-        if install_result.stderr: # Log stderr only if it's not empty
-            context.log(f"apk stderr: {install_result.stderr}")
-
-    except FileNotFoundError as e:
-        context.error(f"FFmpeg installation failed: {e}")
-        return context.res.json({"success": False, "message": str(e)}, 500)
-    except subprocess.CalledProcessError as e:
-        context.error(f"apk command failed with exit code {e.returncode}.")
-        context.error(f"apk stdout: {e.stdout}")
-        context.error(f"apk stderr: {e.stderr}")
-        return context.res.json({"success": False, "message": f"Failed to install ffmpeg via apk: {e.stderr}"}, 500)
-    except Exception as e:
-        context.error(f"An unexpected error occurred during ffmpeg installation: {e}")
-        context.error(traceback.format_exc())
-        return context.res.json({"success": False, "message": f"Unexpected error installing ffmpeg: {str(e)}"}, 500)
-
     # --- Environment & Auth Check ---
     api_endpoint = os.environ.get("APPWRITE_FUNCTION_API_ENDPOINT")
     project_id = os.environ.get("APPWRITE_FUNCTION_PROJECT_ID")
@@ -158,8 +134,7 @@ def main(context):
         return context.res.json({"success": False, "message": message}, 500)
 
     # --- Initialize Appwrite Client ---
-    client = Client()
-    client.set_endpoint(api_endpoint).set_project(project_id).set_key(api_key)
+    client = create_client(api_endpoint, project_id, api_key)
     databases = Databases(client)
     storage = Storage(client)
 
@@ -167,6 +142,16 @@ def main(context):
     os.makedirs(TMP_INPUT_DIR, exist_ok=True)
     os.makedirs(TMP_OUTPUT_DIR, exist_ok=True)
 
+    # --- Batch Size ---
+    # queue-dispatcher sends {"maxItems": n}, the number of pending videos it counted
+    batch_limit = MAX_PROCESSING_LIMIT
+    try:
+        requested_items = json.loads(context.req.body_raw or '{}').get('maxItems')
+        if isinstance(requested_items, int) and requested_items > 0:
+            batch_limit = min(requested_items, MAX_PROCESSING_LIMIT)
+    except (ValueError, AttributeError):
+        pass
+
     processed_count = 0
     failed_count = 0
     skipped_count = 0
@@ -174,14 +159,15 @@ def main(context):
     try:
         # --- Fetch Pending Processing Documents ---
         context.log("Fetching pending video processing documents...")
-        pending_response = databases.list_documents(
-            DATABASE_ID,
-            VIDEO_PROCESSING_COLLECTION_ID,
-            [
-                Query.equal('status', 'pending'),
-                Query.limit(MAX_PROCESSING_LIMIT) # Process in batches
-            ]
-        )
+        with stage('fetch_pending'):
+            pending_response = databases.list_documents(
+                DATABASE_ID,
+                VIDEO_PROCESSING_COLLECTION_ID,
+                [
+                    Query.equal('status', 'pending'),
+                    Query.limit(batch_limit) # Process in batches
+                ]
+            )
         pending_docs = pending_response.get('documents', [])
         total_fetched = len(pending_docs)
         context.log(f"Found {total_fetched} pending documents.")
@@ -191,6 +177,36 @@ def main(context):
             context.log("--- Video Manager Processing End (No Work) ---")
             return context.res.json({"success": True, "message": "No pending videos."})
 
+        # --- Dynamically install ffmpeg using apk add at runtime (only when there is work) ---
+        try:
+            # Update package list first (good practice)
+            apk_update_command = ['apk', 'update']
+            context.log(f"Executing apk command: {' '.join(apk_update_command)}")
+            update_result = subprocess.run(apk_update_command, check=True, capture_output=True, text=True)
+            context.log("APK package list updated.")
+
+            # Install ffmpeg
+            apk_command = ['apk', 'add', 'ffmpeg']
+            context.log(f"Executing apk command: {' '.join(apk_command)}")
+            install_result = subprocess.run(apk_command, check=True, capture_output=True, text=True)
+            context.log("ffmpeg installed successfully via apk add.")
+            context.log(f"apk stdout: {install_result.stdout}")
+            if install_result.stderr: # Log stderr only if it's not empty
+                context.log(f"apk stderr: {install_result.stderr}")
+
+        except FileNotFoundError as e:
+            context.error(f"FFmpeg installation failed: {e}")
+            return context.res.json({"success": False, "message": str(e)}, 500)
+        except subprocess.CalledProcessError as e:
+            context.error(f"apk command failed with exit code {e.returncode}.")
+            context.error(f"apk stdout: {e.stdout}")
+            context.error(f"apk stderr: {e.stderr}")
+            return context.res.json({"success": False, "message": f"Failed to install ffmpeg via apk: {e.stderr}"}, 500)
+        except Exception as e:
+            context.error(f"An unexpected error occurred during ffmpeg installation: {e}")
+            context.error(traceback.format_exc())
+            return context.res.json({"success": False, "message": f"Unexpected error installing ffmpeg: {str(e)}"}, 500)
+
         # --- Process Each Pending Document ---
         for processing_doc in pending_docs:
             processing_doc_id = processing_doc['$id']
@@ -258,7 +274,8 @@ def main(context):
                 context.log(f"Downloading file {uncompressed_file_id} from bucket {VIDEOS_UNCOMPRESSED_BUCKET_ID}...")
                 # Construct input path making sure it's unique enough or cleaned up
                 input_file_path = os.path.join(TMP_INPUT_DIR, uncompressed_file_id) # Use file ID as name
-                file_data = storage.get_file_download(VIDEOS_UNCOMPRESSED_BUCKET_ID, uncompressed_file_id)
+                with stage('download'):
+                    file_data = storage.get_file_download(VIDEOS_UNCOMPRESSED_BUCKET_ID, uncompressed_file_id)
                 with open(input_file_path, 'wb') as f:
                     f.write(file_data)
                 context.log(f"File downloaded successfully to {input_file_path}")
@@ -266,7 +283,8 @@ def main(context):
                 # --- 3b. Calculate Video Duration ---
                 calculated_duration = None
                 try:
-                    calculated_duration = get_video_duration_ffmpeg(input_file_path, context)
+                    with stage('probe'):
+                        calculated_duration = get_video_duration_ffmpeg(input_file_path, context)
                     if calculated_duration is None or calculated_duration <= 0:
                          raise ValueError("Invalid duration calculated.")
                 except Exception as e:
@@ -305,7 +323,8 @@ def main(context):
             try:
                 output_file_name = f"{uncompressed_file_id}.{FFMPEG_OUTPUT_FORMAT}" # Use original ID + new extension
                 output_file_path = os.path.join(TMP_OUTPUT_DIR, output_file_name)
-                compression_success = run_ffmpeg(input_file_path, output_file_path, context)
+                with stage('ffmpeg'):
+                    compression_success = run_ffmpeg(input_file_path, output_file_path, context)
                 if not compression_success:
                     raise Exception("FFmpeg compression command failed.")
             except Exception as e:
@@ -330,22 +349,23 @@ def main(context):
             try:
                 context.log(f"Downloading original thumbnail {thumbnail_id} from {VIDEOS_UNCOMPRESSED_BUCKET_ID}...")
                 thumbnail_input_path = os.path.join(TMP_INPUT_DIR, f"thumb_{thumbnail_id}") # Temp path for thumbnail
-                thumb_data = storage.get_file_download(VIDEOS_UNCOMPRESSED_BUCKET_ID, thumbnail_id)
-                with open(thumbnail_input_path, 'wb') as f:
-                    f.write(thumb_data)
-                context.log(f"Thumbnail downloaded to {thumbnail_input_path}")
-
-                context.log(f"Uploading thumbnail {thumbnail_input_path} to final bucket {VIDEOS_BUCKET_ID}...")
-                thumb_input_file = InputFile.from_path(thumbnail_input_path)
-                thumb_upload_response = storage.create_file(
-                    VIDEOS_BUCKET_ID,
-                    'unique()', # New ID for thumbnail in final bucket
-                    thumb_input_file,
-                    [ # Permissions for the final thumbnail
-                        Permission.read(Role.any()),      # Publicly readable thumbnail
-                        Permission.delete(Role.user(creator_id)) # Owner can delete
-                    ]
-                )
+                with stage('thumbnail_transfer'):
+                    thumb_data = storage.get_file_download(VIDEOS_UNCOMPRESSED_BUCKET_ID, thumbnail_id)
+                    with open(thumbnail_input_path, 'wb') as f:
+                        f.write(thumb_data)
+                    context.log(f"Thumbnail downloaded to {thumbnail_input_path}")
+
+                    context.log(f"Uploading thumbnail {thumbnail_input_path} to final bucket {VIDEOS_BUCKET_ID}...")
+                    thumb_input_file = InputFile.from_path(thumbnail_input_path)
+                    thumb_upload_response = storage.create_file(
+                        VIDEOS_BUCKET_ID,
+                        'unique()', # New ID for thumbnail in final bucket
+                        thumb_input_file,
+                        [ # Permissions for the final thumbnail
+                            Permission.read(Role.any()),      # Publicly readable thumbnail
+                            Permission.delete(Role.user(creator_id)) # Owner can delete
+                        ]
+                    )
                 final_thumbnail_id = thumb_upload_response['$id']
                 context.log(f"Thumbnail transferred successfully. Final Thumbnail ID: {final_thumbnail_id}")
 
@@ -370,17 +390,18 @@ def main(context):
             compressed_file_id = None
             try:
                 context.log(f"Uploading compressed video {output_file_path} to bucket {VIDEOS_BUCKET_ID}...")
-                with open(output_file_path, 'rb') as video_file_handle:
-                    compressed_file_for_upload = InputFile.from_bytes(video_file_handle.read(), filename=os.path.basename(output_file_path))
-                    upload_response = storage.create_file(
-                        VIDEOS_BUCKET_ID,
-                        'unique()', # Let Appwrite generate ID for compressed file
-                        compressed_file_for_upload,
-                    [ # Permissions for compressed video
-                        Permission.read(Role.any()), # Publicly readable
-                        Permission.delete(Role.user(creator_id)) # Owner can delete
-                    ]
-                )
+                with stage('upload'):
+                    with open(output_file_path, 'rb') as video_file_handle:
+                        compressed_file_for_upload = InputFile.from_bytes(video_file_handle.read(), filename=os.path.basename(output_file_path))
+                        upload_response = storage.create_file(
+                            VIDEOS_BUCKET_ID,
+                            'unique()', # Let Appwrite generate ID for compressed file
+                            compressed_file_for_upload,
+                        [ # Permissions for compressed video
+                            Permission.read(Role.any()), # Publicly readable
+                            Permission.delete(Role.user(creator_id)) # Owner can delete
+                        ]
+                    )
                 compressed_file_id = upload_response['$id']
                 context.log(f"Compressed file uploaded successfully. New File ID: {compressed_file_id}")
             except Exception as e:
@@ -457,22 +478,36 @@ def main(context):
                             context.error(f"Warning: Unexpected error updating account {creator_id}: {acc_general_err}")
                     else:
                         context.log(f"Video ID {new_video_id} already present in account {creator_id}'s videosUploaded array. Skipping update.")
+
+                # --- Queue Fan-out to Subscriber Feeds ---
+                try:
+                    databases.create_document(
+                        DATABASE_ID,
+                        FEED_FANOUT_JOBS_COLLECTION_ID,
+                        video_doc['$id'], # One job per video, so a rerun cannot queue it twice
+                        {'videoId': video_doc['$id'], 'creatorId': creator_id, 'nextShard': 0}
+                    )
+                    context.log(f"Queued feed fan-out for video {video_doc['$id']}.")
+                except AppwriteException as fanout_err:
+                    # Subscribers still see the video through the creator's videosUploaded array
+                    context.error(f"Warning: Failed to queue feed fan-out for video {video_doc['$id']}: {fanout_err}")
             except Exception as e:
                 error_message = f"Failed to create final video document for {uncompressed_file_id}: {e}"
                 context.error(error_message)
-                # Attempt to roll back: delete compressed file if DB entry fails
+                # Attempt to roll back: delete the files uploaded for this video, in reverse upload order
+                # Anything left behind is reclaimed by the storage-gc function after its grace period
                 if compressed_file_id:
-                    try:
-                        context.log(f"Rolling back: Deleting transferred thumbnail {final_thumbnail_id}...")
-                        storage.delete_file(VIDEOS_BUCKET_ID, final_thumbnail_id)
-                    except Exception as delete_err:
-                         context.error(f"Failed to rollback transferred thumbnail {final_thumbnail_id}: {delete_err}")
-                if final_thumbnail_id:
                     try:
                         context.log(f"Rolling back: Deleting compressed file {compressed_file_id}...")
                         storage.delete_file(VIDEOS_BUCKET_ID, compressed_file_id)
                     except Exception as delete_err:
                         context.error(f"Failed to rollback compressed file {compressed_file_id}: {delete_err}")
+                if final_thumbnail_id:
+                    try:
+                        context.log(f"Rolling back: Deleting transferred thumbnail {final_thumbnail_id}...")
+                        storage.delete_file(VIDEOS_BUCKET_ID, final_thumbnail_id)
+                    except Exception as delete_err:
+                         context.error(f"Failed to rollback transferred thumbnail {final_thumbnail_id}: {delete_err}")
                 try:
                     databases.update_document(
                         DATABASE_ID, VIDEO_PROCESSING_COLLECTION_ID, processing_doc_id,
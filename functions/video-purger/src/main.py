@@ -0,0 +1,206 @@
+from appwrite.services.databases import Databases
+from appwrite.services.storage import Storage
+from appwrite.exception import AppwriteException
+from appwrite.query import Query
+import os
+import time
+import traceback
+
+from .appwrite_client import create_client
+from .metrics import instrumented, stage
+from .document_deletes import delete_documents_concurrently, delete_if_exists
+from .profiling import profiled
+
+# Configuration Constants
+DATABASE_ID = "database"
+VIDEO_TOMBSTONES_COLLECTION_ID = "video_tombstones"
+VIDEOS_COLLECTION_ID = "videos"
+ACCOUNTS_COLLECTION_ID = "accounts"
+STORAGE_VIDEOS_BUCKET_ID = "videos"
+MAX_TOMBSTONES_PER_RUN = 20
+PURGE_PAGE_SIZE = 100 # Dependent documents listed (and deleted concurrently) per batch
+TIME_BUDGET_SECONDS = float(os.environ.get("TIME_BUDGET_SECONDS", "240")) # Stop purging after this long
+
+# Purge steps in order. A tombstone records the next step, so an interrupted purge resumes there.
+STEP_VIDEO = 'video' # The videos document and its two storage files
+STEP_ACCOUNT = 'account' # The entry in the creator's accounts.videosUploaded
+# Collections whose documents reference the video through an attribute
+QUERY_STEPS = {
+    'user_video_states': ('user_video_states', 'videoId'),
+    'likes': ('likes', 'videoId'),
+    'pending_views': ('pending_views', 'videoId'),
+    'video_interactions': ('video_interactions', 'videoId'),
+    'comments_interactions': ('comments-interactions', 'videoId'),
+    'video_count_shards': ('video_count_shards', 'videoId'),
+    'video_view_sketches': ('video_view_sketches', 'videoId'),
+}
+STEP_DOCUMENTS = 'documents' # Documents whose ID is the video ID
+VIDEO_ID_DOCUMENT_COLLECTIONS = ['video_counts', 'video_view_rollups', 'trending_scores', 'feed_fanout_jobs']
+PURGE_STEPS = [STEP_VIDEO, STEP_ACCOUNT, *QUERY_STEPS, STEP_DOCUMENTS]
+
+def delete_file_if_exists(storage, file_id):
+    if not file_id:
+        return
+    try:
+        storage.delete_file(STORAGE_VIDEOS_BUCKET_ID, file_id)
+    except AppwriteException as e:
+        if e.code != 404:
+            raise
+
+def purge_video_document(databases, storage, tombstone):
+    """Deletes the videos document first, then the files it referenced."""
+    delete_if_exists(databases, VIDEOS_COLLECTION_ID, tombstone['videoId'])
+    delete_file_if_exists(storage, tombstone.get('videoFileId'))
+    delete_file_if_exists(storage, tombstone.get('thumbnailFileId'))
+    return 1
+
+def purge_account_entry(databases, tombstone):
+    creator_id = tombstone.get('creatorId')
+    video_id = tombstone['videoId']
+    try:
+        account_doc = databases.get_document(DATABASE_ID, ACCOUNTS_COLLECTION_ID, creator_id)
+    except AppwriteException as e:
+        if e.code == 404:
+            return 0
+        raise
+    uploads = account_doc.get('videosUploaded', []) or []
+    if video_id not in uploads:
+        return 0
+    databases.update_document(
+        DATABASE_ID, ACCOUNTS_COLLECTION_ID, creator_id,
+        {'videosUploaded': [uploaded_id for uploaded_id in uploads if uploaded_id != video_id]}
+    )
+    return 1
+
+def purge_by_query(databases, collection_id, attribute, video_id, deadline, context):
+    """
+    Deletes every document whose `attribute` equals the video ID, one cursor-paged batch at a time.
+    Returns: A tuple (deleted_count, finished). Not finished if the budget ran out or a delete failed.
+    """
+    deleted_count = 0
+    cursor = None # Deleted documents leave the result set, so the cursor only skips past failures
+    had_failures = False
+    while time.monotonic() < deadline:
+        queries = [Query.equal(attribute, video_id), Query.select(['$id']), Query.limit(PURGE_PAGE_SIZE)]
+        if cursor:
+            queries.append(Query.cursor_after(cursor))
+        doc_ids = [doc['$id'] for doc in databases.list_documents(DATABASE_ID, collection_id, queries).get('documents', [])]
+        if doc_ids:
+            deleted, failed_ids = delete_documents_concurrently(databases, collection_id, doc_ids, context)
+            deleted_count += deleted
+            if failed_ids:
+                had_failures = True
+                cursor = max(failed_ids, key=doc_ids.index) # Last failed id in page order
+        if len(doc_ids) < PURGE_PAGE_SIZE:
+            return deleted_count, not had_failures
+    return deleted_count, False
+
+def purge_video_id_documents(databases, video_id):
+    deleted_count = 0
+    for collection_id in VIDEO_ID_DOCUMENT_COLLECTIONS:
+        delete_if_exists(databases, collection_id, video_id)
+        deleted_count += 1
+    return deleted_count
+
+def run_purge_step(databases, storage, step, tombstone, deadline, context):
+    """
+    Runs one purge step for a tombstoned video.
+    Returns: A tuple (deleted_count, finished)
+    """
+    if step == STEP_VIDEO:
+        return purge_video_document(databases, storage, tombstone), True
+    if step == STEP_ACCOUNT:
+        return purge_account_entry(databases, tombstone), True
+    if step == STEP_DOCUMENTS:
+        return purge_video_id_documents(databases, tombstone['videoId']), True
+    collection_id, attribute = QUERY_STEPS[step]
+    return purge_by_query(databases, collection_id, attribute, tombstone['videoId'], deadline, context)
+
+@instrumented("video-purger")
+@profiled
+def main(context):
+    context.log("--- Video Purger Start ---")
+    deadline = time.monotonic() + TIME_BUDGET_SECONDS
+
+    # --- Environment & Auth Check ---
+    api_endpoint = os.environ.get("APPWRITE_FUNCTION_API_ENDPOINT")
+    project_id = os.environ.get("APPWRITE_FUNCTION_PROJECT_ID")
+    api_key = context.req.headers.get('x-appwrite-key')
+
+    if not all([api_endpoint, project_id, api_key]):
+        message = "Function configuration error: Missing endpoint, project ID, or API key."
+        context.error(message)
+        return context.res.json({"success": False, "message": message}, 500)
+
+    # --- Initialize Appwrite Client ---
+    client = create_client(api_endpoint, project_id, api_key)
+    databases = Databases(client)
+    storage = Storage(client)
+
+    progress = [] # One entry per tombstone touched this run
+    videos_purged = 0
+    failed_count = 0
+
+    try:
+        # --- Fetch the Oldest Tombstones ---
+        with stage('fetch_tombstones'):
+            tombstones = databases.list_documents(
+                DATABASE_ID,
+                VIDEO_TOMBSTONES_COLLECTION_ID,
+                [Query.order_asc('$createdAt'), Query.limit(MAX_TOMBSTONES_PER_RUN)]
+            ).get('documents', [])
+        context.log(f"Found {len(tombstones)} tombstoned videos to purge.")
+
+        for tombstone in tombstones:
+            if time.monotonic() >= deadline:
+                context.log("Time budget reached. Remaining tombstones are left for the next run.")
+                break
+
+            video_id = tombstone['videoId']
+            step = tombstone.get('step') or PURGE_STEPS[0]
+            purged_count = tombstone.get('purgedCount', 0) or 0
+            completed = False
+            try:
+                # --- Run the Remaining Steps in Order, Saving Progress After Each ---
+                for step in PURGE_STEPS[PURGE_STEPS.index(step):]:
+                    with stage('purge_steps'):
+                        deleted, finished = run_purge_step(databases, storage, step, tombstone, deadline, context)
+                    purged_count += deleted
+                    if not finished:
+                        break
+                    next_index = PURGE_STEPS.index(step) + 1
+                    if next_index == len(PURGE_STEPS):
+                        completed = True
+                        break
+                    databases.update_document(
+                        DATABASE_ID, VIDEO_TOMBSTONES_COLLECTION_ID, tombstone['$id'],
+                        {'step': PURGE_STEPS[next_index], 'purgedCount': purged_count}
+                    )
+                if completed:
+                    databases.delete_document(DATABASE_ID, VIDEO_TOMBSTONES_COLLECTION_ID, tombstone['$id'])
+                    videos_purged += 1
+                    context.log(f"Purged video {video_id} ({purged_count} records).")
+                else:
+                    databases.update_document(
+                        DATABASE_ID, VIDEO_TOMBSTONES_COLLECTION_ID, tombstone['$id'], {'purgedCount': purged_count}
+                    )
+                    context.log(f"Purge of video {video_id} paused at step '{step}' ({purged_count} records so far).")
+            except AppwriteException as e:
+                context.error(f"Failed to purge video {video_id} at step '{step}': {e}")
+                failed_count += 1
+            progress.append({"videoId": video_id, "step": None if completed else step, "purged": purged_count})
+
+        context.log(f"Purge finished. Videos purged: {videos_purged}, In progress: {len(progress) - videos_purged}, Failed: {failed_count}")
+        return context.res.json({
+            "success": True,
+            "videosPurged": videos_purged,
+            "failed": failed_count,
+            "progress": progress
+        })
+
+    except Exception as e:
+        context.error(f"An unexpected error occurred during purge: {e}")
+        context.error(traceback.format_exc())
+        return context.res.json({"success": False, "message": f"Unexpected Error: {str(e)}"}, 500)
+    finally:
+        context.log("--- Video Purger End ---")
@@ -0,0 +1,78 @@
+# Synced from functions/shared/async_databases.py by functions/shared/sync.py. Edit the original, not this copy.
+"""
+Running many Appwrite database operations concurrently while keeping per-key order.
+
+The SDK is blocking, so a batch manager that handles its items one after another spends most
+of its run waiting on round trips. `run_keyed` hands every item to an asyncio task and runs the
+blocking work on a bounded thread pool (DB_CONCURRENCY calls in flight). Items that share a key,
+such as a video_counts document or a subscriber, are serialized in the order they were given,
+because each one is a read-modify-write of the same document; items with different keys proceed
+in parallel.
+
+    results = run_keyed(items, key=lambda item: item['videoId'], fn=process_item)
+
+`fn` runs on a worker thread and may use the ordinary blocking `Databases` service. A failed item
+does not stop the others: its exception is returned in its place in the results.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import os
+
+# Configuration Constants
+DB_CONCURRENCY = int(os.environ.get("DB_CONCURRENCY", "8")) # Database calls in flight per batch
+
+
+class AsyncDatabases:
+    """Runs blocking database work on a bounded thread pool, serialized per key."""
+    def __init__(self, concurrency=DB_CONCURRENCY):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, concurrency))
+        self.locks = collections.defaultdict(asyncio.Lock)
+
+    async def call(self, fn, *args, **kwargs):
+        """Runs one blocking call on the pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    @contextlib.asynccontextmanager
+    async def ordered(self, key):
+        """
+        Holds the key's lock. asyncio.Lock wakes waiters first in, first out, so tasks that enter
+        before their first await run in the order they were created.
+        """
+        lock = self.locks[key]
+        async with lock:
+            yield
+
+    async def run(self, key, fn, *args, **kwargs):
+        async with self.ordered(key):
+            return await self.call(fn, *args, **kwargs)
+
+    async def map_keyed(self, items, key, fn):
+        """
+        Runs fn(item) for every item, serialized per key(item) and parallel across keys.
+        Returns: A list of results in input order; a failed item's exception takes its place.
+        """
+        tasks = [asyncio.ensure_future(self.run(key(item), fn, item)) for item in items]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def run_keyed(items, key, fn, concurrency=DB_CONCURRENCY):
+    """Blocking entry point for synchronous function code. See AsyncDatabases.map_keyed."""
+    items = list(items)
+    if not items:
+        return []
+
+    async def run_all():
+        async_databases = AsyncDatabases(concurrency)
+        try:
+            return await async_databases.map_keyed(items, key, fn)
+        finally:
+            async_databases.close()
+
+    return asyncio.run(run_all())
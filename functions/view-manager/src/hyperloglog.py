@@ -0,0 +1,63 @@
+"""
+A small HyperLogLog sketch for estimating the number of unique viewers of a video.
+
+With precision p the sketch keeps m = 2^p one-byte registers, so it takes m bytes in memory
+and about 4m/3 characters when stored base64-encoded. The standard error of the estimate is
+1.04 / sqrt(m): about 3.3% at the default p=10 (1 KiB per video per window).
+"""
+import base64
+import hashlib
+import math
+
+DEFAULT_PRECISION = 10
+
+
+class HyperLogLog:
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError(f"HyperLogLog precision must be between 4 and 16, got {precision}")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+        if len(self.registers) != self.m:
+            raise ValueError(f"Expected {self.m} registers, got {len(self.registers)}")
+
+    @staticmethod
+    def _hash(value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+
+    def add(self, value):
+        """Adds a value. Returns True if a register changed."""
+        hashed = self._hash(value)
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        # Position of the leftmost 1-bit in the remaining (64 - p) bits, counting from 1
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def cardinality(self):
+        if self.m == 16:
+            alpha = 0.673
+        elif self.m == 32:
+            alpha = 0.697
+        elif self.m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw_estimate = alpha * self.m * self.m / sum(2.0 ** -register for register in self.registers)
+        zero_registers = self.registers.count(0)
+        if raw_estimate <= 2.5 * self.m and zero_registers:
+            # Small-range correction (linear counting)
+            return self.m * math.log(self.m / zero_registers)
+        return raw_estimate
+
+    def to_string(self):
+        return base64.b64encode(bytes(self.registers)).decode('ascii')
+
+    @classmethod
+    def from_string(cls, encoded, precision=DEFAULT_PRECISION):
+        return cls(precision, base64.b64decode(encoded))
@@ -1,18 +1,45 @@
-from appwrite.client import Client
 from appwrite.services.databases import Databases
 from appwrite.query import Query
 from appwrite.permission import Permission
 from appwrite.role import Role
 from appwrite.exception import AppwriteException
 import os
+import time
 import traceback
 import collections
 
+from datetime import datetime
+
+from .appwrite_client import create_client
+from .async_databases import DB_CONCURRENCY, run_keyed
+from .counter_journal import apply_journal_entry, delete_journal_entry, find_journal_entries, journal_key, record_journal_entry
+from .document_deletes import DELETE_CONCURRENCY, delete_documents_concurrently
+from .profiling import profiled
+from .queue_worker import drain_queue
+from .hyperloglog import HyperLogLog
+from .metrics import instrumented, stage
+from .run_log import leveled_logging
+from .trending import SOURCE_VIEWS, record_trending_deltas
+from .video_counters import apply_counter_deltas
+from .view_rollups import add_views, rollup_from_document
+
 # Configuration Constants
 DATABASE_ID = "database"
 PENDING_VIEWS_COLLECTION_ID = "pending_views"
 VIDEO_COUNTS_COLLECTION_ID = "video_counts"
-MAX_DOCS_PER_RUN = 500 # Process up to 500 pending views per run
+VIEW_SKETCHES_COLLECTION_ID = "video_view_sketches"
+VIEW_ROLLUPS_COLLECTION_ID = "video_view_rollups"
+JOB_CHECKPOINTS_COLLECTION_ID = "job_checkpoints"
+DELETE_BACKLOG_ID = "view-manager-deletes" # Processed pending views whose delete failed
+PAGE_SIZE = 500 # Pending views fetched per page
+FUNCTION_TIMEOUT_SECONDS = float(os.environ.get("FUNCTION_TIMEOUT_SECONDS", "120")) # Keep in sync with appwrite.json
+# "window": count unique viewers per time window across runs (HyperLogLog); "batch": dedup within one run only
+VIEW_DEDUP_MODE = os.environ.get("VIEW_DEDUP_MODE", "window")
+VIEW_DEDUP_WINDOW_HOURS = int(os.environ.get("VIEW_DEDUP_WINDOW_HOURS", "24"))
+VIEW_SKETCH_PRECISION = int(os.environ.get("VIEW_SKETCH_PRECISION", "10"))
+JOURNAL_SOURCE = 'views' # Marks this function's entries in counter_journal
+SKETCH_CLEANUP_PAGE_SIZE = 100
+SKETCH_CLEANUP_TIME_SHARE = 0.85 # Share of the timeout after which expired-sketch cleanup stops
 
 # Helper to extract user ID from permissions
 def get_user_id_from_permissions(permissions):
@@ -25,8 +52,313 @@ def get_user_id_from_permissions(permissions):
                 return perm[start_index:end_index]
     return None
 
+def current_window_start(now):
+    window_seconds = VIEW_DEDUP_WINDOW_HOURS * 3600
+    return int(now // window_seconds * window_seconds)
+
+def add_viewers_to_sketch(databases, video_id, user_ids, window_start, context):
+    """
+    Adds a batch of viewers to the registers of the video's HyperLogLog sketch for the current window.
+    The sketch's countedViews is moved by the batch's journal entry (apply_view_entry), so a batch
+    that fails before its entry is recorded is counted again from the same registers.
+    Returns: A tuple (new_unique_views, sketch_doc_id, counted_views)
+             new_unique_views: Viewers not seen before in this window (estimated).
+             counted_views: The sketch's countedViews once this batch is counted.
+    """
+    sketch_doc_id = f"{video_id}_{window_start}"
+    sketch_doc = None
+    try:
+        sketch_doc = databases.get_document(DATABASE_ID, VIEW_SKETCHES_COLLECTION_ID, sketch_doc_id)
+    except AppwriteException as e:
+        if e.code != 404:
+            raise
+
+    previously_counted = (sketch_doc or {}).get('countedViews', 0) or 0
+    if sketch_doc and sketch_doc.get('precision') == VIEW_SKETCH_PRECISION:
+        sketch = HyperLogLog.from_string(sketch_doc['registers'], VIEW_SKETCH_PRECISION)
+    else:
+        if sketch_doc:
+            context.debug("Sketch %s has precision %s, expected %s. Starting a fresh sketch.", sketch_doc_id, sketch_doc.get('precision'), VIEW_SKETCH_PRECISION)
+        sketch = HyperLogLog(VIEW_SKETCH_PRECISION)
+
+    for user_id in user_ids:
+        sketch.add(user_id)
+    # A batch can never add more views than it has distinct viewers, whatever the estimate says
+    new_unique_views = min(len(user_ids), max(0, round(sketch.cardinality()) - previously_counted))
+
+    # Adding viewers to the registers is idempotent, so this write is safe to repeat
+    sketch_data = {
+        'registers': sketch.to_string(),
+        'precision': VIEW_SKETCH_PRECISION
+    }
+    if sketch_doc:
+        databases.update_document(DATABASE_ID, VIEW_SKETCHES_COLLECTION_ID, sketch_doc_id, sketch_data)
+    else:
+        databases.create_document(
+            DATABASE_ID, VIEW_SKETCHES_COLLECTION_ID, sketch_doc_id,
+            {**sketch_data, 'videoId': video_id, 'windowStart': window_start, 'countedViews': 0}
+        )
+    return new_unique_views, sketch_doc_id, previously_counted + new_unique_views
+
+def delete_expired_sketches(databases, window_start, deadline, context):
+    """
+    Deletes sketches from windows before the current one, a page at a time, until none are left or
+    the deadline passes.
+    Returns: A tuple (deleted_count, finished). Not finished if the deadline passed or a delete failed.
+    """
+    deleted_count = 0
+    cursor = None # Deleted sketches leave the result set, so the cursor only skips past failures
+    had_failures = False
+    while time.monotonic() < deadline:
+        queries = [Query.less_than('windowStart', window_start), Query.select(['$id']), Query.limit(SKETCH_CLEANUP_PAGE_SIZE)]
+        if cursor:
+            queries.append(Query.cursor_after(cursor))
+        doc_ids = [doc['$id'] for doc in databases.list_documents(DATABASE_ID, VIEW_SKETCHES_COLLECTION_ID, queries).get('documents', [])]
+        if doc_ids:
+            deleted, failed_ids = delete_documents_concurrently(databases, VIEW_SKETCHES_COLLECTION_ID, doc_ids, context)
+            deleted_count += deleted
+            if failed_ids:
+                had_failures = True
+                cursor = max(failed_ids, key=doc_ids.index) # Last failed id in page order
+        if len(doc_ids) < SKETCH_CLEANUP_PAGE_SIZE:
+            return deleted_count, not had_failures
+    return deleted_count, False
+
+def view_hour(doc, fallback_hour):
+    """Returns the hour (since the epoch) a pending view was created in."""
+    try:
+        return int(datetime.fromisoformat(doc['$createdAt']).timestamp() // 3600)
+    except (KeyError, TypeError, ValueError):
+        return fallback_hour
+
+def update_view_rollup(databases, video_id, counts_by_hour, current_hour):
+    """Adds a batch's views to the video's hourly/daily rollup document."""
+    rollup_doc = None
+    try:
+        rollup_doc = databases.get_document(DATABASE_ID, VIEW_ROLLUPS_COLLECTION_ID, video_id)
+    except AppwriteException as e:
+        if e.code != 404:
+            raise
+
+    rollup = add_views(rollup_from_document(rollup_doc), counts_by_hour, current_hour)
+    if rollup_doc:
+        databases.update_document(DATABASE_ID, VIEW_ROLLUPS_COLLECTION_ID, video_id, rollup)
+    else:
+        databases.create_document(
+            DATABASE_ID, VIEW_ROLLUPS_COLLECTION_ID, video_id, rollup,
+            [Permission.read(Role.any())]
+        )
+
+def load_delete_backlog(databases):
+    """Returns the ids of processed pending views whose delete failed in an earlier run."""
+    try:
+        backlog_doc = databases.get_document(DATABASE_ID, JOB_CHECKPOINTS_COLLECTION_ID, DELETE_BACKLOG_ID)
+        return backlog_doc.get('pendingDeletes', []) or []
+    except AppwriteException as e:
+        if e.code == 404:
+            return []
+        raise
+
+def save_delete_backlog(databases, doc_ids):
+    data = {'pendingDeletes': doc_ids}
+    try:
+        databases.update_document(DATABASE_ID, JOB_CHECKPOINTS_COLLECTION_ID, DELETE_BACKLOG_ID, data)
+    except AppwriteException as e:
+        if e.code != 404:
+            raise
+        databases.create_document(DATABASE_ID, JOB_CHECKPOINTS_COLLECTION_ID, DELETE_BACKLOG_ID, data)
+
+def apply_view_entry(databases, entry, context):
+    """
+    Applies a journaled batch of one video's views (see counter_journal.py): the sketch's
+    countedViews, then viewCount. Both are safe to repeat.
+    Returns: The mode of the video_counts write, or None if it was already applied
+    """
+    video_id = entry['target']
+    modes = []
+
+    def apply_states(entry):
+        sketch_state = entry['states'].get('sketch')
+        if not sketch_state:
+            return
+        try:
+            databases.update_document(DATABASE_ID, VIEW_SKETCHES_COLLECTION_ID, sketch_state['id'], {'countedViews': sketch_state['countedViews']})
+        except AppwriteException as e:
+            if e.code != 404: # The window expired and its sketch was deleted
+                raise
+
+    def apply_deltas(entry):
+        modes.append(apply_counter_deltas(
+            databases, video_id, entry['deltas'], len(entry['interactionIds']), context, idempotency_key=journal_key(entry)
+        ))
+
+    apply_journal_entry(entry, apply_states, apply_deltas)
+    return modes[-1] if modes else None
+
+def process_video_group(databases, video_id, user_ids, doc_ids, view_hours, window_start, current_hour, context):
+    """
+    Counts one video's batch of pending views exactly once: journals the batch, then applies it.
+    Returns: A tuple (unique_views_count, rollup_updated, entry); entry is None if nothing was counted.
+             Raises if the views could not be counted; a journaled batch is then finished by a later run.
+    """
+    unique_user_ids_set = set(user_ids)
+    unique_views_count = len(unique_user_ids_set)
+    context.debug("Processing Video ID: %s. Found %s unique views in this batch.", video_id, unique_views_count)
+    states = {}
+
+    # --- Deduplicate Against Viewers Already Counted in This Window ---
+    if VIEW_DEDUP_MODE == "window":
+        unique_views_count, sketch_doc_id, counted_views = add_viewers_to_sketch(
+            databases, video_id, unique_user_ids_set, window_start, context
+        )
+        states['sketch'] = {'id': sketch_doc_id, 'countedViews': counted_views}
+        context.debug("%s of the batch's viewers are new in the current window for %s.", unique_views_count, video_id)
+
+    # --- Update video_counts (main document, or a counter shard for hot videos) ---
+    entry = None
+    if unique_views_count > 0:
+        entry = record_journal_entry(databases, JOURNAL_SOURCE, video_id, {'viewCount': unique_views_count}, states, doc_ids)
+        mode = apply_view_entry(databases, entry, context)
+        context.debug("Added %s views to counts for %s (%s).", unique_views_count, video_id, mode)
+        context.count(f"countWrites.{mode}")
+
+    # --- Add Raw Views to the Hourly/Daily Rollup (best effort, analytics only) ---
+    try:
+        update_view_rollup(databases, video_id, view_hours, current_hour)
+        rollup_updated = True
+    except Exception as rollup_err:
+        context.error(f"Failed to update view rollup for {video_id}: {rollup_err}")
+        rollup_updated = False
+    return unique_views_count, rollup_updated, entry
+
+def process_pending_view_page(databases, pending_docs, already_counted_ids, window_start, totals, new_views_by_video, blocked_video_ids, context):
+    """
+    Counts one page of pending views and deletes them.
+    Views that are counted but could not be deleted are added to already_counted_ids, so they are
+    skipped (not counted again) when a later page or run sees them. A video whose batch failed is
+    added to `blocked_video_ids`: its later views wait for the next run, which finishes the batch first.
+    Returns: The IDs of the pending views left in the queue.
+    """
+    doc_ids_to_delete = [] # Processed or invalid pending views, deleted together after the loop
+    finished_entries = [] # Journal entries to delete once their views are deleted
+
+    # --- Finish Batches an Earlier Run Journaled but Did Not Complete ---
+    # Their views are not counted again: the journal already holds their outcome
+    with stage('journal'):
+        entries = find_journal_entries(databases, JOURNAL_SOURCE, [doc['$id'] for doc in pending_docs if doc['$id'] not in already_counted_ids])
+    covered_ids = {doc_id for entry in entries for doc_id in entry['interactionIds']}
+    if entries:
+        context.log(f"Finishing {len(entries)} journaled batches covering {len(covered_ids)} pending views.")
+    with stage('journal_recovery'):
+        results = run_keyed(entries, lambda entry: entry['target'], lambda entry: apply_view_entry(databases, entry, context))
+    for entry, result in zip(entries, results):
+        if isinstance(result, Exception):
+            context.error(f"Failed to finish journaled batch {entry['$id']} for video {entry['target']}: {result}")
+            totals['failedVideoGroups'] += 1
+            blocked_video_ids.add(entry['target'])
+            continue
+        totals['recoveredBatches'] += 1
+        if result:
+            totals['newViews'] += entry['deltas'].get('viewCount', 0)
+            new_views_by_video[entry['target']] += entry['deltas'].get('viewCount', 0)
+        doc_ids_to_delete.extend(entry['interactionIds']) # Including any on later pages
+        finished_entries.append(entry)
+
+    # --- Group by Video ID ---
+    views_by_video = collections.defaultdict(list)
+    view_hours_by_video = collections.defaultdict(collections.Counter) # Map videoId -> {hour: views}
+    doc_ids_to_process = {} # Map videoId -> list of pendingDocIds
+    current_hour = int(time.time() // 3600)
+
+    context.log("Grouping pending views by video ID and user...")
+    for doc in pending_docs:
+        video_id = doc.get('videoId')
+        doc_id = doc['$id']
+        permissions = doc.get('$permissions', [])
+        user_id = get_user_id_from_permissions(permissions)
+
+        if doc_id in already_counted_ids or doc_id in covered_ids:
+            continue # Counted in an earlier run; only its delete is outstanding
+        if not video_id:
+            context.warning("Pending view doc %s missing videoId. Skipping.", doc_id)
+            doc_ids_to_delete.append(doc_id) # Delete this invalid doc with the processed ones
+            continue
+        if not user_id:
+            context.warning("Could not extract userId from permissions for pending view doc %s. Skipping.", doc_id)
+            doc_ids_to_delete.append(doc_id) # Delete this invalid doc with the processed ones
+            continue
+        if video_id in blocked_video_ids:
+            totals['deferred'] += 1
+            continue
+
+        views_by_video[video_id].append(user_id)
+        view_hours_by_video[video_id][view_hour(doc, current_hour)] += 1
+        if video_id not in doc_ids_to_process:
+            doc_ids_to_process[video_id] = []
+        doc_ids_to_process[video_id].append(doc_id)
+
+    context.log(f"Grouped views for {len(views_by_video)} unique videos.")
+
+    # --- Process Each Video Group, Videos in Parallel ---
+    # Groups already have one video each; the key keeps each video's sketch/counts/rollup writes in order
+    video_ids = list(views_by_video)
+    context.log(f"Processing {len(video_ids)} video groups with up to {DB_CONCURRENCY} concurrent database calls...")
+    with stage('video_groups'):
+        results = run_keyed(
+            video_ids,
+            lambda video_id: video_id,
+            lambda video_id: process_video_group(
+                databases, video_id, views_by_video[video_id], doc_ids_to_process[video_id],
+                view_hours_by_video[video_id], window_start, current_hour, context
+            )
+        )
+    for video_id, result in zip(video_ids, results):
+        if isinstance(result, Exception):
+            context.error(f"Failed to update/create counts for Video ID {video_id}: {result}")
+            context.error("".join(traceback.format_exception(type(result), result, result.__traceback__)))
+            totals['failedVideoGroups'] += 1
+            blocked_video_ids.add(video_id)
+            continue # DO NOT delete pending docs if update failed
+
+        unique_views_count, rollup_updated, entry = result
+        totals['newViews'] += unique_views_count
+        new_views_by_video[video_id] += unique_views_count
+        if rollup_updated:
+            totals['rollupsUpdated'] += 1
+        totals['processedVideoGroups'] += 1
+        if entry:
+            finished_entries.append(entry)
+        # --- Queue Processed Pending Views for Deletion (update succeeded) ---
+        doc_ids_to_delete.extend(doc_ids_to_process.get(video_id, []))
+
+    # --- Delete Processed Pending Views Concurrently ---
+    context.log(f"Deleting {len(doc_ids_to_delete)} processed pending views (concurrency {DELETE_CONCURRENCY})...")
+    with stage('deletes'):
+        deleted_count, failed_delete_ids = delete_documents_concurrently(databases, PENDING_VIEWS_COLLECTION_ID, doc_ids_to_delete, context)
+    totals['pendingDocsDeleted'] += deleted_count
+    totals['pendingDocsDeleteFailures'] += len(failed_delete_ids)
+    already_counted_ids.update(failed_delete_ids)
+
+    # --- Delete the Journal Entries Whose Views Are All Gone ---
+    # An entry with a failed view delete stays; counts-compactor removes it once the view is gone
+    failed_delete_set = set(failed_delete_ids)
+    with stage('journal'):
+        for entry in finished_entries:
+            if failed_delete_set.isdisjoint(entry['interactionIds']):
+                try:
+                    delete_journal_entry(databases, entry)
+                except AppwriteException as e:
+                    context.warning("Failed to delete journal entry %s: %s", entry['$id'], e)
+
+    deleted_ids = set(doc_ids_to_delete) - failed_delete_set
+    return [doc['$id'] for doc in pending_docs if doc['$id'] not in deleted_ids]
+
+@instrumented("view-manager")
+@leveled_logging
+@profiled
 def main(context):
     context.log("--- View Manager Function Start ---")
+    started_at = time.monotonic()
 
     # --- Environment & Auth Check ---
     api_endpoint = os.environ.get("APPWRITE_FUNCTION_API_ENDPOINT")
@@ -39,153 +371,74 @@ def main(context):
         return context.res.json({"success": False, "message": message}, 500)
 
     # --- Initialize Appwrite Client ---
-    client = Client()
-    client.set_endpoint(api_endpoint).set_project(project_id).set_key(api_key)
+    client = create_client(api_endpoint, project_id, api_key)
     databases = Databases(client)
 
-    total_processed_successfully = 0
-    total_failed_to_update = 0
-    total_deleted = 0
-    total_delete_failures = 0
+    totals = collections.Counter() # Run-wide counts, keyed like the summary
+    expired_sketches_deleted = 0
 
     try:
-        # --- Fetch Pending Views ---
-        context.log(f"Fetching up to {MAX_DOCS_PER_RUN} pending views...")
-        pending_response = databases.list_documents(
-            DATABASE_ID,
-            PENDING_VIEWS_COLLECTION_ID,
-            [Query.limit(MAX_DOCS_PER_RUN)]
+        # --- Retry Deletes Left Over From Earlier Runs (these views were already counted) ---
+        delete_backlog = load_delete_backlog(databases)
+        had_delete_backlog = bool(delete_backlog)
+        if delete_backlog:
+            context.log(f"Retrying deletion of {len(delete_backlog)} already-counted pending views...")
+            with stage('deletes'):
+                backlog_deleted, delete_backlog = delete_documents_concurrently(databases, PENDING_VIEWS_COLLECTION_ID, delete_backlog, context)
+            totals['pendingDocsDeleted'] += backlog_deleted
+        already_counted_ids = set(delete_backlog)
+
+        # --- Drain Pending Views Page by Page Within the Time Budget ---
+        window_start = current_window_start(time.time())
+        new_views_by_video = collections.Counter() # Map videoId -> views added to viewCount, for trending
+        blocked_video_ids = set() # Videos with a failed batch this run
+        drain = drain_queue(
+            databases, PENDING_VIEWS_COLLECTION_ID,
+            lambda page: process_pending_view_page(databases, page, already_counted_ids, window_start, totals, new_views_by_video, blocked_video_ids, context),
+            context, FUNCTION_TIMEOUT_SECONDS, page_size=PAGE_SIZE, started_at=started_at
         )
-        pending_docs = pending_response.get('documents', [])
-        total_fetched = len(pending_docs)
-        context.log(f"Fetched {total_fetched} pending view documents.")
+        total_fetched = drain['fetched']
+        context.log(f"Fetched {total_fetched} pending view documents in {drain['pages']} pages. Backlog remaining: {drain['backlogRemaining']}.")
+
+        # Remember failed deletes so the next run retries them instead of counting the views again
+        remaining_backlog = sorted(already_counted_ids)
+        if remaining_backlog or had_delete_backlog:
+            save_delete_backlog(databases, remaining_backlog)
 
         if total_fetched == 0:
             context.log("No pending views to process.")
             return context.res.json({"success": True, "message": "No pending views."})
 
-        # --- Group by Video ID ---
-        views_by_video = collections.defaultdict(list)
-        doc_ids_to_process = {} # Map videoId -> list of pendingDocIds
-
-        context.log("Grouping pending views by video ID and user...")
-        for doc in pending_docs:
-            video_id = doc.get('videoId')
-            doc_id = doc['$id']
-            permissions = doc.get('$permissions', [])
-            user_id = get_user_id_from_permissions(permissions)
-
-            if not video_id:
-                context.log(f"Warning: Pending view doc {doc_id} missing videoId. Skipping.")
-                # Consider deleting this invalid doc immediately
-                try:
-                   databases.delete_document(DATABASE_ID, PENDING_VIEWS_COLLECTION_ID, doc_id)
-                except Exception as del_err:
-                   context.log(f"Warning: Failed to delete invalid pending view doc {doc_id}: {del_err}")
-                continue
-            if not user_id:
-                context.log(f"Warning: Could not extract userId from permissions for pending view doc {doc_id}. Skipping.")
-                # Consider deleting this invalid doc immediately
-                try:
-                   databases.delete_document(DATABASE_ID, PENDING_VIEWS_COLLECTION_ID, doc_id)
-                except Exception as del_err:
-                   context.log(f"Warning: Failed to delete invalid pending view doc {doc_id}: {del_err}")
-                continue
-
-            views_by_video[video_id].append(user_id)
-            if video_id not in doc_ids_to_process:
-                doc_ids_to_process[video_id] = []
-            doc_ids_to_process[video_id].append(doc_id)
-
-        context.log(f"Grouped views for {len(views_by_video)} unique videos.")
+        with stage('trending'):
+            record_trending_deltas(databases, SOURCE_VIEWS, dict(new_views_by_video), context)
 
-        # --- Process Each Video Group ---
-        for video_id, user_ids in views_by_video.items():
-            update_successful = False
+        if VIEW_DEDUP_MODE == "window":
             try:
-                unique_user_ids_set = set(user_ids)
-                unique_views_count = len(unique_user_ids_set)
-                context.log(f"Processing Video ID: {video_id}. Found {unique_views_count} unique views in this batch.")
-
-                # --- Update video_counts ---
-                current_view_count = 0
-                counts_doc_exists = False
-                try:
-                    counts_doc = databases.get_document(DATABASE_ID, VIDEO_COUNTS_COLLECTION_ID, video_id)
-                    current_view_count = counts_doc.get('viewCount', 0) or 0
-                    counts_doc_exists = True
-                except AppwriteException as e:
-                    if e.code == 404:
-                        context.log(f"No counts document found for {video_id}. Will create.")
-                        current_view_count = 0
-                        counts_doc_exists = False
-                    else:
-                        # Re-throw other errors during fetch
-                        raise Exception(f"Error fetching counts doc {video_id}: {e}")
-
-                new_view_count = current_view_count + unique_views_count
-                update_data = {'viewCount': new_view_count}
-
-                if counts_doc_exists:
-                    context.log(f"Updating counts for {video_id}: {current_view_count} -> {new_view_count}")
-                    databases.update_document(
-                        database_id=DATABASE_ID,
-                        collection_id=VIDEO_COUNTS_COLLECTION_ID,
-                        document_id=video_id,
-                        data=update_data
-                    )
-                    context.log(f"Successfully updated counts for {video_id}.")
-                else:
-                    context.log(f"Creating counts for {video_id} with initial count: {new_view_count}")
-                    # Include other default counts when creating
-                    create_data = {
-                        'viewCount': new_view_count,
-                        'likeCount': 0,
-                        'dislikeCount': 0,
-                        'commentCount': 0,
-                        'commentsJson': '[]'
-                    }
-                    databases.create_document(
-                        database_id=DATABASE_ID,
-                        collection_id=VIDEO_COUNTS_COLLECTION_ID,
-                        document_id=video_id,
-                        data=create_data,
-                        permissions=[Permission.read(Role.any())] # Public read access
+                with stage('expired_sketches'):
+                    expired_sketches_deleted, cleanup_finished = delete_expired_sketches(
+                        databases, window_start, started_at + FUNCTION_TIMEOUT_SECONDS * SKETCH_CLEANUP_TIME_SHARE, context
                     )
-                    context.log(f"Successfully created counts document for {video_id}.")
-
-                update_successful = True
-                total_processed_successfully += 1
-
-            except Exception as update_err:
-                context.error(f"Failed to update/create counts for Video ID {video_id}: {update_err}")
-                context.error(traceback.format_exc())
-                total_failed_to_update += 1
-                update_successful = False
-                # DO NOT delete pending docs if update failed
-
-            # --- Delete Processed Pending Views (if update succeeded) ---
-            if update_successful:
-                pending_docs_for_video = doc_ids_to_process.get(video_id, [])
-                context.log(f"Update successful for {video_id}. Deleting {len(pending_docs_for_video)} related pending views...")
-                for doc_id in pending_docs_for_video:
-                    try:
-                        databases.delete_document(DATABASE_ID, PENDING_VIEWS_COLLECTION_ID, doc_id)
-                        total_deleted += 1
-                    except Exception as delete_err:
-                        context.error(f"Failed to delete pending view doc {doc_id} for video {video_id}: {delete_err}")
-                        total_delete_failures += 1
-                context.log(f"Finished deletion attempt for {video_id}.")
-
-        # --- End of loop ---
-        context.log(f"Batch processing finished. Successful updates: {total_processed_successfully}, Failed updates: {total_failed_to_update}, Docs deleted: {total_deleted}, Deletion failures: {total_delete_failures}")
+                if not cleanup_finished:
+                    context.log(f"Deleted {expired_sketches_deleted} expired view sketches. Leaving the rest for the next run.")
+            except AppwriteException as e:
+                context.log(f"Warning: Failed to clean up expired view sketches: {e}")
+
+        context.log(f"Batch processing finished. Successful updates: {totals['processedVideoGroups']}, Failed updates: {totals['failedVideoGroups']}, New views: {totals['newViews']}, Docs deleted: {totals['pendingDocsDeleted']}, Deletion failures: {totals['pendingDocsDeleteFailures']}")
         return context.res.json({
             "success": True,
-            "processedVideoGroups": total_processed_successfully,
-            "failedVideoGroups": total_failed_to_update,
-            "pendingDocsDeleted": total_deleted,
-            "pendingDocsDeleteFailures": total_delete_failures,
-            "totalFetched": total_fetched
+            "newViews": totals['newViews'],
+            "rollupsUpdated": totals['rollupsUpdated'],
+            "expiredSketchesDeleted": expired_sketches_deleted,
+            "processedVideoGroups": totals['processedVideoGroups'],
+            "failedVideoGroups": totals['failedVideoGroups'],
+            "recoveredBatches": totals['recoveredBatches'],
+            "deferred": totals['deferred'],
+            "pendingDocsDeleted": totals['pendingDocsDeleted'],
+            "pendingDocsDeleteFailures": totals['pendingDocsDeleteFailures'],
+            "totalFetched": total_fetched,
+            "pages": drain['pages'],
+            "backlogRemaining": drain['backlogRemaining'],
+            "drained": drain['drained']
         })
 
     except Exception as e:
@@ -0,0 +1,268 @@
+# Synced from functions/shared/video_counters.py by functions/shared/sync.py. Edit the original, not this copy.
+"""
+Counter updates for the video_counts collection, with an optional sharded mode for hot videos.
+
+Unsharded videos keep their totals on the single video_counts document. When sharding is
+enabled (VIDEO_COUNTS_SHARDING=true) a video whose event rate crosses the hot threshold is
+promoted: its video_counts document gets shardCount=N, and writers then add their deltas to
+one of N random documents in video_count_shards instead of the main document. The
+counts-compactor function periodically folds shard deltas back into video_counts and demotes
+videos that have cooled down, so readers of video_counts stay eventually consistent.
+
+Counter and shard documents are written under optimistic concurrency (see versioned_writes.py).
+A write with an idempotency key is applied once: the key is stored on the document it went to,
+and a keyed write to a sharded video always picks the same shard. A fold of the shards
+into video_counts is recorded on the video_counts document, so a compaction that dies halfway is
+finished by the next one instead of counted twice (compact_video_shards).
+"""
+import hashlib
+import json
+import os
+import random
+import time
+
+from appwrite.exception import AppwriteException
+from appwrite.id import ID
+from appwrite.permission import Permission
+from appwrite.role import Role
+from appwrite.query import Query
+
+from .versioned_writes import APPLIED_KEYS_ATTRIBUTE, delete_versioned, merge_applied_keys, update_versioned
+
+# Configuration Constants
+DATABASE_ID = "database"
+VIDEO_COUNTS_COLLECTION_ID = "video_counts"
+VIDEO_COUNT_SHARDS_COLLECTION_ID = "video_count_shards"
+COUNTER_FIELDS = ('likeCount', 'dislikeCount', 'viewCount')
+PENDING_FOLD_ATTRIBUTE = 'pendingFold'
+FOLD_KEY_SCOPE = 'fold' # Idempotency keys of shard subtractions: fold:<fold ID>
+
+SHARDING_ENABLED = os.environ.get("VIDEO_COUNTS_SHARDING", "false").lower() == "true"
+SHARD_COUNT = int(os.environ.get("VIDEO_COUNTS_SHARD_COUNT", "8"))
+# Events per minute on one video before it is promoted to sharded mode
+HOT_EVENTS_PER_MINUTE = float(os.environ.get("VIDEO_COUNTS_HOT_EVENTS_PER_MINUTE", "30"))
+RATE_WINDOW_SECONDS = 300 # Length of the event-rate window tracked on video_counts
+
+MODE_MAIN = 'main'
+MODE_SHARD = 'shard'
+
+
+class FoldInProgressError(Exception):
+    """Another compaction recorded a fold of the video and has not finished it."""
+
+
+def shard_document_id(video_id, shard_index):
+    return f"{video_id}_{shard_index}"
+
+
+def _default_counts_data():
+    return {
+        'likeCount': 0,
+        'dislikeCount': 0,
+        'viewCount': 0,
+        'commentCount': 0,
+        'commentsJson': '[]'
+    }
+
+
+def _shard_index(shard_count, idempotency_key):
+    """A random shard, or the key's own shard so a retried keyed write finds the key again."""
+    if idempotency_key is None:
+        return random.randrange(shard_count)
+    return int(hashlib.sha1(idempotency_key.encode('utf-8')).hexdigest()[:8], 16) % shard_count
+
+
+def _add_to_shard(databases, video_id, shard_count, deltas, events, idempotency_key=None):
+    """Adds deltas to one shard of a sharded video. Returns the fields written, None if the key was already applied."""
+    shard_index = _shard_index(shard_count, idempotency_key)
+
+    def build(shard_doc):
+        data = {field: ((shard_doc or {}).get(field, 0) or 0) + delta for field, delta in deltas.items()}
+        data['events'] = ((shard_doc or {}).get('events', 0) or 0) + events
+        return data
+
+    create_data = {field: 0 for field in COUNTER_FIELDS}
+    create_data.update({'videoId': video_id, 'shard': shard_index})
+    return update_versioned(
+        databases, VIDEO_COUNT_SHARDS_COLLECTION_ID, shard_document_id(video_id, shard_index), build,
+        idempotency_key, create_data=create_data, permissions=[Permission.read(Role.any())]
+    )
+
+
+def _next_rate_window(counts_doc, events, now):
+    """Returns (windowStart, windowEvents) after recording `events` at time `now`."""
+    window_start = counts_doc.get('rateWindowStart') or 0
+    window_events = counts_doc.get('rateWindowEvents') or 0
+    if now - window_start >= RATE_WINDOW_SECONDS:
+        return now, events
+    return window_start, window_events + events
+
+
+def apply_counter_deltas(databases, video_id, deltas, events, context, idempotency_key=None):
+    """
+    Adds integer deltas (keys from COUNTER_FIELDS) to a video's counters.
+
+    `events` is the number of user events the deltas represent; it drives hot-video promotion.
+    A write with an `idempotency_key` that was already applied is skipped.
+    Returns the mode used for the write: MODE_MAIN or MODE_SHARD, or None if the key was already
+    applied.
+    Raises AppwriteException on database errors, VersionConflictError if the write kept losing races.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta != 0}
+
+    shard_counts = [] # Set by build when the video turns out to be sharded
+
+    def build(counts_doc):
+        shard_count = (counts_doc or {}).get('shardCount') or 0
+        if shard_count > 0:
+            shard_counts.append(shard_count)
+            return None
+        now = int(time.time())
+        window_start, window_events = _next_rate_window(counts_doc or {}, events, now)
+        update_data = {
+            field: max(0, ((counts_doc or {}).get(field, 0) or 0) + delta)
+            for field, delta in deltas.items()
+        }
+        update_data['rateWindowStart'] = window_start
+        update_data['rateWindowEvents'] = window_events
+        if SHARDING_ENABLED and window_events >= HOT_EVENTS_PER_MINUTE * RATE_WINDOW_SECONDS / 60:
+            update_data['shardCount'] = SHARD_COUNT
+        return update_data
+
+    written = update_versioned(
+        databases, VIDEO_COUNTS_COLLECTION_ID, video_id, build, idempotency_key,
+        create_data=_default_counts_data(), permissions=[Permission.read(Role.any())]
+    )
+    if shard_counts and written is None:
+        if _add_to_shard(databases, video_id, shard_counts[-1], deltas, events, idempotency_key) is None:
+            return None
+        return MODE_SHARD
+    if written is None:
+        return None
+    if 'shardCount' in written:
+        context.log(f"Video {video_id} reached {written['rateWindowEvents']} events in the current window. Promoting to {SHARD_COUNT} counter shards.")
+    return MODE_MAIN
+
+
+def list_shard_documents(databases, video_id=None, page_size=100):
+    """Pages through shard documents, optionally for a single video."""
+    cursor = None
+    while True:
+        queries = [Query.limit(page_size)]
+        if video_id:
+            queries.append(Query.equal('videoId', video_id))
+        if cursor:
+            queries.append(Query.cursor_after(cursor))
+        documents = databases.list_documents(DATABASE_ID, VIDEO_COUNT_SHARDS_COLLECTION_ID, queries).get('documents', [])
+        yield from documents
+        if len(documents) < page_size:
+            return
+        cursor = documents[-1]['$id']
+
+
+def _subtract_from_shard(databases, shard_id, folded, fold_key):
+    """Removes a fold's deltas from a shard once, re-reading it to keep deltas written since the fold."""
+    def build(shard_doc):
+        if shard_doc is None:
+            return None
+        return {field: (shard_doc.get(field, 0) or 0) - amount for field, amount in folded.items()}
+
+    update_versioned(databases, VIDEO_COUNT_SHARDS_COLLECTION_ID, shard_id, build, fold_key)
+
+
+def _finish_fold(databases, video_id, pending_fold):
+    """
+    Subtracts a recorded fold from its shards, then clears it from the video_counts document.
+    Shards it emptied are deleted only after that, so a recorded fold always has its shards (and
+    their fold keys) to come back to.
+    """
+    fold_key = f"{FOLD_KEY_SCOPE}:{pending_fold['id']}"
+    for shard_id, folded in pending_fold['shards'].items():
+        _subtract_from_shard(databases, shard_id, folded, fold_key)
+
+    def build(counts_doc):
+        if counts_doc is None or _pending_fold(counts_doc).get('id') != pending_fold['id']:
+            return None
+        return {PENDING_FOLD_ATTRIBUTE: None}
+
+    update_versioned(databases, VIDEO_COUNTS_COLLECTION_ID, video_id, build)
+    if pending_fold['deleteEmptied']:
+        for shard_id, folded in pending_fold['shards'].items():
+            delete_versioned(
+                databases, VIDEO_COUNT_SHARDS_COLLECTION_ID, shard_id,
+                lambda shard_doc: not any(shard_doc.get(field, 0) or 0 for field in folded)
+            )
+
+
+def _pending_fold(counts_doc):
+    return json.loads((counts_doc or {}).get(PENDING_FOLD_ATTRIBUTE) or '{}')
+
+
+def compact_video_shards(databases, video_id, shard_docs, context):
+    """
+    Folds a video's shard deltas into its video_counts document and demotes it if it has cooled down.
+
+    The fold is recorded as `pendingFold` (an ID and the amounts taken from each shard) by the same
+    write that adds the amounts to video_counts. The amounts are then subtracted from the shards with
+    the fold's ID as idempotency key, and the record is cleared. A fold interrupted in between is
+    finished by the next compaction before it folds anything new, so no delta is counted twice.
+    The shards' idempotency keys are carried over, so a keyed write retried after a demotion is still found.
+    Returns: A tuple (folded_shard_count, demoted)
+    """
+    counts_doc = databases.get_document(DATABASE_ID, VIDEO_COUNTS_COLLECTION_ID, video_id)
+    pending_fold = _pending_fold(counts_doc)
+    if pending_fold:
+        context.log(f"Finishing interrupted fold {pending_fold['id']} of video {video_id}.")
+        _finish_fold(databases, video_id, pending_fold)
+        shard_docs = list(list_shard_documents(databases, video_id))
+
+    sums = {field: 0 for field in COUNTER_FIELDS}
+    events = 0
+    shard_keys = []
+    fold_shards = {}
+    for shard_doc in shard_docs:
+        folded = {field: shard_doc.get(field, 0) or 0 for field in COUNTER_FIELDS}
+        folded['events'] = shard_doc.get('events', 0) or 0
+        for field in COUNTER_FIELDS:
+            sums[field] += folded[field]
+        events += folded['events']
+        fold_shards[shard_doc['$id']] = folded
+        shard_keys.extend(
+            record for record in (shard_doc.get(APPLIED_KEYS_ATTRIBUTE) or [])
+            if not record.startswith(f"{FOLD_KEY_SCOPE}:")
+        )
+    fold = {'id': ID.unique(), 'shards': fold_shards, 'deleteEmptied': False}
+    demoted = []
+
+    def build(counts_doc):
+        if counts_doc is None:
+            raise AppwriteException(f"video_counts document {video_id} not found", 404)
+        if _pending_fold(counts_doc):
+            raise FoldInProgressError(f"video_counts document {video_id} has an unfinished fold")
+        now = int(time.time())
+        # Sharded writers do not touch the main document, so its window start is the last compaction
+        elapsed_minutes = max(1.0, (now - (counts_doc.get('rateWindowStart') or now)) / 60)
+        events_per_minute = events / elapsed_minutes
+        demote = (counts_doc.get('shardCount') or 0) > 0 and events_per_minute < HOT_EVENTS_PER_MINUTE / 2
+
+        update_data = {field: max(0, (counts_doc.get(field, 0) or 0) + sums[field]) for field in COUNTER_FIELDS}
+        update_data['rateWindowStart'] = now
+        update_data['rateWindowEvents'] = 0
+        if shard_keys:
+            update_data[APPLIED_KEYS_ATTRIBUTE] = merge_applied_keys(counts_doc.get(APPLIED_KEYS_ATTRIBUTE), shard_keys)
+        demoted[:] = [events_per_minute] if demote else []
+        if demote:
+            update_data['shardCount'] = 0
+        # A demoted video's shards are deleted once emptied; so are stray shards of an unsharded one
+        fold['deleteEmptied'] = demote or not (counts_doc.get('shardCount') or 0)
+        if fold_shards:
+            update_data[PENDING_FOLD_ATTRIBUTE] = json.dumps(fold, separators=(',', ':'))
+        return update_data
+
+    update_versioned(databases, VIDEO_COUNTS_COLLECTION_ID, video_id, build)
+    if demoted:
+        context.log(f"Video {video_id} cooled down to {demoted[0]:.1f} events/min. Demoting to a single counter document.")
+    if fold_shards:
+        _finish_fold(databases, video_id, fold)
+
+    return len(shard_docs), bool(demoted)
@@ -0,0 +1,91 @@
+"""
+Time-bucketed view rollups stored as fixed-length arrays on one document per video.
+
+`hourlyViews` holds the last HOURLY_BUCKETS hours, newest last, ending at hour `latestHour`
+(hours since the Unix epoch). When an hour ages out of that ring it is folded into
+`dailyViews`, which holds the last DAILY_BUCKETS days ending at day `latestDay`. A day
+bucket therefore only contains hours that are no longer in the hourly ring, so the two
+arrays never count the same view twice and a range query touches O(buckets), not O(events).
+"""
+HOURLY_BUCKETS = 48
+DAILY_BUCKETS = 90
+
+
+def empty_rollup():
+    return {
+        'hourlyViews': [0] * HOURLY_BUCKETS,
+        'latestHour': 0,
+        'dailyViews': [0] * DAILY_BUCKETS,
+        'latestDay': 0
+    }
+
+
+def rollup_from_document(rollup_doc):
+    """Reads the rollup fields from a document, resetting any array with an unexpected length."""
+    rollup = empty_rollup()
+    if rollup_doc:
+        hourly_views = rollup_doc.get('hourlyViews') or []
+        daily_views = rollup_doc.get('dailyViews') or []
+        if len(hourly_views) == HOURLY_BUCKETS:
+            rollup['hourlyViews'] = list(hourly_views)
+            rollup['latestHour'] = rollup_doc.get('latestHour') or 0
+        if len(daily_views) == DAILY_BUCKETS:
+            rollup['dailyViews'] = list(daily_views)
+            rollup['latestDay'] = rollup_doc.get('latestDay') or 0
+    return rollup
+
+
+def _add_to_day(rollup, day, count):
+    if day > rollup['latestDay']:
+        shift = min(day - rollup['latestDay'], DAILY_BUCKETS)
+        rollup['dailyViews'] = rollup['dailyViews'][shift:] + [0] * shift
+        rollup['latestDay'] = day
+    offset = rollup['latestDay'] - day
+    if offset < DAILY_BUCKETS: # Older than the daily ring: dropped
+        rollup['dailyViews'][DAILY_BUCKETS - 1 - offset] += count
+
+
+def advance_to_hour(rollup, hour):
+    """Moves the hourly ring forward to `hour`, folding the hours that age out into days."""
+    latest_hour = rollup['latestHour']
+    if hour <= latest_hour:
+        return
+    shift = min(hour - latest_hour, HOURLY_BUCKETS)
+    oldest_hour = latest_hour - HOURLY_BUCKETS + 1
+    for index in range(shift):
+        count = rollup['hourlyViews'][index]
+        if count:
+            _add_to_day(rollup, (oldest_hour + index) // 24, count)
+    rollup['hourlyViews'] = rollup['hourlyViews'][shift:] + [0] * shift
+    rollup['latestHour'] = hour
+
+
+def add_views(rollup, counts_by_hour, current_hour):
+    """Adds view counts keyed by hour (hours since the epoch) after advancing the ring to `current_hour`."""
+    advance_to_hour(rollup, max([current_hour, *counts_by_hour]))
+    for hour, count in counts_by_hour.items():
+        offset = rollup['latestHour'] - hour
+        if offset < HOURLY_BUCKETS:
+            rollup['hourlyViews'][HOURLY_BUCKETS - 1 - offset] += count
+        else:
+            _add_to_day(rollup, hour // 24, count)
+    return rollup
+
+
+def views_in_range(rollup, start_hour, end_hour):
+    """
+    Returns the views between `start_hour` (inclusive) and `end_hour` (exclusive).
+    Hours inside the hourly ring are exact; older parts of the range are summed at day granularity.
+    """
+    total = 0
+    ring_start = rollup['latestHour'] - HOURLY_BUCKETS + 1
+    for hour in range(max(start_hour, ring_start), min(end_hour, rollup['latestHour'] + 1)):
+        total += rollup['hourlyViews'][hour - ring_start]
+
+    if start_hour < ring_start:
+        first_day = start_hour // 24
+        last_day = (min(end_hour, ring_start) - 1) // 24
+        daily_start = rollup['latestDay'] - DAILY_BUCKETS + 1
+        for day in range(max(first_day, daily_start), min(last_day, rollup['latestDay']) + 1):
+            total += rollup['dailyViews'][day - daily_start]
+    return total
@@ -55,22 +55,67 @@ export const AuthProvider = ({ children }) => {
         // Proceed even if account doc doesn't exist yet, defaults will be used
     }
     
-    // Fetch user's subscriptions from dedicated collection
+    // accounts.videosLiked/videosDisliked trail user_video_states by up to one projector run,
+    // so read the user's own states, which likes-manager writes as soon as it applies a like
     try {
-        const subscriptionsDoc = await databases.getDocument(
-            appwriteConfig.databaseId,
-            appwriteConfig.userSubscriptionsCollectionId,
-            userId
-        );
-        subscribedToChannelIds = subscriptionsDoc?.subscribedToChannelIds || [];
-        console.log(`[AuthContext] Fetched subscriptions: ${subscribedToChannelIds.length} channels`);
+        const pageSize = 100;
+        let cursor = null;
+        const likedFromStates = [];
+        const dislikedFromStates = [];
+        while (true) {
+            const queries = [Query.equal('userId', userId), Query.limit(pageSize)];
+            if (cursor) queries.push(Query.cursorAfter(cursor));
+            const response = await databases.listDocuments(
+                appwriteConfig.databaseId,
+                appwriteConfig.userVideoStatesCollectionId,
+                queries
+            );
+            for (const doc of response.documents) {
+                if (doc.state === 'liked') likedFromStates.push(doc.videoId);
+                else if (doc.state === 'disliked') dislikedFromStates.push(doc.videoId);
+            }
+            if (response.documents.length < pageSize) break;
+            cursor = response.documents[response.documents.length - 1].$id;
+        }
+        accountVideosLiked = likedFromStates;
+        accountVideosDisliked = dislikedFromStates;
     } catch (error) {
-        if (error.code !== 404) {
-            console.error("Failed to fetch user subscriptions:", error);
-        } else {
-            console.log(`[AuthContext] No subscriptions document found for ${userId}, using empty array.`);
+        console.error("Failed to fetch user video states, using the account arrays:", error);
+    }
+
+    // Fetch user's subscriptions: one edge document per followed channel
+    try {
+        const pageSize = 100;
+        let cursor = null;
+        while (true) {
+            const queries = [Query.equal('subscriberId', userId), Query.limit(pageSize)];
+            if (cursor) queries.push(Query.cursorAfter(cursor));
+            const response = await databases.listDocuments(
+                appwriteConfig.databaseId,
+                appwriteConfig.subscriptionsCollectionId,
+                queries
+            );
+            subscribedToChannelIds.push(...response.documents.map(doc => doc.creatorId));
+            if (response.documents.length < pageSize) break;
+            cursor = response.documents[response.documents.length - 1].$id;
+        }
+        // Users not migrated yet still have their subscriptions in the legacy array
+        if (subscribedToChannelIds.length === 0) {
+            try {
+                const legacyDoc = await databases.getDocument(
+                    appwriteConfig.databaseId,
+                    appwriteConfig.userSubscriptionsCollectionId,
+                    userId
+                );
+                subscribedToChannelIds = legacyDoc?.subscribedToChannelIds || [];
+            } catch (legacyError) {
+                if (legacyError.code !== 404) throw legacyError;
+            }
         }
-        // Default to empty array if document doesn't exist or error occurs
+        console.log(`[AuthContext] Fetched subscriptions: ${subscribedToChannelIds.length} channels`);
+    } catch (error) {
+        console.error("Failed to fetch user subscriptions:", error);
+        // Default to empty array if an error occurs
     }
 
     return {
@@ -155,25 +200,6 @@ export const AuthProvider = ({ children }) => {
           );
           console.log(`[AuthContext] Successfully created account details document for user ${userId}.`);
           
-          // Create empty user subscriptions document
-          try {
-            await databases.createDocument(
-              appwriteConfig.databaseId,
-              appwriteConfig.userSubscriptionsCollectionId,
-              userId, // Use user ID as document ID
-              {
-                subscribedToChannelIds: [] // Initialize with empty array
-              },
-              [ // Only allow user to read their own subscriptions
-                Permission.read(Role.user(userId))
-              ]
-            );
-            console.log(`[AuthContext] Successfully created subscriptions document for user ${userId}.`);
-          } catch (subsError) {
-            console.error("Failed to create user subscriptions document:", subsError);
-            // Continue with login anyway
-          }
-          
         } catch (docError) {
           console.error("Failed to create account details document:", docError);
           // Proceed to login anyway
@@ -274,64 +300,6 @@ export const AuthProvider = ({ children }) => {
     });
      console.log(`[AuthContext Optimistic] Updated client state sets for ${videoId}, action ${action}`);
   };
-  // --- Add updateAccountLikeDislikeArrays ---
-  const updateAccountLikeDislikeArrays = async (videoId, action) => {
-    if (!user) {
-        console.warn("[AuthContext] Cannot update account arrays: User not logged in.");
-        return;
-    }
-    console.log(`[AuthContext] Queueing update for account arrays: video ${videoId}, action ${action}`);
-
-    try {
-        // Fetch the latest arrays (optional, could use current context state but fetch is safer)
-        const currentAccountDoc = await databases.getDocument(
-            appwriteConfig.databaseId,
-            appwriteConfig.accountsCollectionId,
-            user.$id
-        );
-        let currentLiked = new Set(currentAccountDoc.videosLiked || []);
-        let currentDisliked = new Set(currentAccountDoc.videosDisliked || []);
-
-        // Apply the action
-        if (action === 'like') {
-            if (currentLiked.has(videoId)) {
-                currentLiked.delete(videoId); // Toggle off like
-            } else {
-                currentLiked.add(videoId); // Add like
-                currentDisliked.delete(videoId); // Remove potential dislike
-            }
-        } else if (action === 'dislike') {
-            if (currentDisliked.has(videoId)) {
-                currentDisliked.delete(videoId); // Toggle off dislike
-            } else {
-                currentDisliked.add(videoId); // Add dislike
-                currentLiked.delete(videoId); // Remove potential like
-            }
-        }
-
-        // Convert Sets back to arrays for update
-        const updatedLikedArray = Array.from(currentLiked);
-        const updatedDislikedArray = Array.from(currentDisliked);
-
-        // Update the document
-        await databases.updateDocument(
-            appwriteConfig.databaseId,
-            appwriteConfig.accountsCollectionId,
-            user.$id,
-            {
-                videosLiked: updatedLikedArray,
-                videosDisliked: updatedDislikedArray
-                // Only update these fields to avoid overwriting concurrent updates to bio/name etc.
-            }
-        );
-        console.log(`[AuthContext] Successfully updated account arrays for user ${user.$id}`);
-
-    } catch (error) {
-        console.error(`[AuthContext] Failed to update account arrays for user ${user.$id}:`, error);
-        // Log the error, but don't block the user. The backend function will eventually correct the state.
-    }
-  };
-
   // --- Add toggleWatchLater function ---
   const toggleWatchLater = async (videoId) => {
     if (!user) {
@@ -362,10 +330,8 @@ export const AuthProvider = ({ children }) => {
         appwriteConfig.accountsCollectionId,
         user.$id,
         {
-          watchLaterVideos: updatedWatchLaterArray,
-          // Include other required arrays to prevent overwriting
-          videosLiked: Array.from(likedVideoIds),
-          videosDisliked: Array.from(dislikedVideoIds)
+          watchLaterVideos: updatedWatchLaterArray
+          // videosLiked/videosDisliked are left to liked-videos-projector
         }
       );
       console.log(`[AuthContext] Successfully updated 'watchLaterVideos' for user ${user.$id}`);
@@ -390,7 +356,6 @@ export const AuthProvider = ({ children }) => {
     checkUserStatus,
     refreshUserProfile, // Expose the renamed function
     updateClientVideoStates, // Keep this for immediate UI update
-    updateAccountLikeDislikeArrays, // Expose the new function
     toggleWatchLater, // Expose the new watch later function
     account, // Keep access to account service if needed elsewhere
   };
@@ -14,7 +14,9 @@ export const appwriteConfig = {
     videoInteractionsCollectionId: 'video_interactions', // Video interactions collection ID
     channelStatsCollectionId: 'channel_stats', // Channel stats collection ID
     accountInteractionsCollectionId: 'account_interactions', // Account interactions collection ID
-    userSubscriptionsCollectionId: 'user_subscriptions', // User subscriptions collection ID
+    userSubscriptionsCollectionId: 'user_subscriptions', // Legacy per-user subscriptions arrays (being migrated)
+    subscriptionsCollectionId: 'subscriptions', // One document per (subscriber, creator) subscription
+    subscriptionFeedsCollectionId: 'subscription_feeds', // Per-user feeds of fanned-out video ids, newest first
     userVideoStatesCollectionId: 'user_video_states', // User video states collection ID
     commentsInteractionsCollectionId: 'comments-interactions', // Comments interactions collection ID
 };
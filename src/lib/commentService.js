@@ -1,5 +1,6 @@
 import { functions, databases, appwriteConfig } from './appwriteConfig';
 import { ID, Permission, Role } from 'appwrite';
+import { queuePartition } from './queuePartition';
 import { v4 as uuidv4 } from 'uuid';
 
 const COMMENTS_FUNCTION_ID = 'comments-manager';
@@ -32,7 +33,8 @@ export const postComment = async (videoId, commentText, parentCommentId = null,
       videoId,
       commentText,
       parentCommentId: parentCommentId || null, // Ensure null if empty
-      temporaryClientId
+      temporaryClientId,
+      partition: queuePartition(videoId) // Keeps a video's interactions in order
     };
 
     // Permissions: Creator can manage, function (via API key) reads implicitly
@@ -86,7 +88,8 @@ export const deleteCommentInteraction = async (videoId, commentIdToDelete, userI
       type: 'delete', // Explicitly set type to delete
       commentIdToDelete,
       commentText: '', // Not needed for delete, send empty or null
-      temporaryClientId: `delete-${commentIdToDelete}-${Date.now()}` // Unique identifier for this delete request
+      temporaryClientId: `delete-${commentIdToDelete}-${Date.now()}`, // Unique identifier for this delete request
+      partition: queuePartition(videoId)
     };
 
     // Permissions: Creator can manage their own delete request
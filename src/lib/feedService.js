@@ -0,0 +1,84 @@
+import { databases, appwriteConfig } from './appwriteConfig';
+import { Query } from 'appwrite';
+
+const FEED_PAGE_SIZE = 50; // Videos shown in the subscriptions feed
+const MERGE_UPLOADS_PER_CHANNEL = 20; // Latest uploads read from each merge-on-read channel
+const QUERY_VALUES_LIMIT = 100; // Appwrite accepts at most 100 values in one Query.equal
+
+// Lists documents whose $id is in `ids`, QUERY_VALUES_LIMIT ids per request
+const listByIds = async (collectionId, ids) => {
+  const documents = [];
+  for (let start = 0; start < ids.length; start += QUERY_VALUES_LIMIT) {
+    const chunk = ids.slice(start, start + QUERY_VALUES_LIMIT);
+    const response = await databases.listDocuments(
+      appwriteConfig.databaseId,
+      collectionId,
+      [Query.equal('$id', chunk), Query.limit(chunk.length)]
+    );
+    documents.push(...response.documents);
+  }
+  return documents;
+};
+
+/**
+ * Returns the ID of a video's creator, who holds the delete permission on the video document.
+ * @param {object} videoDoc - A videos document.
+ * @returns {string|null}
+ */
+export const creatorIdOf = (videoDoc) => {
+  for (const perm of videoDoc.$permissions || []) {
+    const match = perm.match(/^delete\("user:(.+)"\)$/);
+    if (match) return match[1];
+  }
+  return videoDoc.creatorId || null;
+};
+
+/**
+ * Builds a user's subscriptions feed.
+ * The feed-fanout function pushes new uploads into the user's subscription_feeds document, except for
+ * channels with more than FANOUT_MAX_SUBSCRIBERS subscribers: those have `mergeOnRead` set on their
+ * channel_stats document, and their latest uploads are merged in here from accounts.videosUploaded.
+ *
+ * @param {string} userId - The ID of the signed-in user.
+ * @param {string[]} channelIds - The IDs of the channels the user subscribes to.
+ * @returns {Promise<Array<object>>} - Video documents, newest first, at most FEED_PAGE_SIZE.
+ * @throws {Error} - Throws an error if reading the feed fails.
+ */
+export const fetchSubscriptionFeed = async (userId, channelIds) => {
+  if (!userId) {
+    throw new Error('User ID is required to read the subscriptions feed.');
+  }
+
+  // --- Fanned-out Video Ids ---
+  let feedVideoIds = [];
+  try {
+    const feedDoc = await databases.getDocument(
+      appwriteConfig.databaseId,
+      appwriteConfig.subscriptionFeedsCollectionId,
+      userId
+    );
+    feedVideoIds = feedDoc.videoIds || [];
+  } catch (error) {
+    if (error.code !== 404) throw error; // No feed until the first fan-out reaches the user
+  }
+
+  // --- Merge In the Latest Uploads of Merge-on-Read Channels ---
+  const followedIds = channelIds || [];
+  const statsDocs = await listByIds(appwriteConfig.channelStatsCollectionId, followedIds);
+  const mergeChannelIds = statsDocs.filter(doc => doc.mergeOnRead).map(doc => doc.$id);
+  const mergeAccounts = await listByIds(appwriteConfig.accountsCollectionId, mergeChannelIds);
+  // videosUploaded is appended to on upload, so the latest uploads are at the end
+  const mergedVideoIds = mergeAccounts.flatMap(doc => (doc.videosUploaded || []).slice(-MERGE_UPLOADS_PER_CHANNEL));
+
+  const videoIds = [...new Set([...feedVideoIds, ...mergedVideoIds])];
+  if (videoIds.length === 0) {
+    return [];
+  }
+
+  // Deleted videos are missing from the result, and unfollowed channels are filtered out
+  const followed = new Set(followedIds);
+  const videoDocs = (await listByIds(appwriteConfig.videosCollectionId, videoIds))
+    .filter(doc => followed.has(creatorIdOf(doc)));
+  videoDocs.sort((a, b) => b.$createdAt.localeCompare(a.$createdAt));
+  return videoDocs.slice(0, FEED_PAGE_SIZE);
+};
@@ -1,5 +1,6 @@
 import { databases, appwriteConfig } from './appwriteConfig';
 import { ID, Permission, Role } from 'appwrite';
+import { queuePartition } from './queuePartition';
 
 /**
  * Records a like/dislike interaction in the database.
@@ -29,6 +30,7 @@ export const toggleLikeDislike = async (videoId, action, userId) => {
     const interactionData = {
       videoId: videoId,
       type: action,
+      partition: queuePartition(videoId), // Keeps a video's interactions in order
       // DO NOT include userId attribute here
     };
 
@@ -0,0 +1,18 @@
+// Must match PARTITION_SLOTS and partition_of() in functions/shared/partitions.py
+export const PARTITION_SLOTS = 16;
+
+/**
+ * The queue partition of a key: 32-bit FNV-1a of its UTF-8 bytes, modulo PARTITION_SLOTS.
+ * Queued documents with the same key (a video, or a channel for subscriptions) share a
+ * partition, so the backend processes them in order.
+ *
+ * @param {string} key - The videoId, or the targetAccountId of a subscription.
+ * @returns {number} - The partition slot, 0 to PARTITION_SLOTS - 1.
+ */
+export const queuePartition = (key) => {
+  let hash = 0x811c9dc5;
+  for (const byte of new TextEncoder().encode(key || '')) {
+    hash = Math.imul(hash ^ byte, 0x01000193) >>> 0;
+  }
+  return hash % PARTITION_SLOTS;
+};
@@ -1,5 +1,6 @@
 import { databases, appwriteConfig } from './appwriteConfig';
 import { ID, Permission, Role } from 'appwrite';
+import { queuePartition } from './queuePartition';
 
 /**
  * Creates a subscription interaction document to request subscribe/unsubscribe.
@@ -38,7 +39,8 @@ export const createSubscriptionInteraction = async (creatorId, action, userId) =
       ID.unique(),                              // documentId
       {                                         // data
         type: action,
-        targetAccountId: creatorId
+        targetAccountId: creatorId,
+        partition: queuePartition(creatorId) // Keeps a channel's interactions in order
       },
       docPermissions                            // permissions
     );
@@ -6,7 +6,7 @@ import { Permission, Role } from 'appwrite'; // Add Permission and Role
 
 const Account = () => {
   // *** Get liked/disliked sets from context ***
-  const { user, accountDetails, likedVideoIds, dislikedVideoIds, account, refreshUserProfile, logout } = useAuth(); // Renamed updateUserProfile -> refreshUserProfile in context
+  const { user, accountDetails, account, refreshUserProfile, logout } = useAuth(); // Renamed updateUserProfile -> refreshUserProfile in context
   const [name, setName] = useState('');
   const [bio, setBio] = useState(''); // Renamed from description to bio
   const [profileImageUrl, setProfileImageUrl] = useState('');
@@ -52,9 +52,7 @@ const Account = () => {
           name: name, // Always include the current name state
           bio: bio,
           profileImageUrl: profileImageUrl,
-          // --- Use Sets from context for like/dislike arrays ---
-          videosLiked: Array.from(likedVideoIds),    // Use Set from context
-          videosDisliked: Array.from(dislikedVideoIds), // Use Set from context
+          // *** DO NOT include videosLiked/videosDisliked: liked-videos-projector is their only writer ***
           // *** DO NOT include videosUploaded or watchLaterVideos here for UPDATE ***
           // *** DO NOT include videosUploaded here ***
         };
@@ -77,6 +75,8 @@ const Account = () => {
                 user.$id, // Use user's ID as document ID
                 { // *** When creating, include videosUploaded explicitly ***
                   ...accountDataPayload,
+                  videosLiked: [], // Filled by liked-videos-projector
+                  videosDisliked: [],
                   videosUploaded: [], // Initialize empty array
                   watchLaterVideos: [] // Initialize watch later empty array
                 },
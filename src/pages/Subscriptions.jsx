@@ -1,14 +1,17 @@
 import React, { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
 import { useAuth } from '../context/AuthContext';
-import { databases, avatars, appwriteConfig } from '../lib/appwriteConfig';
+import { databases, storage, avatars, appwriteConfig } from '../lib/appwriteConfig';
 import { Query } from 'appwrite';
 import ChannelCard from '../components/ChannelCard'; // Import the new component
+import VideoCard from '../components/VideoCard';
+import { fetchSubscriptionFeed, creatorIdOf } from '../lib/feedService';
 import '../App.css'; // Use shared styles
 
 const Subscriptions = () => {
   const { user: currentUser, loading: authLoading, accountDetails } = useAuth();
   const [subscribedChannels, setSubscribedChannels] = useState([]);
+  const [latestVideos, setLatestVideos] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
 
@@ -21,6 +24,7 @@ const Subscriptions = () => {
       if (!currentUser || !accountDetails) {
         setLoading(false);
         setSubscribedChannels([]);
+        setLatestVideos([]);
         return; // Handled by ProtectedRoute, but good to double check
       }
 
@@ -29,6 +33,7 @@ const Subscriptions = () => {
 
       if (channelIds.length === 0) {
         setSubscribedChannels([]);
+        setLatestVideos([]);
         setLoading(false);
         return; // No subscriptions
       }
@@ -80,6 +85,50 @@ const Subscriptions = () => {
 
         setSubscribedChannels(channels);
 
+        // --- Latest Videos From the Subscriptions Feed ---
+        const feedDocs = await fetchSubscriptionFeed(currentUser.$id, channelIds);
+        const channelsById = new Map(channels.map(channel => [channel.id, channel]));
+        let viewCountsMap = new Map();
+        if (feedDocs.length > 0) {
+          const countsResponse = await databases.listDocuments(
+            appwriteConfig.databaseId,
+            appwriteConfig.videoCountsCollectionId,
+            [
+              Query.equal('$id', feedDocs.map(doc => doc.$id)),
+              Query.limit(feedDocs.length)
+            ]
+          );
+          viewCountsMap = new Map(countsResponse.documents.map(doc => [doc.$id, doc.viewCount || 0]));
+        }
+        setLatestVideos(feedDocs.map(doc => {
+          const creatorId = creatorIdOf(doc);
+          const channel = channelsById.get(creatorId);
+          let thumbnailUrl = 'https://via.placeholder.com/320x180?text=No+Thumb';
+          if (doc.thumbnail_id) {
+            try {
+              thumbnailUrl = storage.getFilePreview(
+                appwriteConfig.storageVideosBucketId,
+                doc.thumbnail_id
+              ).href;
+            } catch {}
+          }
+          return {
+            id: doc.$id,
+            title: doc.title || 'Untitled Video',
+            thumbnailUrl: thumbnailUrl,
+            durationSeconds: doc.video_duration || 0,
+            viewCount: viewCountsMap.get(doc.$id) || 0,
+            uploadedAt: doc.$createdAt,
+            channel: {
+              id: creatorId,
+              name: channel?.name || 'Unknown Channel',
+              profileImageUrl: channel?.profileImageUrl || avatars.getInitials(creatorId || '?').href,
+              bio: channel?.bio || '',
+              creatorUserId: creatorId
+            }
+          };
+        }));
+
       } catch (err) {
         console.error('Failed to fetch subscribed channels:', err);
         setError('Could not load your subscriptions. Please try again later.');
@@ -129,11 +178,24 @@ const Subscriptions = () => {
       {subscribedChannels.length === 0 ? (
         <p>You haven't subscribed to any channels yet.</p>
       ) : (
-        <div className="channels-list">
-          {subscribedChannels.map((channel) => (
-            <ChannelCard key={channel.id} channel={channel} />
-          ))}
-        </div>
+        <>
+          <h2>Latest videos</h2>
+          {latestVideos.length === 0 ? (
+            <p>No new videos from your subscriptions yet.</p>
+          ) : (
+            <div className="videos-grid">
+              {latestVideos.map((video) => (
+                <VideoCard key={video.id} video={video} />
+              ))}
+            </div>
+          )}
+          <h2>Channels</h2>
+          <div className="channels-list">
+            {subscribedChannels.map((channel) => (
+              <ChannelCard key={channel.id} channel={channel} />
+            ))}
+          </div>
+        </>
       )}
 
       {/* Add simple styling */}
@@ -146,6 +208,9 @@ const Subscriptions = () => {
         .subscriptions-container h1 {
           margin-bottom: 24px;
         }
+        .subscriptions-container h2 {
+          margin: 24px 0 16px;
+        }
         .subscriptions-container p {
           color: var(--text-secondary);
         }
@@ -51,7 +51,7 @@ const formatTimeAgo = (dateString) => {
 
 const VideoDetail = () => {
   const { id: videoId } = useParams(); // Get video ID from URL parameter
-  const { user: currentUser, accountDetails, loading: authLoading, likedVideoIds, dislikedVideoIds, watchLaterVideoIds, updateClientVideoStates, updateAccountLikeDislikeArrays, refreshUserProfile, toggleWatchLater } = useAuth(); // Add watchLaterVideoIds, toggleWatchLater
+  const { user: currentUser, accountDetails, loading: authLoading, likedVideoIds, dislikedVideoIds, watchLaterVideoIds, updateClientVideoStates, refreshUserProfile, toggleWatchLater } = useAuth(); // Add watchLaterVideoIds, toggleWatchLater
   const navigate = useNavigate(); // For redirecting to sign-in
 
   const [video, setVideo] = useState(null);
@@ -114,8 +114,8 @@ const VideoDetail = () => {
     // 1. Update AuthContext client state sets IMMEDIATELY
     updateClientVideoStates(videoId, action); // Use the existing function for Sets
 
-    // --- ADDED STEP: Update the account document arrays asynchronously ---
-    updateAccountLikeDislikeArrays(videoId, action); // Call the new function, no need to await
+    // accounts.videosLiked/videosDisliked are rebuilt from the recorded interaction by the
+    // liked-videos-projector function, their only writer
 
     // 2. Optimistically update LOCAL counts for UI feedback
     // Use the status *before* the update to calculate the change
@@ -157,7 +157,7 @@ const VideoDetail = () => {
       setIsLiking(false);
     }
 // Add dependencies for the new context values used
-}, [currentUser, videoId, isLiking, likeCount, dislikeCount, likedVideoIds, dislikedVideoIds, navigate, updateClientVideoStates, updateAccountLikeDislikeArrays, setIsLiking, setLikeError, setLikeCount, setDislikeCount]);
+}, [currentUser, videoId, isLiking, likeCount, dislikeCount, likedVideoIds, dislikedVideoIds, navigate, updateClientVideoStates, setIsLiking, setLikeError, setLikeCount, setDislikeCount]);
 
   // Video deletion handler
   const handleDeleteVideo = async () => {